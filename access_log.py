@@ -0,0 +1,149 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Access log of the server: one record per request,
+written to the log by a background thread.
+
+Successful requests are sampled; errors are always counted
+but logged at most once per error interval.
+The last requests are kept in a ring buffer that can be dumped on demand.
+
+"""
+
+import collections
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+
+ACCESS_FORMAT = "%s req_id=%s type=%s status=%s time_ms=%.3f"
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+  """
+  QueueHandler that leaves formatting to the listener thread
+  (the arguments of the access records are immutable)
+  and drops records when the queue is full
+  """
+
+  def __init__(self, queue):
+    super().__init__(queue)
+    self.dropped = 0
+
+  def prepare(self, record):
+    return record
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+
+class AccessLog(object):
+
+  def __init__(self, handler, sample_rate=1.0, error_interval=1.0, ring_size=1000, queue_size=10000):
+    """
+    :param handler: handler that writes the records (used by the background thread)
+    :param sample_rate: fraction of successful requests that are logged
+    :param error_interval: minimum number of seconds between logged errors
+    :param ring_size: number of the last requests kept for dump()
+    :param queue_size: maximum number of records waiting for the background thread
+    """
+    self.handler = handler
+    self.sample_rate = sample_rate
+    self.error_interval = error_interval
+    self.ring = collections.deque(maxlen=ring_size)
+    self.queue_handler = DeferredQueueHandler(queue.Queue(queue_size))
+    self.logger = logging.getLogger("access")
+    self.logger.propagate = False
+    self.logger.setLevel(logging.INFO)
+    self.logger.addHandler(self.queue_handler)
+    self.lock = threading.Lock()
+    self.last_error = 0.0
+    self.suppressed_errors = 0
+    self.listener = None
+    self.pid = None
+
+  def start(self):
+    """
+    Starts the background thread (again in a forked process, where the parent's thread does not exist).
+    Called automatically by record().
+    """
+    with self.lock:
+      if self.pid == os.getpid():
+        return
+      if self.pid is not None:
+        # forked: the requests in the ring were received by the parent
+        self.ring.clear()
+      self.listener = logging.handlers.QueueListener(self.queue_handler.queue, self.handler)
+      self.listener.start()
+      self.pid = os.getpid()
+
+  def stop(self):
+    """ writes the waiting records and stops the background thread """
+    with self.lock:
+      if self.listener is not None and self.pid == os.getpid():
+        self.listener.stop()
+      self.listener = None
+      self.pid = None
+
+  def record(self, client, req_id, req_type, status, elapsed):
+    """
+    Records a served request
+    :param elapsed: time spent on the request (in seconds)
+    """
+    if self.pid != os.getpid():
+      self.start()
+    entry = (time.time(), client, req_id, req_type, status, elapsed * 1e3)
+    self.ring.append(entry)
+    if status == "error":
+      now = entry[0]
+      if now - self.last_error < self.error_interval:
+        self.suppressed_errors += 1
+        return
+      self.last_error = now
+      if self.suppressed_errors:
+        self.logger.warning("%d errors not logged", self.suppressed_errors)
+        self.suppressed_errors = 0
+      self.logger.error(ACCESS_FORMAT, *entry[1:])
+    elif self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+      self.logger.info(ACCESS_FORMAT, *entry[1:])
+
+  def last(self, count=None):
+    """ returns the last requests (at most count) as dictionaries, oldest first """
+    entries = list(self.ring)
+    if count is not None:
+      entries = entries[-count:] if count > 0 else []
+    return [dict(zip(("time", "client", "req_id", "type", "status", "time_ms"), entry)) for entry in entries]
+
+  def dump(self):
+    """ writes the requests in the ring buffer to the log """
+    entries = list(self.ring)
+    self.logger.warning("dump of the last %d requests (%d records dropped)", len(entries), self.queue_handler.dropped)
+    for entry in entries:
+      self.logger.warning("%.6f " + ACCESS_FORMAT, *entry)
@@ -0,0 +1,103 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Admission control of the server: requests are handled in lanes by their type.
+A lane may bound the number of requests handled at the same time
+and the number of admitted requests waiting for their turn;
+requests beyond that are rejected immediately (the server responds "busy"),
+so expensive requests cannot hold up the other lanes.
+
+"""
+
+import threading
+
+
+class Lane(object):
+
+  def __init__(self, name, max_running=0, max_waiting=0):
+    """
+    :param max_running: maximum number of requests handled at the same time (0 for unlimited)
+    :param max_waiting: maximum number of admitted requests waiting for their turn
+    """
+    self.name = name
+    self.max_running = max_running
+    self.capacity = max_running + max_waiting if max_running else 0
+    self.slots = threading.BoundedSemaphore(max_running) if max_running else None
+    self.lock = threading.Lock()
+    self.admitted = 0  # currently admitted (running or waiting)
+    self.total = 0
+    self.rejected = 0
+
+  def admit(self):
+    """
+    Returns whether the request is admitted (does not block).
+    An admitted request must be handled with run().
+    """
+    with self.lock:
+      if self.capacity and self.admitted >= self.capacity:
+        self.rejected += 1
+        return False
+      self.admitted += 1
+      self.total += 1
+      return True
+
+  def run(self, fn, *args):
+    """ handles an admitted request: waits for a free slot and returns fn(*args) """
+    try:
+      if self.slots is None:
+        return fn(*args)
+      with self.slots:
+        return fn(*args)
+    finally:
+      with self.lock:
+        self.admitted -= 1
+
+  def stats(self):
+    with self.lock:
+      return {"admitted": self.admitted, "total": self.total, "rejected": self.rejected,
+              "max_running": self.max_running, "capacity": self.capacity}
+
+
+class AdmissionControl(object):
+
+  def __init__(self, lanes, default_lane="default"):
+    """
+    :param lanes: {lane name: {"types": [request type, ...], "max_running": int, "max_waiting": int}}
+    :param default_lane: name of the (unlimited) lane of the requests of other types
+    """
+    self.lanes = {default_lane: Lane(default_lane)}
+    self.lane_of_type = {}
+    for name, params in lanes.items():
+      self.lanes[name] = Lane(name, params.get("max_running", 0), params.get("max_waiting", 0))
+      for req_type in params.get("types", []):
+        self.lane_of_type[req_type] = self.lanes[name]
+    self.default_lane = self.lanes[default_lane]
+
+  def lane(self, req_type):
+    if not isinstance(req_type, str):
+      return self.default_lane
+    return self.lane_of_type.get(req_type, self.default_lane)
+
+  def stats(self):
+    return {name: lane.stats() for name, lane in self.lanes.items()}
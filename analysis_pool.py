@@ -0,0 +1,170 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Pool of worker threads that run analyses of jobs (analyze_job) for the server
+
+Each worker reuses its own data source.
+The requests are identified by handles; the results are kept for some time,
+so repeated requests for the same job are answered from memory.
+
+"""
+
+import collections
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+
+class BusyError(Exception):
+  pass
+
+
+class AnalysisEntry(object):
+  """ a submitted analysis and (when done) its result """
+
+  def __init__(self, handle, key):
+    self.handle = handle
+    self.key = key
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+    self.finished = None
+
+
+class AnalysisPool(object):
+
+  def __init__(self, analyze, make_datasource, n_workers, max_pending, ttl, max_results):
+    """
+    :param analyze: function (datasource, key) -> result
+    :param make_datasource: function that creates a configured data source (called once per worker)
+    :param n_workers: number of worker threads
+    :param max_pending: maximum number of analyses waiting for a worker
+    :param ttl: seconds for which the results are kept
+    :param max_results: maximum number of kept results
+    """
+    self.analyze = analyze
+    self.make_datasource = make_datasource
+    self.n_workers = n_workers
+    self.ttl = ttl
+    self.max_results = max_results
+    self.queue = queue.Queue(max_pending)
+    self.lock = threading.Lock()
+    self.entries = collections.OrderedDict()  # handle -> AnalysisEntry, oldest first
+    self.by_key = {}  # key -> handle of the latest entry
+    self.counter = itertools.count(1)
+    self.pid = None
+    self.hits = 0
+    self.misses = 0
+    self.log = logging.getLogger("analysis_pool")
+
+  def start(self):
+    """
+    Starts the worker threads (again in a forked process, where the parent's threads do not exist).
+    Called automatically by submit().
+    """
+    with self.lock:
+      if self.pid == os.getpid():
+        return
+      self.pid = os.getpid()
+      self.entries.clear()
+      self.by_key.clear()
+      self.queue = queue.Queue(self.queue.maxsize)
+      for _ in range(self.n_workers):
+        th = threading.Thread(target=self.worker, args=(self.queue,))
+        th.daemon = True
+        th.start()
+
+  def worker(self, jobs):
+    datasource = None
+    while True:
+      entry = jobs.get()
+      try:
+        if datasource is None:
+          datasource = self.make_datasource()
+        entry.result = self.analyze(datasource, entry.key)
+      except Exception as e:
+        self.log.exception("analysis of %s failed", str(entry.key))
+        entry.error = "Exception: {}".format(e)
+        # the data source may be in a bad state
+        datasource = None
+      entry.finished = time.time()
+      entry.done.set()
+
+  def expire(self, now):
+    """ drops expired results, and the oldest ones over max_results (must be called with the lock held) """
+    excess = len(self.entries) - self.max_results
+    # the pending analyses are kept (they may take long; the number of them is bounded by the queue)
+    for handle, entry in list(self.entries.items()):
+      if not entry.done.is_set():
+        continue
+      if entry.finished + self.ttl > now and excess <= 0:
+        continue
+      del self.entries[handle]
+      excess -= 1
+      if self.by_key.get(entry.key) == handle:
+        del self.by_key[entry.key]
+
+  def submit(self, key):
+    """
+    Returns the entry of the analysis of key: a kept or pending one if there is one, a new one otherwise.
+    Raises BusyError if too many analyses are waiting for a worker.
+    """
+    if self.pid != os.getpid():
+      self.start()
+    with self.lock:
+      now = time.time()
+      self.expire(now)
+      handle = self.by_key.get(key)
+      # failed analyses are not kept
+      if handle is not None and self.entries[handle].error is None:
+        self.hits += 1
+        return self.entries[handle]
+      entry = AnalysisEntry("{}-{}".format(self.pid, next(self.counter)), key)
+      try:
+        self.queue.put_nowait(entry)
+      except queue.Full:
+        raise BusyError("too many pending analyses")
+      self.misses += 1
+      self.entries[entry.handle] = entry
+      self.by_key[key] = entry.handle
+      return entry
+
+  def get(self, handle, timeout=0):
+    """
+    Returns the entry of the handle (waiting up to timeout seconds for the result)
+    or None if the handle is unknown or its result has expired
+    """
+    with self.lock:
+      self.expire(time.time())
+      entry = self.entries.get(handle)
+    if entry is not None and timeout:
+      entry.done.wait(timeout)
+    return entry
+
+  def stats(self):
+    with self.lock:
+      return {"kept": len(self.entries), "pending": self.queue.qsize(), "hits": self.hits, "misses": self.misses}
@@ -26,7 +26,15 @@
 Created by Alexander Goponenko at 4/7/2022
 
 '''
+import collections
+import ctypes
+import heapq
+import itertools
+import logging
+import os
 import queue
+import select
+import threading
 from simple_fsqueue import SimpleFSQueue as FSQueue
 import time
 
@@ -35,50 +43,299 @@ import message
 
 
 class CombinedQueue(object):
+    """
+    Queue of messages ordered by their due time (`message.time`).
+    `get` blocks until the earliest message is due; it wakes up when that time comes
+    or when a message is put.
+    If `watched_path` is given, the messages of the file system queue are kept in their files
+    until `get` returns them (so they are not lost if the server stops before they are due);
+    a feeder thread keeps the index of their due times and reads the directory only when it has changed
+    (see DirectoryWatch).
 
-    def __init__(self, watched_path=None):
-        self.inner_queue = queue.Queue(0)
+    The queue keeps an index of the jobs that are pending (queued or being processed)
+    and of the jobs completed within `completed_ttl` seconds (at most `max_completed` of them);
+    a message for a job from the index is a duplicate and is dropped
+    (its job_start, job_end and job_nodes fill in the missing ones of the queued message).
+    A message that was taken with `get` is pending until `done` is called for it;
+    it can be put again (e.g., to be retried later) before that.
+    """
+
+    def __init__(self, watched_path=None, poll_interval=1.0, completed_ttl=3600, max_completed=10000):
+        self.cond = threading.Condition()
+        self.heap = []  # (due time, sequence number, message)
+        self.counter = itertools.count()
+        self.pending = {}  # job_id -> message
+        self.queued = set()  # job_ids of the messages in the heap
+        self.completed = collections.OrderedDict()  # job_id -> completion time (the oldest first)
+        self.completed_ttl = completed_ttl
+        self.max_completed = max_completed
+        self.duplicates = 0
         self.file_queue = FSQueue(watched_path) if watched_path else None
-        self.file_item = None
-        self.inner_item = None
+        self.file_heap = []  # (due time, file) of the messages in the file queue
+        self.file_items = {}  # file -> due time (the files of file_heap that were not taken or removed)
+        self.unreadable = set()  # files of the file queue that are not messages
+        self.watched_path = watched_path
+        self.poll_interval = poll_interval
+        self.feeder = None
+        self.watch = None
+        self.stopped = threading.Event()
+
+
+    def start(self):
+        """ starts the feeder thread (if there is a file queue and it was not started yet) """
+        with self.cond:
+            if self.file_queue is None or self.feeder is not None or self.stopped.is_set():
+                return
+            # the directory is watched before it is read, so that no change is missed
+            self.watch = DirectoryWatch(self.watched_path, self.poll_interval)
+            self.feeder = threading.Thread(target=self.feed, name="file_queue_feeder")
+            self.feeder.daemon = True
+            self.feeder.start()
+
+
+    def close(self):
+        """ stops the feeder thread (and waits for it) """
+        self.stopped.set()
+        with self.cond:
+            feeder = self.feeder
+            if self.watch is not None:
+                self.watch.stop()
+        if feeder is not None and feeder is not threading.current_thread():
+            feeder.join()
+
+
+    def feed(self):
+        log = logging.getLogger("job_util")
+        try:
+            while not self.watch.stopped.is_set():
+                try:
+                    self.scan_file_queue()
+                except Exception:
+                    log.exception("could not read the file queue %s", str(self.watched_path))
+                self.watch.wait()
+        finally:
+            self.watch.close()
+
+
+    def scan_file_queue(self):
+        """ updates the index of the file queue (reads the due times of the new files) """
+        log = logging.getLogger("job_util")
+        files = set(self.file_queue.files())
+        with self.cond:
+            known = set(self.file_items) | self.unreadable
+        new_items = []
+        for f in files - known:
+            try:
+                new_items.append((self.file_queue.read(f).time, f))
+            except FileNotFoundError:
+                pass  # taken by another reader
+            except Exception:
+                log.exception("could not read the message %s of the file queue", str(f))
+                self.unreadable.add(f)
+        with self.cond:
+            for f in set(self.file_items) - files:
+                del self.file_items[f]
+            self.unreadable &= files
+            for due, f in new_items:
+                self.file_items[f] = due
+                heapq.heappush(self.file_heap, (due, f))
+            if new_items:
+                self.cond.notify()
+
+
+    def next_file_due(self):
+        """ returns the due time of the earliest message of the file queue (or None); must hold the lock """
+        while self.file_heap and self.file_items.get(self.file_heap[0][1]) != self.file_heap[0][0]:
+            heapq.heappop(self.file_heap)
+        return self.file_heap[0][0] if self.file_heap else None
+
+
+    def take_file_item(self):
+        """ takes the earliest message of the file queue (None if it is gone or a duplicate); must hold the lock """
+        f = heapq.heappop(self.file_heap)[1]
+        del self.file_items[f]
+        try:
+            item = self.file_queue.take(f)
+        except FileNotFoundError:
+            return None  # taken by another reader
+        except Exception:
+            logging.getLogger("job_util").exception("could not read the message %s of the file queue", str(f))
+            return None
+        if self.is_duplicate(item):
+            self.duplicates += 1
+            return None
+        self.pending[item.job_id] = item
+        return item
 
 
     def empty(self) -> bool:
-        if self.inner_item or self.file_item:
-            return False
-        if not self.inner_queue.empty():
-            return False
-        elif self.file_queue is None:
-            return False
-        else:
-            return self.file_queue.empty()
-
-
-    def put(self, item) -> None:
-        self.inner_queue.put(item)
-
-
-    def get(self):
-        if self.inner_item is None and not self.inner_queue.empty():
-            self.inner_item = self.inner_queue.get()
-        if self.file_item is None and self.file_queue and not self.file_queue.empty():
-            self.file_item = self.file_queue.get()
-        if self.file_item:
-            if self.inner_item and self.inner_item.time <= self.file_item.time:
-                item = self.inner_item
-                self.inner_item = None
-                return item
-            else:
-                item = self.file_item
-                self.file_item = None
-                return item
-        elif self.inner_item:
-            item = self.inner_item
-            self.inner_item = None
-            return item
+        with self.cond:
+            return not self.heap and not self.file_items
+
+
+    def qsize(self) -> int:
+        with self.cond:
+            return len(self.heap) + len(self.file_items)
+
+
+    def put(self, item) -> bool:
+        """ :return: False if the item is a duplicate (and was dropped) """
+        with self.cond:
+            if self.is_duplicate(item):
+                self.duplicates += 1
+                return False
+            self.pending[item.job_id] = item
+            self.queued.add(item.job_id)
+            heapq.heappush(self.heap, (item.time, next(self.counter), item))
+            # the new item may be due before the one `get` waits for
+            self.cond.notify()
+            return True
+
+
+    def is_duplicate(self, item):
+        """ checks the index (and merges the item into the pending message); must hold the lock """
+        pending = self.pending.get(item.job_id)
+        if pending is not None:
+            if pending is item:
+                return item.job_id in self.queued
+            if item.job_id in self.queued:
+                for field in ('job_start', 'job_end', 'job_nodes'):
+                    if getattr(pending, field) is None:
+                        setattr(pending, field, getattr(item, field))
+            return True
+        self.expire_completed()
+        return item.job_id in self.completed
+
+
+    def expire_completed(self):
+        oldest = time.time() - self.completed_ttl
+        while self.completed and (len(self.completed) > self.max_completed
+                                  or next(iter(self.completed.values())) < oldest):
+            self.completed.popitem(last=False)
+
+
+    def done(self, item) -> None:
+        """ marks the processing of the item (taken with `get`) finished, unless it was put again """
+        with self.cond:
+            if item.job_id in self.queued or self.pending.get(item.job_id) is not item:
+                return
+            del self.pending[item.job_id]
+            self.completed[item.job_id] = time.time()
+            self.completed.move_to_end(item.job_id)
+            self.expire_completed()
+
+
+    def stats(self):
+        with self.cond:
+            return {"queued": len(self.heap) + len(self.file_items), "pending": len(self.pending),
+                    "completed": len(self.completed), "duplicates": self.duplicates}
+
+
+    def get(self, timeout=None):
+        """
+        waits until the earliest message is due and returns it
+        :raise queue.Empty: if no message became due within `timeout` seconds
+        """
+        self.start()
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while True:
+                now = time.time()
+                file_due = self.next_file_due()
+                if self.heap and self.heap[0][0] <= now and (file_due is None or self.heap[0][0] <= file_due):
+                    item = heapq.heappop(self.heap)[2]
+                    self.queued.discard(item.job_id)
+                    return item
+                if file_due is not None and file_due <= now:
+                    item = self.take_file_item()
+                    if item is not None:
+                        return item
+                    continue
+                dues = [t for t in (self.heap[0][0] if self.heap else None, file_due) if t is not None]
+                wait = min(dues) - now if dues else None
+                if deadline is not None:
+                    if now >= deadline:
+                        raise queue.Empty()
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.cond.wait(wait)
+
+
+
+# inotify events of the entries of a directory (see inotify(7))
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_DELETE = 0x200
+
+
+class DirectoryWatch(object):
+    """
+    Waits for changes of the entries of a directory:
+    with inotify where it is available (Linux), otherwise by checking the modification time
+    of the directory every `poll_interval` seconds
+    """
+
+    def __init__(self, path, poll_interval=1.0):
+        self.path = str(path)
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()  # for the descriptors
+        self.fd = inotify_watch(self.path)
+        if self.fd is not None:
+            self.wakeup = os.pipe()
         else:
-            return self.inner_queue.get()
+            self.wakeup = None
+            self.last_mtime = os.stat(self.path).st_mtime_ns
+
+
+    def wait(self):
+        """ returns when the directory may have changed or `stop` was called """
+        if self.fd is not None:
+            ready = select.select([self.fd, self.wakeup[0]], [], [])[0]
+            if self.fd in ready:
+                try:
+                    while os.read(self.fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            return
+        while not self.stopped.wait(self.poll_interval):
+            mtime = os.stat(self.path).st_mtime_ns
+            # the directory may change again within the granularity of its modification time
+            if mtime != self.last_mtime or time.time() - mtime / 1e9 < 2 * self.poll_interval:
+                self.last_mtime = mtime
+                return
+
+
+    def stop(self):
+        """ wakes up `wait` (for good) """
+        with self.lock:
+            if self.fd is not None and not self.stopped.is_set():
+                os.write(self.wakeup[1], b"x")
+            self.stopped.set()
+
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                for fd in self.wakeup:
+                    os.close(fd)
+                self.fd = None
+
 
+def inotify_watch(path):
+    """ returns a non-blocking inotify descriptor that watches the entries of the directory (None if inotify is not available) """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(path), IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE) < 0:
+        os.close(fd)
+        return None
+    return fd
 
 
 def external_put(path, job_id, variety_id, delay):
@@ -28,23 +28,53 @@ import numpy as np
 # from pysimserv3 import conf
 
 
-class DeltaParameter:
+def _grid_crossings(grid, timestamps, caller):
+  """ finds the point ends crossed by the new records of the current node
+  :param grid: MultiDeltaParameter
+  :param timestamps: increasing timestamps of the new records (float array)
+  :return: (the new current point, indices of the records that cross the point ends,
+            times of the point ends, times between the crossing records and the records before them)
+  """
+  points = np.maximum(0, np.floor((timestamps - grid.start) / grid.step)).astype(int)
+  assert points[0] >= grid.cur_point and np.all(np.diff(points) >= 0)
+  if timestamps[-1] > grid.end:
+    grid.log.warning("%s; timestamp (%f) is over the end time (%f)",
+                     caller, timestamps[-1], grid.end)
+  points = np.minimum(points, grid.n_points - 1)
+  new_point = points[-1]
+  ends = np.arange(grid.cur_point, new_point)
+  # the record after each crossed point end
+  idx = np.searchsorted(points, ends + 1, side='left')
+  prev_times = np.concatenate(([grid.last_time], timestamps[:-1]))
+  delta_time = timestamps[idx] - prev_times[idx]
+  assert np.all(delta_time > 0)
+  pe_time = grid.start + (ends + 1) * grid.step
+  return new_point, idx, pe_time, delta_time
+
+
+class MultiDeltaParameter:
   """
   Discretize data, calculate total profile,
-  then calculate average and variance of the total profile
+  then calculate average and variance of the total profile.
+  Several metrics of the same records are gridded at once;
+  the profile is 2-D: (number of metrics, number of points)
 
   NOTE:
   "timestamp" which methods require must be a number, not a datatime64 or such
   """
 
-  def __init__(self, start, end, step, log=None, nodeLog=None, nodeLogPrefill=tuple()):
+  def __init__(self, start, end, step, n_metrics, log=None, nodeLog=None, nodeLogPrefill=tuple(),
+               profile_sink=None):
     """
     :param start: min grid time
     :param end: max gird time
     :param step: grid step
+    :param n_metrics: number of metrics (the values passed to the methods are arrays of this length)
     :param log: logger for messages (from logging)
     :param nodeLog: logger for node for analysis (outputs to csv)
     :param nodeLogPrefill: tuple of values to be prepended to the nodeLog line
+    :param profile_sink: function (first_point, rates) that takes the rates of the points
+                         instead of the profile of this object (see add_to_profile)
     """
     assert start < end
     assert step > 0
@@ -52,23 +82,23 @@ class DeltaParameter:
     self.start = start
     self.step = (end - start) / self.n_points
     self.end = end
-    self.t_profile = np.zeros(self.n_points)
-    self.total = 0
+    self.profile_sink = profile_sink
+    self.t_profile = np.zeros((n_metrics, self.n_points)) if profile_sink is None else None
+    self.total = np.zeros(n_metrics)
     if log:
       self.log = log
     else:
       self.log = logging.getLogger("DeltaParameter")
-      self.log.setLevel(logging.DEBUG)
     self.nodeLog = nodeLog
     self.nodeLogPrefill = nodeLogPrefill
-    log.debug("DeltaParameter; start: %s, end: %s, step: %s, n_points: %d",
-              str(start), str(end), str(self.step), self.n_points)
+    self.log.debug("MultiDeltaParameter; start: %s, end: %s, step: %s, n_points: %d, n_metrics: %d",
+                   str(start), str(end), str(self.step), self.n_points, n_metrics)
 
 
-  def init_node(self, timestamp, value, node_name):
+  def init_node(self, timestamp, values, node_name):
     """ starts a new node of the analysis
     :param timestamp: time of the first point
-    :param value: value of the first point
+    :param values: values of the metrics at the first point
     :param node_name: name of the node (for logging)
     """
     self.node_name = node_name
@@ -80,18 +110,19 @@ class DeltaParameter:
     elif self.cur_point >= self.n_points:
       if timestamp > self.end:
         self.log.warning("init_node; timestamp (%f) is over the end time (%f)",
-                       timestamp, self.end)
+                         timestamp, self.end)
       self.cur_point = self.n_points - 1
+    values = np.array(values, dtype=float)
     # 'ps' is "point start"
-    self.ps_val = value
-    self.point_roll_over = 0
+    self.ps_val = values
+    self.point_roll_over = np.zeros_like(values)
     # 'ns' is "node start"
     self.ns_time = timestamp
-    self.ns_val = value
-    self.node_roll_over = 0
+    self.ns_val = values
+    self.node_roll_over = np.zeros_like(values)
     self.last_time = timestamp
-    self.last_val = value
-    self.log.debug("init node %s; time: %s value: %f", str(node_name), str(timestamp), value)
+    self.last_val = values
+    self.log.debug("init node %s; time: %s values: %s", node_name, timestamp, values)
 
 
   def finish_node(self):
@@ -101,66 +132,247 @@ class DeltaParameter:
       self.log.warning("node %s start time and end time are equal when finishing a node", str(self.node_name))
       return
 
-    pd_val = self.last_val + self.point_roll_over - self.ps_val
-    point_rate = pd_val / self.step
-    self.log.debug("finish node %s; point: %d, adding: %f", str(self.node_name), self.cur_point, point_rate)
-    self.t_profile[self.cur_point] += point_rate
+    self.add_to_profile(self.cur_point, ((self.last_val + self.point_roll_over - self.ps_val) / self.step)[:, None])
 
-    node_time = (self.last_time - self.ns_time)  # / np.timedelta64(1, 's')
+    node_time = self.last_time - self.ns_time
     node_total = self.node_roll_over + self.last_val - self.ns_val
     node_avg = node_total / node_time
-    self.log.debug("finish node %s; node time: %s, node total: %f, node rate: %f",
-                    str(self.node_name), str(node_time), node_total, node_avg)
+    self.log.debug("finish node %s; node time: %s, node totals: %s, node rates: %s",
+                   self.node_name, node_time, node_total, node_avg)
     self.total += node_total
 
     if self.nodeLog:
-      nodeLogLine = []
-      nodeLogLine.extend(self.nodeLogPrefill)
-      nodeLogLine.extend([self.node_name, self.ns_time, self.last_time, node_avg])
-      self.nodeLog.log(nodeLogLine)
+      # one line per metric
+      for avg in node_avg:
+        nodeLogLine = []
+        nodeLogLine.extend(self.nodeLogPrefill)
+        nodeLogLine.extend([self.node_name, self.ns_time, self.last_time, avg])
+        self.nodeLog.log(nodeLogLine)
 
 
-  def new_node(self, timestamp, value, node_name):
+  def add_to_profile(self, first_point, rates):
+    """ adds the rates (n_metrics x number of points) to the points of the profile starting with first_point """
+    if self.profile_sink is not None:
+      self.profile_sink(first_point, rates)
+      return
+    self.t_profile[:, first_point:first_point + rates.shape[1]] += rates
+
+
+  def new_node(self, timestamp, values, node_name):
     self.finish_node()
-    self.init_node(timestamp, value, node_name)
+    self.init_node(timestamp, values, node_name)
 
 
-  def same_node(self, timestamp, value):
-    self.log.debug("same_node; time: %s, value: %f", str(timestamp), value)
-    roll_over = self.last_val if value < self.last_val else 0
+  def same_node(self, timestamp, values):
+    self.same_node_batch([timestamp], np.asarray(values, dtype=float)[:, None])
+
+
+  def same_node_batch(self, timestamps, values):
+    """ processes the next records of the current node
+    :param timestamps: increasing timestamps of the records of the current node
+    :param values: values of the records (n_metrics x len(timestamps))
+    """
+    if len(timestamps) == 0:
+      return
+    timestamps = np.asarray(timestamps, dtype=float)
+    values = np.asarray(values, dtype=float)
+    prev_values = np.concatenate((self.last_val[:, None], values[:, :-1]), axis=1)
+    roll_overs = np.where(values < prev_values, prev_values, 0)
     # ^ we man loose some due to overflow, but reset is more likely and we should not risk it
-    self.point_roll_over += roll_over
-    self.node_roll_over += roll_over
-    new_point = max(0, math.floor((timestamp - self.start) / self.step))
-    assert new_point >= self.cur_point
-    if new_point >= self.n_points:
-      if timestamp > self.end:
-        self.log.warning("same_node; timestamp (%f) is over the end time (%f)",
-                       timestamp, self.end)
-      new_point = self.n_points - 1
+    cum_roll_over = np.cumsum(roll_overs, axis=1)
+
+    new_point, idx, pe_time, delta_time = _grid_crossings(self, timestamps, "same_node_batch")
+
     if new_point > self.cur_point:
-      # we have to finish the point and advance
-      delta_value = value + roll_over - self.last_val
-      delta_time = (timestamp - self.last_time)  # / np.timedelta64(1, 's')
-      assert delta_time > 0
-      while self.cur_point < new_point:
-        # finish cur_point and init a new
-        pe_time = self.start + (self.cur_point + 1) * self.step # point end time
-        pe_val = value - delta_value * (timestamp - pe_time) / delta_time
-        pd_val = pe_val + self.point_roll_over - self.ps_val # point delta value
-        point_rate = pd_val / self.step
-        self.log.debug("same_node; point: %d, end: (%f, %f), adding: %f", self.cur_point, pe_time, pe_val, point_rate)
-        self.t_profile[self.cur_point] += point_rate
-        self.cur_point += 1
-        self.ps_val = pe_val
-        self.point_roll_over = 0
-    assert new_point == self.cur_point
+      # finish the crossed points: interpolate the values at the point ends
+      delta_value = values[:, idx] + roll_overs[:, idx] - prev_values[:, idx]
+      pe_val = values[:, idx] - delta_value * (timestamps[idx] - pe_time) / delta_time
+      # point start values (and roll overs within the points)
+      ps_val = np.concatenate((self.ps_val[:, None], pe_val[:, :-1]), axis=1)
+      point_roll_over = np.concatenate(((self.point_roll_over + cum_roll_over[:, idx[0]])[:, None],
+                                        cum_roll_over[:, idx[1:]] - cum_roll_over[:, idx[:-1]]), axis=1)
+      self.add_to_profile(self.cur_point, (pe_val + point_roll_over - ps_val) / self.step)
+      self.cur_point = new_point
+      self.ps_val = pe_val[:, -1]
+      self.point_roll_over = cum_roll_over[:, -1] - cum_roll_over[:, idx[-1]]
+    else:
+      self.point_roll_over = self.point_roll_over + cum_roll_over[:, -1]
+    self.node_roll_over = self.node_roll_over + cum_roll_over[:, -1]
+    self.last_time = timestamps[-1]
+    self.last_val = values[:, -1]
 
-    self.last_time = timestamp
-    self.last_val = value
 
   def finish_all(self):
+    """ :return: list of (average, variance) of the total profile of each metric """
     self.finish_node()
-    avg = self.t_profile.mean()
-    var = self.t_profile.var()
-    return avg, var,  #  self.total
+    return list(zip(self.t_profile.mean(axis=1), self.t_profile.var(axis=1)))
+
+
+class DeltaParameter:
+  """
+  MultiDeltaParameter of one metric (the values are numbers and the profile is 1-D)
+  """
+
+  def __init__(self, start, end, step, log=None, nodeLog=None, nodeLogPrefill=tuple()):
+    """ see MultiDeltaParameter """
+    self.grid = MultiDeltaParameter(start, end, step, 1, log, nodeLog, nodeLogPrefill)
+
+  @property
+  def t_profile(self):
+    return self.grid.t_profile[0]
+
+  @property
+  def total(self):
+    return self.grid.total[0]
+
+
+  def init_node(self, timestamp, value, node_name):
+    self.grid.init_node(timestamp, [value], node_name)
+
+
+  def finish_node(self):
+    self.grid.finish_node()
+
+
+  def new_node(self, timestamp, value, node_name):
+    self.grid.new_node(timestamp, [value], node_name)
+
+
+  def same_node(self, timestamp, value):
+    self.grid.same_node(timestamp, [value])
+
+
+  def same_node_batch(self, timestamps, values):
+    self.grid.same_node_batch(timestamps, np.asarray(values, dtype=float)[None, :])
+
+
+  def finish_all(self):
+    return self.grid.finish_all()[0]
+
+
+class StreamingDeltaParameter:
+  """
+  The same as MultiDeltaParameter for the records of all nodes in the order of time,
+  but only the points of the profile that some node may still add to are kept:
+  a point is finished when every node is past it; the average and the variance
+  of the finished points are accumulated (with Welford's algorithm).
+
+  A node that has no records for `stall_timeout` seconds is finished
+  (its later records, if any, start a new node);
+  so the memory is proportional to the number of nodes and stall_timeout / step.
+  """
+
+  def __init__(self, start, end, step, n_metrics, stall_timeout, log=None, nodeLog=None, nodeLogPrefill=tuple()):
+    assert start < end
+    assert step > 0
+    self.n_points = max(1, round((end - start) / step))
+    self.start = start
+    self.step = (end - start) / self.n_points
+    self.end = end
+    self.stall_timeout = stall_timeout
+    self.total = np.zeros(n_metrics)
+    if log:
+      self.log = log
+    else:
+      self.log = logging.getLogger("DeltaParameter")
+    self.nodeLog = nodeLog
+    self.nodeLogPrefill = nodeLogPrefill
+    self.nodes = {}  # node_name -> MultiDeltaParameter (that adds to the profile of this object)
+    self.pending = np.zeros((n_metrics, 0))  # points from first_pending on
+    self.first_pending = 0
+    self.max_pending = 0
+    # accumulators of the finished points
+    self.n_finished = 0
+    self.mean = np.zeros(n_metrics)
+    self.m2 = np.zeros(n_metrics)
+    # statistics of the records (for the average time between records)
+    self.n_records = 0
+    self.n_nodes = 0
+    self.node_time_total = 0
+    self.log.debug("StreamingDeltaParameter; start: %s, end: %s, step: %s, n_points: %d, n_metrics: %d",
+                   str(start), str(end), str(self.step), self.n_points, n_metrics)
+
+
+  def add_to_profile(self, first_point, rates):
+    assert first_point >= self.first_pending
+    last = first_point + rates.shape[1] - self.first_pending
+    if last > self.pending.shape[1]:
+      grow = max(last - self.pending.shape[1], self.pending.shape[1])
+      self.pending = np.concatenate((self.pending, np.zeros((self.pending.shape[0], grow))), axis=1)
+    self.pending[:, first_point - self.first_pending:last] += rates
+
+
+  def add_records(self, timestamps, node_names, values):
+    """
+    processes the next records
+    :param timestamps: timestamps of the records (not less than the timestamps of the records added before)
+    :param node_names: names of the nodes of the records
+    :param values: values of the records (n_metrics x number of records)
+    """
+    if len(timestamps) == 0:
+      return
+    timestamps = np.asarray(timestamps, dtype=float)
+    values = np.asarray(values, dtype=float)
+    self.n_records += len(timestamps)
+    # the records of each node (in the order of time)
+    order = np.argsort(node_names, kind='stable')
+    node_names = np.asarray(node_names)[order]
+    run_starts = np.flatnonzero(node_names[1:] != node_names[:-1]) + 1
+    for start, end in zip(np.concatenate(([0], run_starts)), np.concatenate((run_starts, [len(order)]))):
+      records = order[start:end]
+      node_name = node_names[start]
+      node = self.nodes.get(node_name)
+      if node is None:
+        node = self.nodes[node_name] = MultiDeltaParameter(self.start, self.end, self.step, len(self.total),
+                                                           self.log, self.nodeLog, self.nodeLogPrefill,
+                                                           self.add_to_profile)
+        node.init_node(timestamps[records[0]], values[:, records[0]], node_name)
+        self.n_nodes += 1
+        records = records[1:]
+      node.same_node_batch(timestamps[records], values[:, records])
+
+    now = timestamps[-1]
+    for node_name in [name for name, node in self.nodes.items() if node.last_time < now - self.stall_timeout]:
+      self.log.debug("node %s has no records since %f, finishing it", node_name, self.nodes[node_name].last_time)
+      self.finish_node(node_name)
+    # the new nodes start at the current point or later
+    first_needed = min([math.floor((now - self.start) / self.step)]
+                       + [node.cur_point for node in self.nodes.values()])
+    self.finish_points(min(first_needed, self.n_points))
+
+
+  def finish_node(self, node_name):
+    node = self.nodes.pop(node_name)
+    node.finish_node()
+    self.total += node.total
+    self.node_time_total += node.last_time - node.ns_time
+
+
+  def finish_points(self, end_point):
+    """ accumulates the points before end_point and drops them """
+    n = end_point - self.first_pending
+    if n <= 0:
+      return
+    self.max_pending = max(self.max_pending, self.pending.shape[1])
+    points = np.zeros((self.pending.shape[0], n))
+    available = min(n, self.pending.shape[1])
+    points[:, :available] = self.pending[:, :available]
+    self.pending = self.pending[:, available:]
+    self.first_pending = end_point
+    # combine the accumulators with the mean and the variance of the points (Chan et al.)
+    mean = points.mean(axis=1)
+    m2 = ((points - mean[:, None]) ** 2).sum(axis=1)
+    total = self.n_finished + n
+    delta = mean - self.mean
+    self.mean = self.mean + delta * n / total
+    self.m2 = self.m2 + m2 + delta ** 2 * self.n_finished * n / total
+    self.n_finished = total
+
+
+  def finish_all(self):
+    """ :return: list of (average, variance) of the total profile of each metric """
+    for node_name in list(self.nodes):
+      self.finish_node(node_name)
+    self.finish_points(self.n_points)
+    self.log.debug("StreamingDeltaParameter; at most %d points were kept", self.max_pending)
+    return list(zip(self.mean, self.m2 / self.n_finished))
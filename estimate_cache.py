@@ -0,0 +1,202 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+In-memory cache of the predictions kept by sos_recorder.Recorder
+
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class EstimateCache(object):
+  """
+  Write-through LRU cache of (avg, var, w_count, w_sum) records
+  keyed by (variety_id, parameter).
+
+  Has the same getRecord/getRecords/saveRecord interface as Recorder,
+  so it can be used in place of the recorder.
+  Missing records are cached too (as None), so that unknown varieties
+  do not hit the database on every request.
+  """
+
+  def __init__(self, recorder, max_size):
+    """
+    :param recorder: the Recorder to cache
+    :param max_size: maximum number of cached records
+    """
+    assert max_size > 0
+    self.recorder = recorder
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    self.records = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def _insert(self, key, record, overwrite):
+    # NOTE: must be called with the lock held
+    if key in self.records:
+      if overwrite:
+        self.records[key] = record
+      self.records.move_to_end(key)
+      return
+    self.records[key] = record
+    if len(self.records) > self.max_size:
+      self.records.popitem(last=False)
+      self.evictions += 1
+
+  def getRecord(self, variety_id, param):
+    key = (variety_id, param)
+    with self.lock:
+      if key in self.records:
+        self.hits += 1
+        self.records.move_to_end(key)
+        return self.records[key]
+      self.misses += 1
+    record = self.recorder.getRecord(variety_id, param)
+    if record is not None:
+      record = tuple(record)
+    with self.lock:
+      # do not overwrite a record saved while we were reading the database
+      self._insert(key, record, overwrite=False)
+      return self.records[key]
+
+  def getRecords(self, keys):
+    result = {}
+    missing = []
+    with self.lock:
+      for key in keys:
+        if key in self.records:
+          self.hits += 1
+          self.records.move_to_end(key)
+          result[key] = self.records[key]
+        else:
+          self.misses += 1
+          missing.append(key)
+    if missing:
+      found = self.recorder.getRecords(missing)
+      with self.lock:
+        for key in missing:
+          record = found.get(key)
+          self._insert(key, tuple(record) if record is not None else None, overwrite=False)
+          result[key] = self.records[key]
+    return result
+
+  def saveRecord(self, variety_id, param, avg, var, w_count, w_sum):
+    self.recorder.saveRecord(variety_id, param, avg, var, w_count, w_sum)
+    with self.lock:
+      self._insert((variety_id, param), (avg, var, w_count, w_sum), overwrite=True)
+
+  def loadRecords(self):
+    return self.recorder.loadRecords()
+
+  def preload(self):
+    """ bulk-loads records from the recorder (up to max_size) """
+    n = 0
+    for variety_id, param, avg, var, w_count, w_sum in self.recorder.loadRecords():
+      if n >= self.max_size:
+        logger.warning("estimate cache is full, stopped preloading after %d records", n)
+        break
+      with self.lock:
+        self._insert((variety_id, param), (avg, var, w_count, w_sum), overwrite=False)
+      n += 1
+    logger.info("preloaded %d records", n)
+    return n
+
+  def stats(self):
+    with self.lock:
+      return {
+        "size": len(self.records),
+        "max_size": self.max_size,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+      }
+
+
+class ResponseCache(object):
+  """
+  LRU cache of values computed from the predictions of a variety
+  (e.g., encoded responses), invalidated when the predictions change.
+  """
+
+  def __init__(self, max_size):
+    assert max_size > 0
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    self.entries = OrderedDict()
+    # incremented on every invalidation; see put()
+    self.generation = 0
+    self.hits = 0
+    self.misses = 0
+
+  def __contains__(self, key):
+    with self.lock:
+      return key in self.entries
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self.entries.move_to_end(key)
+      return entry
+
+  def put(self, key, entry, generation):
+    """
+    :param generation: value of self.generation read before computing the entry;
+      the entry is dropped if the cache was invalidated since then
+    """
+    with self.lock:
+      if generation != self.generation:
+        return
+      self.entries[key] = entry
+      self.entries.move_to_end(key)
+      if len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+  def invalidate(self, key):
+    with self.lock:
+      self.generation += 1
+      self.entries.pop(key, None)
+
+  def clear(self):
+    with self.lock:
+      self.generation += 1
+      self.entries.clear()
+
+  def stats(self):
+    with self.lock:
+      return {
+        "size": len(self.entries),
+        "max_size": self.max_size,
+        "hits": self.hits,
+        "misses": self.misses,
+      }
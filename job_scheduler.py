@@ -0,0 +1,135 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Scheduling of the processing of finished jobs
+
+VarietyDispatcher runs the processing on a pool of worker threads
+(each with its own data source); the jobs of the same variety
+are processed one at a time, in the order they were submitted,
+so that the updates of the predictions of a variety keep their order.
+
+"""
+
+import collections
+import logging
+import random
+import threading
+
+
+def retry_delay(attempts, base, factor=2, max_delay=None, jitter=0, rand=random.random):
+  """
+  exponential backoff: delay before the next try after `attempts` failed tries
+  :param jitter: relative spread of the delay (0.1 means +/-10%)
+  """
+  delay = base * factor ** max(attempts - 1, 0)
+  if max_delay is not None:
+    delay = min(delay, max_delay)
+  return delay * (1 + jitter * (2 * rand() - 1))
+
+
+class VarietyDispatcher(object):
+
+  def __init__(self, process, make_datasource, n_workers, log=None):
+    """
+    :param process: function (datasource, message) that processes one job
+    :param make_datasource: function that creates a configured data source (called once per worker)
+    :param n_workers: number of worker threads
+    """
+    self.process = process
+    self.make_datasource = make_datasource
+    self.n_workers = n_workers
+    self.log = log if log is not None else logging.getLogger("job_util")
+    self.cond = threading.Condition()
+    self.pending = {}  # variety_id -> deque of messages (for varieties that are ready or being processed)
+    self.ready = collections.deque()  # varieties with pending messages that no worker is processing
+    self.active = set()  # varieties being processed
+    self.n_pending = 0
+    self.threads = []
+
+  def start(self):
+    for i in range(self.n_workers):
+      th = threading.Thread(target=self.worker, name="job_worker_{}".format(i))
+      th.daemon = True
+      th.start()
+      self.threads.append(th)
+
+  def submit(self, message):
+    with self.cond:
+      messages = self.pending.get(message.variety_id)
+      if messages is None:
+        messages = self.pending[message.variety_id] = collections.deque()
+        if message.variety_id not in self.active:
+          self.ready.append(message.variety_id)
+          self.cond.notify()
+      messages.append(message)
+      self.n_pending += 1
+
+  def take(self):
+    """ waits for a variety that is ready and returns its next message (the variety becomes active) """
+    with self.cond:
+      while not self.ready:
+        self.cond.wait()
+      variety_id = self.ready.popleft()
+      messages = self.pending[variety_id]
+      message = messages.popleft()
+      if not messages:
+        del self.pending[variety_id]
+      self.active.add(variety_id)
+      self.n_pending -= 1
+      return message
+
+  def done(self, message):
+    """ makes the variety of the processed message ready again if it has pending messages """
+    with self.cond:
+      self.active.discard(message.variety_id)
+      if message.variety_id in self.pending:
+        # other varieties get their turn before the next message of this one
+        self.ready.append(message.variety_id)
+        self.cond.notify()
+      self.cond.notify_all()
+
+  def worker(self):
+    datasource = None
+    while True:
+      message = self.take()
+      try:
+        if datasource is None:
+          datasource = self.make_datasource()
+        self.process(datasource, message)
+      except Exception:
+        self.log.exception("processing of job %s failed", str(message.job_id))
+        # the data source may be in a bad state
+        datasource = None
+      finally:
+        self.done(message)
+
+  def join(self, timeout=None):
+    """ waits until all submitted jobs are processed; returns whether they are """
+    with self.cond:
+      return self.cond.wait_for(lambda: not self.n_pending and not self.active, timeout)
+
+  def stats(self):
+    with self.cond:
+      return {"pending": self.n_pending, "active": len(self.active), "workers": self.n_workers}
+
@@ -0,0 +1,272 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Load generator for pysimserv3: sends requests at a target rate (open loop)
+or as fast as the server answers (closed loop) over several connections,
+and reports the throughput and latency percentiles per request type.
+
+The requests are either replayed from a trace (a JSONL file with one request per line,
+or {"time": <seconds from the start>, "request": {...}} per line to keep the original timing),
+or synthesized from a mix of request types.
+
+Latencies are measured from the time a request was due to be sent,
+so in the open loop a slow server is not hidden by requests waiting for a connection.
+In the open loop, the requests on one connection are pipelined (not limited to one at a time).
+
+Example:
+  python3 loadgen.py -p 9999 --mix usage=0.5,job_utilization=0.5 --rate 2000 --duration 30 --connections 16
+
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import sys
+import time
+
+from simserv_client import AsyncClient
+
+SYNTHETIC_TYPES = ["usage", "job_utilization", "process_job", "variety_id/manual", "variety_id/auto"]
+
+
+def parse_mix(mix):
+  """ parses "type=weight,..." into {type: weight} """
+  weights = {}
+  for item in mix.split(','):
+    req_type, weight = item.split('=')
+    if req_type not in SYNTHETIC_TYPES:
+      raise ValueError("unknown request type in the mix: {}".format(req_type))
+    weights[req_type] = float(weight)
+  return weights
+
+
+def synthetic_request(req_type, rnd, n_varieties):
+  variety = rnd.randrange(n_varieties)
+  if req_type == "usage":
+    return {"type": "usage", "request": ["lustre"]}
+  if req_type == "job_utilization":
+    variety_id = hashlib.sha256("loadgen-{}".format(variety).encode('utf-8')).hexdigest()
+    return {"type": "job_utilization", "variety_id": variety_id}
+  if req_type == "process_job":
+    variety_id = hashlib.sha256("loadgen-{}".format(variety).encode('utf-8')).hexdigest()
+    return {"type": "process_job", "job_id": rnd.randrange(1, 1 << 31), "variety_id": variety_id}
+  if req_type == "variety_id/manual":
+    return {"type": "variety_id/manual", "variety_name": "loadgen-{}".format(variety)}
+  return {"type": "variety_id/auto", "UID": 1000, "GID": 1000, "min_nodes": 1, "max_nodes": 1,
+          "script_name": "loadgen", "script_args": ["loadgen", str(variety)]}
+
+
+def synthetic_requests(weights, n_varieties, seed):
+  rnd = random.Random(seed)
+  types = list(weights)
+  type_weights = [weights[t] for t in types]
+  while True:
+    yield synthetic_request(rnd.choices(types, type_weights)[0], rnd, n_varieties)
+
+
+def read_trace(path):
+  """ returns the list of (time or None, request) """
+  trace = []
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      item = json.loads(line)
+      if "request" in item and "time" in item:
+        trace.append((float(item["time"]), item["request"]))
+      else:
+        trace.append((None, item))
+  return trace
+
+
+def schedule(requests, rate, duration, max_requests, speed=1.0):
+  """
+  Yields (due time from the start, request):
+  at the recorded times (divided by speed) for timed trace entries, at the rate for the others
+  (None as due time in the closed loop, i.e. if rate is 0)
+  """
+  for i, (recorded, req) in enumerate(requests):
+    if max_requests and i >= max_requests:
+      return
+    if recorded is not None:
+      due = recorded / speed
+    elif rate:
+      due = i / rate
+    else:
+      due = None
+    if duration and due is not None and due >= duration:
+      return
+    yield due, req
+
+
+class Results(object):
+
+  def __init__(self):
+    self.latencies = {}  # type -> list of seconds
+    self.errors = {}  # type -> count of responses with status "error" or "busy" and of failed requests
+    self.start = None
+    self.end = None
+
+  def add(self, req_type, latency, error):
+    self.latencies.setdefault(req_type, []).append(latency)
+    if error:
+      self.errors[req_type] = self.errors.get(req_type, 0) + 1
+
+  def summary(self):
+    elapsed = max(self.end - self.start, 1e-9)
+    out = {}
+    for req_type, latencies in sorted(self.latencies.items()):
+      latencies = sorted(latencies)
+      row = {"count": len(latencies), "errors": self.errors.get(req_type, 0),
+             "throughput": len(latencies) / elapsed}
+      for name, q in (("p50_ms", 50), ("p90_ms", 90), ("p99_ms", 99), ("p99.9_ms", 99.9)):
+        row[name] = percentile(latencies, q) * 1e3
+      row["max_ms"] = latencies[-1] * 1e3
+      out[req_type] = row
+    return {"elapsed": elapsed, "requests": out}
+
+
+def percentile(sorted_values, q):
+  """ nearest-rank percentile """
+  rank = max(int(-(-q * len(sorted_values) // 100)), 1)
+  return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def send(client, req, due, results):
+  try:
+    resp = await client.call(req)
+    error = resp.get("status") in ("error", "busy")
+  except Exception:
+    error = True
+  results.add(req.get("type", "?"), time.perf_counter() - due, error)
+
+
+async def run_open_loop(clients, timed_requests, results):
+  loop = asyncio.get_event_loop()
+  tasks = []
+  results.start = time.perf_counter()
+  for i, (due, req) in enumerate(timed_requests):
+    due += results.start
+    delay = due - time.perf_counter()
+    if delay > 0:
+      await asyncio.sleep(delay)
+    tasks.append(loop.create_task(send(clients[i % len(clients)], req, due, results)))
+  if tasks:
+    await asyncio.wait(tasks)
+  results.end = time.perf_counter()
+
+
+async def run_closed_loop(clients, requests, duration, results):
+  results.start = time.perf_counter()
+  deadline = results.start + duration if duration else None
+  requests = iter(requests)
+
+  async def worker(client):
+    for _, req in requests:
+      now = time.perf_counter()
+      if deadline is not None and now >= deadline:
+        return
+      await send(client, req, now, results)
+
+  await asyncio.wait([asyncio.ensure_future(worker(client)) for client in clients])
+  results.end = time.perf_counter()
+
+
+def format_table(summary):
+  columns = ["count", "errors", "throughput", "p50_ms", "p90_ms", "p99_ms", "p99.9_ms", "max_ms"]
+  lines = ["{:<20}".format("type") + "".join("{:>12}".format(c) for c in columns)]
+  for req_type, row in summary["requests"].items():
+    lines.append("{:<20}".format(req_type) +
+                 "".join("{:>12}".format(row[c]) if isinstance(row[c], int) else "{:>12.3f}".format(row[c])
+                         for c in columns))
+  lines.append("elapsed: {:.3f} s".format(summary["elapsed"]))
+  return "\n".join(lines)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="load generator for pysimserv3")
+  parser.add_argument('-a', '--address', type=str, default='localhost', help="address of the server")
+  parser.add_argument('-p', '--port', type=int, default=9999, help="port of the server")
+  parser.add_argument('-u', '--unix_socket', type=str, default=None, help="Unix domain socket of the server (instead of address and port)")
+  parser.add_argument('-e', '--encoding', type=str, default='json', choices=['json', 'binary'], help="encoding of the messages")
+  parser.add_argument('--trace', type=str, default=None, help="JSONL file with the requests to replay (instead of --mix)")
+  parser.add_argument('--mix', type=str, default="usage=0.5,job_utilization=0.5",
+                      help="weights of the synthesized request types ({}); note that process_job requests make the server analyze jobs".format(", ".join(SYNTHETIC_TYPES)))
+  parser.add_argument('--varieties', type=int, default=1000, help="number of distinct varieties in synthesized requests")
+  parser.add_argument('--seed', type=int, default=0, help="seed of synthesized requests")
+  parser.add_argument('--rate', type=float, default=0, help="requests per second (0 for the closed loop: every connection sends the next request when the previous one is answered)")
+  parser.add_argument('--speed', type=float, default=1.0, help="speed-up of the recorded times of a timed trace")
+  parser.add_argument('--duration', type=float, default=10, help="seconds to run (0 for no limit)")
+  parser.add_argument('--requests', type=int, default=0, help="maximum number of requests (0 for no limit)")
+  parser.add_argument('--connections', type=int, default=8, help="number of connections")
+  parser.add_argument('--json', action='store_true', help="print the results as JSON")
+  args = parser.parse_args(argv)
+
+  if args.trace:
+    trace = read_trace(args.trace)
+    # a trace is repeated until the duration or the number of requests is reached
+    period = max((t for t, _ in trace if t is not None), default=0) + 1.0 / max(args.rate, 1)
+    if args.duration or args.requests:
+      requests = ((t + period * n if t is not None else None, req)
+                  for n in itertools.count() for t, req in trace)
+    else:
+      requests = iter(trace)
+  else:
+    requests = ((None, req) for req in synthetic_requests(parse_mix(args.mix), args.varieties, args.seed))
+  if not args.duration and not args.requests and not args.trace:
+    parser.error("--duration or --requests is required for synthesized requests")
+  timed = any(t is not None for t, _ in trace) if args.trace else False
+  if timed and not args.rate and any(t is None for t, _ in trace):
+    parser.error("--rate is required for the requests without time in a timed trace")
+
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  clients = [AsyncClient(args.address, args.port, args.unix_socket, args.encoding) for _ in range(args.connections)]
+  results = Results()
+  try:
+    if args.rate or timed:
+      loop.run_until_complete(run_open_loop(clients, schedule(requests, args.rate, args.duration, args.requests, args.speed),
+                                            results))
+    else:
+      limited = itertools.islice(requests, args.requests) if args.requests else requests
+      loop.run_until_complete(run_closed_loop(clients, limited, args.duration, results))
+  finally:
+    for client in clients:
+      client.close()
+    loop.close()
+
+  if results.start is None or not results.latencies:
+    print("no requests were sent", file=sys.stderr)
+    return 1
+  summary = results.summary()
+  print(json.dumps(summary, indent=2) if args.json else format_table(summary))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -6,6 +6,8 @@ Created by Alexander Goponenko at 4/7/2022
 
 class Message:
 
+    attempts = 0  # number of times the processing of the job was tried (class default for unpickled messages)
+
     def __init__(self, time, job_id, variety_id, job_start=None, job_end=None, job_nodes=None):
         self.time = time
         self.job_id = job_id
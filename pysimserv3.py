@@ -13,6 +13,8 @@
 # if not os.environ['LD_LIBRARY_PATH']:
 #  print('no LD_LIBRARY_PATH')
 
+import asyncio
+import concurrent.futures
 import copy
 import math
 import time
@@ -27,6 +29,11 @@ import argparse
 import traceback
 import csv
 import os
+import multiprocessing
+import queue
+import socket
+import signal
+import stat
 
 # from analyze_job_option1 import analyze_job
 from combined_queue import CombinedQueue
@@ -36,9 +43,18 @@ from sosdb import Sos
 from numsos.DataSource import SosDataSource
 
 from message import Message
+import wire_protocol
 from sos_recorder import Recorder, CanaryStore
+from estimate_cache import EstimateCache, ResponseCache
+from shared_estimates import SharedEstimateTable
+from server_stats import ServerStats, STATS_TITLES
+from access_log import AccessLog
+from admission import AdmissionControl
+from analysis_pool import AnalysisPool, BusyError
+from job_scheduler import VarietyDispatcher, retry_delay
+from tracing import SPAN_FIELDS, Tracer
 import table_log
-from delta_parameter_totalized import DeltaParameter
+from delta_parameter_totalized import DeltaParameter, MultiDeltaParameter, StreamingDeltaParameter
 
 
 def update_dict(base, overrides):
@@ -79,8 +95,18 @@ parser.add_argument('--FACTORS', type=yaml.safe_load, default={
   "lustre": 10000.0 / 14000000.0
 }, help="multipliers for the metrics")
 parser.add_argument('--grid_step', type=int, default=10, help="grid step for gridding (in seconds)")
+parser.add_argument('--grid_engine', type=str, default='numpy', choices=['numpy', 'python'],
+                    help="gridding of the records of a job: whole arrays at once (numpy) or record by record (python)")
 parser.add_argument('--use_canary', type=str, default=None, help="location of canary probe database (None if disabled)")
 parser.add_argument('--zero_current_utilization', type=bool, default=False, help='whether to report always zero untilization')
+parser.add_argument('--server_mode', type=str, default='threading', choices=['threading', 'asyncio'],
+                    help="server engine: thread per connection or a single asyncio event loop")
+parser.add_argument('--serving_processes', type=int, default=1,
+                    help="number of processes that serve requests (sharing the port with SO_REUSEPORT)")
+parser.add_argument('--unix_socket', type=str, default=None,
+                    help="path of a Unix domain socket to listen on in addition to the TCP port (None if disabled)")
+parser.add_argument('--log_level', type=str, default="INFO" if is_production else "DEBUG",
+                    choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="level of the log messages")
 
 ###################################################
 #
@@ -109,8 +135,19 @@ if args.config_file is not None:
 #
 ###################################################
 conf = {}
-conf['MAX'] = 1024 * 4  # maximum lenght of network message
+conf['MAX'] = 1024 * 4  # maximum lenght of one read from the network
+conf['MAX_MESSAGE'] = 1024 * 1024  # maximum lenght of network message
+conf['MAX_CONNECTIONS'] = 1024  # maximum number of simultaneous connections (asyncio server mode)
+conf['IDLE_TIMEOUT'] = 0  # seconds before an idle connection is closed; 0 disables (asyncio server mode)
+conf['ASYNC_WORKERS'] = 8  # threads that handle blocking requests (asyncio server mode)
+conf['OUT_OF_ORDER_WORKERS'] = 32  # threads that handle requests of connections in the out-of-order mode (threading server mode)
+conf['SHARED_TABLE_SLOTS'] = 1 << 18  # size of the table of predictions shared with serving processes
 conf['QUERY_LIMIT'] = 4096  # maximum number of rows to be returned by queries
+conf['ANALYSIS_SCAN'] = 'bounds'  # 'bounds' (find the time bounds first), 'single' (one scan of the job records) or 'stream'
+conf['ANALYSIS_MAX_BUFFERED'] = 2000000  # maximum number of records kept in memory by the 'single' scan
+conf['STREAM_STALL_TIMEOUT'] = 3600  # seconds without records after which the 'stream' scan finishes a node
+conf['ALT_ANALYSIS'] = 'points'  # 'points' (four queries per node) or 'scan' (one time-window scan per job boundary)
+conf['ALT_SCAN_WINDOW'] = 30  # seconds around the job start and end read by the 'scan' analysis
 conf['OVERFLOW'] = 1 + 0xffffffffffffffff  # uint64 overflow value
 # DEFAULT_DT = 1 # default interval between samples in seconds
 
@@ -121,6 +158,11 @@ conf['OVERFLOW'] = 1 + 0xffffffffffffffff  # uint64 overflow value
 ###################################################
 conf['PROCESSING_DELAY'] = 20  # seconds
 conf['N_TRIES'] = 3  # number of tries before giving up on a job
+conf['RETRY_DELAY'] = 20  # seconds before the second try
+conf['RETRY_BACKOFF'] = 2  # each next retry waits this many times longer
+conf['RETRY_MAX_DELAY'] = 300  # seconds
+conf['RETRY_JITTER'] = 0.1  # relative random spread of the retry delays
+conf['JOB_WORKERS'] = 1  # threads (each with its own data source) that process finished jobs
 conf['DELTAS'] = ["user", ]
 if is_production:
   conf['DELTAS'] = ["lustre", ]
@@ -184,8 +226,42 @@ conf['TRANSLATE'] = {
   "user": "lustre"
 }
 
+# size of the in-memory cache of predictions (0 disables the cache)
+conf['ESTIMATE_CACHE_SIZE'] = 100000
+# whether to load the cache from the database at startup
+conf['ESTIMATE_CACHE_PRELOAD'] = False
+# number of varieties with cached encoded job_utilization responses (0 disables the cache)
+conf['RESPONSE_CACHE_SIZE'] = 100000
+
+# seconds between dumps of the request statistics to a table (0 disables the dumps)
+conf['STATS_PERIOD'] = 60
+# lanes of requests with bounded concurrency (requests of other types are handled without limits);
+# requests that do not fit are rejected with "busy"
+conf['ADMISSION_LANES'] = {
+  "heavy": {"types": ["analyze_job"], "max_running": 2, "max_waiting": 2},
+  "results": {"types": ["analyze_job/result"], "max_running": 8, "max_waiting": 0},
+  # requests that may each read many records (the queries of the scheduler are never limited)
+  "bulk": {"types": ["batch", "process_canary_probe"], "max_running": 4, "max_waiting": 64},
+}
+# analyze_job requests
+conf['ANALYSIS_WORKERS'] = 2  # threads (each with its own data source) that analyze jobs
+conf['ANALYSIS_MAX_PENDING'] = 16  # analyses waiting for a worker; more requests are rejected with "busy"
+conf['ANALYSIS_RESULT_TTL'] = 600  # seconds for which the results are kept
+conf['ANALYSIS_MAX_RESULTS'] = 1000  # maximum number of kept results
+conf['ANALYSIS_MAX_WAIT'] = 60  # maximum timeout (in seconds) of analyze_job/result
+# access log (one record per request)
+conf['ACCESS_LOG_PATH'] = None  # file of the access log (None for stderr)
+conf['ACCESS_LOG_SAMPLE_RATE'] = 0.01 if is_production else 1.0  # fraction of successful requests that are logged
+conf['ACCESS_LOG_ERROR_INTERVAL'] = 1.0  # minimum number of seconds between logged errors
+conf['ACCESS_LOG_RING_SIZE'] = 1000  # number of the last requests kept for dumps
+conf['TRACE_ENABLED'] = False  # whether the stages of the job processing are traced
+conf['TRACE_RING_SIZE'] = 1000  # number of the last trace spans kept for the trace request
+
 #  Parameters for communication through file system
 conf['file_queue_path'] = None
+conf['FILE_QUEUE_POLL'] = 1.0  # seconds between checks of the file queue directory (without inotify)
+conf['COMPLETED_JOBS_TTL'] = 3600  # seconds during which repeated messages for a processed job are dropped
+conf['COMPLETED_JOBS_MAX'] = 10000  # maximum number of remembered processed jobs
 conf['file_canary_queue_path'] = None
 conf['CANARY_FS_PROCESSING_DELAY'] = 20  # seconds
 
@@ -234,17 +310,47 @@ print("^^^^^ Config ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^", flush=True)
 ###################################################
 
 
-gMessageQueue = CombinedQueue(conf['file_queue_path'])
+gMessageQueue = CombinedQueue(conf['file_queue_path'], conf['FILE_QUEUE_POLL'],
+                              conf['COMPLETED_JOBS_TTL'], conf['COMPLETED_JOBS_MAX'])
 
 gCU_lock = threading.Lock()
 gCU_avg = dict.fromkeys(conf['DELTAS'], 0.0)
 
 gRecorder = Recorder(conf['REC_PATH'])
+if conf['ESTIMATE_CACHE_SIZE']:
+  gRecorder = EstimateCache(gRecorder, conf['ESTIMATE_CACHE_SIZE'])
+  if conf['ESTIMATE_CACHE_PRELOAD']:
+    gRecorder.preload()
+
+gResponseCache = ResponseCache(conf['RESPONSE_CACHE_SIZE']) if conf['RESPONSE_CACHE_SIZE'] else None
+
+# predictions and current utilization shared with serving processes (see start_serving_processes)
+gSharedEstimates = None
+# generation of gSharedEstimates, for which gResponseCache is valid (in serving processes)
+gSharedGeneration = None
 gCanaryStore = CanaryStore(conf['use_canary']) if conf['use_canary'] else None
 
+# request counters and latencies (reported by the "stats" request)
+gStats = ServerStats()
+
+gAdmission = AdmissionControl(conf['ADMISSION_LANES'])
+
+# workers for analyze_job requests (the functions are looked up when called, as they are defined below)
+gAnalysisPool = AnalysisPool(lambda datasource, job_id: analyze_job(datasource, job_id, TCPlog),
+                             lambda: make_datasource(),
+                             conf['ANALYSIS_WORKERS'], conf['ANALYSIS_MAX_PENDING'],
+                             conf['ANALYSIS_RESULT_TTL'], conf['ANALYSIS_MAX_RESULTS'])
+
 logging.basicConfig(format='[%(asctime)s] %(levelname)s:%(name)s: %(message)s')
 TCPlog = logging.getLogger("TCP")
-TCPlog.setLevel(logging.DEBUG)
+
+if conf['ACCESS_LOG_PATH']:
+  access_handler = logging.FileHandler(conf['ACCESS_LOG_PATH'])
+else:
+  access_handler = logging.StreamHandler()
+access_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s:%(name)s: %(message)s'))
+gAccessLog = AccessLog(access_handler, conf['ACCESS_LOG_SAMPLE_RATE'], conf['ACCESS_LOG_ERROR_INTERVAL'],
+                       conf['ACCESS_LOG_RING_SIZE'])
 
 if 'hostlist' in conf and conf['hostlist']:
   # read hostlist from file
@@ -286,6 +392,12 @@ else:
   gNodeLog = None
   gCanaryTable = None
 
+if conf['doSaveTables'] and conf['TRACE_ENABLED']:
+  gTracer = Tracer(True, conf['TRACE_RING_SIZE'],
+                   table_log.TableLog(conf['prefixSaveTables'] + "trace_table.csv", title=list(SPAN_FIELDS)))
+else:
+  gTracer = Tracer(conf['TRACE_ENABLED'], conf['TRACE_RING_SIZE'])
+
 ###################################################
 #
 # the rest
@@ -297,8 +409,12 @@ def DT64toTS(dt64):
   return (dt64 - conf['ZERO_TIME']) / np.timedelta64(1, 's')
 
 
+def scale_value(param, val):
+  return int(math.ceil(val * conf['FACTORS'][param]))
+
+
 def format_value(param, val):
-  return str(int(math.ceil(val * conf['FACTORS'][param])))
+  return str(scale_value(param, val))
 
 
 def get_components_from_string(s):
@@ -453,14 +569,192 @@ g_state = State()
 #     return (avg, var)
 
 
+def _canary_time(job_id, min_time, max_time):
+  """ :return: (average canary time during the job, 0) """
+  with gTracer.span("canary", job_id):
+    return (gCanaryStore.getAverageValue(min_time,
+                                         max_time,
+                                         conf['wiggle_time'],
+                                         conf['QUERY_LIMIT']),
+            0)
+
+
+def _read_job_records(dataSource, job_id, log):
+  """
+  reads all records of the job (one scan ordered by component and time)
+  :return: (timestamps, component ids, values of the deltas (2-D)) or None if there are more than ANALYSIS_MAX_BUFFERED records
+  """
+  with gTracer.span("fetch", job_id) as span:
+    records = _fetch_job_records(dataSource, job_id, log)
+    if records is not None:
+      span.add_rows(len(records[0]))
+  return records
+
+
+def _fetch_job_records(dataSource, job_id, log):
+  dataSource.select(conf['COLUMNS'],
+                    where=[['job_id', Sos.COND_EQ, job_id]],
+                    order_by='job_comp_time')
+  timestamps, comp_ids, values = [], [], []
+  total_records = 0
+  a = dataSource.get_results(limit=conf['QUERY_LIMIT'], reset=True)
+  while a:
+    timestamps.append(DT64toTS(a.array('timestamp')))
+    comp_ids.append(a.array('component_id'))
+    values.append(np.array([conf['DELTAS_DATA_GETTERS'][val_name](a, val_name) for val_name in conf['DELTAS']],
+                           dtype=float))
+    nrecords = len(timestamps[-1])
+    total_records += nrecords
+    log.debug("total records so far: %d", total_records)
+    if total_records > conf['ANALYSIS_MAX_BUFFERED']:
+      return None
+    if nrecords < conf['QUERY_LIMIT']:
+      break
+    a = dataSource.get_results(limit=conf['QUERY_LIMIT'], reset=False)
+  if not timestamps:
+    return np.zeros(0), np.zeros(0, dtype=int), np.zeros((len(conf['DELTAS']), 0))
+  return np.concatenate(timestamps), np.concatenate(comp_ids), np.concatenate(values, axis=1)
+
+
+def _analyze_job_records(job_id, timestamps, comp_ids, values, log, nodeLog=None):
+  """ analyze_job for the records read by _read_job_records (the time bounds are found from the records) """
+  if not len(timestamps):
+    log.info("No records for the job %i", job_id)
+    return None
+  min_time = timestamps.min()
+  max_time = timestamps.max()
+  if min_time >= max_time:
+    log.info("min time(%i) is not less than max time(%i) for the job %i", min_time, max_time, job_id)
+    return None
+
+  run_starts = np.flatnonzero(comp_ids[1:] != comp_ids[:-1]) + 1
+  starts = np.concatenate(([0], run_starts))
+  ends = np.concatenate((run_starts, [len(timestamps)]))
+  if conf['grid_engine'] == 'numpy':
+    # one accumulator for all deltas
+    grids = [MultiDeltaParameter(min_time, max_time, conf['grid_step'], len(conf['DELTAS']), log, nodeLog, (job_id,))]
+    grid_values = [values]
+  else:
+    grids = [DeltaParameter(min_time, max_time, conf['grid_step'], log, nodeLog, (job_id,)) for _ in conf['DELTAS']]
+    grid_values = list(values)
+  with gTracer.span("grid", job_id) as span:
+    for i, (start, end) in enumerate(zip(starts, ends)):
+      for grid, vals in zip(grids, grid_values):
+        if i == 0:
+          grid.init_node(timestamps[start], vals[..., start], comp_ids[start])
+        else:
+          grid.new_node(timestamps[start], vals[..., start], comp_ids[start])
+        if conf['grid_engine'] == 'numpy':
+          grid.same_node_batch(timestamps[start + 1:end], vals[..., start + 1:end])
+        else:
+          for j in range(start + 1, end):
+            grid.same_node(timestamps[j], vals[j])
+    span.add_rows(len(timestamps))
+  log.debug("analyzed %d components", len(starts))
+  dt_sample = len(timestamps) - len(starts)
+  dt_total = (timestamps[ends - 1] - timestamps[starts]).sum()
+  if dt_sample == 0 or dt_total == 0:
+    log.info("No useful records for the job %i", job_id)
+    return None
+
+  dt_avg = dt_total / dt_sample
+  delta_time = 2 * dt_avg + (max_time - min_time)
+  with gTracer.span("reduce", job_id):
+    if conf['grid_engine'] == 'numpy':
+      results = dict(zip(conf['DELTAS'], grids[0].finish_all()))
+    else:
+      results = dict(zip(conf['DELTAS'], [grid.finish_all() for grid in grids]))
+  if conf['use_canary']:
+    results['canary_time'] = _canary_time(job_id, min_time, max_time)
+  a_value = next(iter(conf['DELTAS']))
+  avg, var = results[a_value]
+  log.info("d_time: %f, %s avg: %f, var: %f", delta_time, a_value, avg, var)
+
+  return min_time, max_time, delta_time, results
+
+
+def _analyze_job_stream(dataSource, job_id, log, nodeLog=None):
+  """ analyze_job reading the records in the order of time (keeps only the part of the profile still in use) """
+  fetch = gTracer.span("fetch", job_id).start()
+  dataSource.select(conf['COLUMNS'],
+                    where=[['job_id', Sos.COND_EQ, job_id]],
+                    desc=True,
+                    order_by='job_time_comp')
+  a = dataSource.get_results(limit=1)
+  if not a:
+    fetch.end()
+    log.info("No records for the job %i", job_id)
+    return None
+  max_time = DT64toTS(a.array('timestamp')[0])
+
+  dataSource.select(conf['COLUMNS'],
+                    where=[['job_id', Sos.COND_EQ, job_id]],
+                    order_by='job_time_comp')
+  a = dataSource.get_results(limit=conf['QUERY_LIMIT'], reset=True)
+  fetch.stop()
+  min_time = DT64toTS(a.array('timestamp')[0])
+  if min_time >= max_time:
+    fetch.end()
+    log.info("min time(%i) is not less than max time(%i) for the job %i", min_time, max_time, job_id)
+    return None
+
+  grid = StreamingDeltaParameter(min_time, max_time, conf['grid_step'], len(conf['DELTAS']),
+                                 conf['STREAM_STALL_TIMEOUT'], log, nodeLog, (job_id,))
+  grid_span = gTracer.span("grid", job_id)
+  while a:
+    grid_span.start()
+    timestamps = DT64toTS(a.array('timestamp'))
+    grid.add_records(timestamps, a.array('component_id'),
+                     [conf['DELTAS_DATA_GETTERS'][val_name](a, val_name) for val_name in conf['DELTAS']])
+    grid_span.stop(len(timestamps))
+    log.debug("total records so far: %d", grid.n_records)
+    if len(timestamps) < conf['QUERY_LIMIT']:
+      break
+    fetch.start()
+    a = dataSource.get_results(limit=conf['QUERY_LIMIT'], reset=False)
+    fetch.stop()
+  fetch.add_rows(grid.n_records)
+  fetch.end()
+  grid_span.end()
+  with gTracer.span("reduce", job_id):
+    results = dict(zip(conf['DELTAS'], grid.finish_all()))
+  log.debug("analyzed %d components, at most %d points kept", grid.n_nodes, grid.max_pending)
+
+  dt_sample = grid.n_records - grid.n_nodes
+  dt_total = grid.node_time_total
+  if dt_sample == 0 or dt_total == 0:
+    log.info("No useful records for the job %i", job_id)
+    return None
+
+  dt_avg = dt_total / dt_sample
+  delta_time = 2 * dt_avg + (max_time - min_time)
+  if conf['use_canary']:
+    results['canary_time'] = _canary_time(job_id, min_time, max_time)
+  a_value = next(iter(conf['DELTAS']))
+  avg, var = results[a_value]
+  log.info("d_time: %f, %s avg: %f, var: %f", delta_time, a_value, avg, var)
+
+  return min_time, max_time, delta_time, results
+
+
 def analyze_job(dataSource, job_id, log, nodeLog=None):
   log.debug("Analyzing job_id: %i", job_id)
+  if conf['ANALYSIS_SCAN'] == 'stream':
+    return _analyze_job_stream(dataSource, job_id, log, nodeLog)
+  if conf['ANALYSIS_SCAN'] == 'single':
+    records = _read_job_records(dataSource, job_id, log)
+    if records is not None:
+      return _analyze_job_records(job_id, *records, log, nodeLog=nodeLog)
+    log.info("More than %d records for the job %i, finding the time bounds first",
+             conf['ANALYSIS_MAX_BUFFERED'], job_id)
+  fetch = gTracer.span("fetch", job_id).start()
   dataSource.select(conf['COLUMNS'],
                     where=[['job_id', Sos.COND_EQ, job_id]],
                     desc=True,
                     order_by='job_time_comp')
   a = dataSource.get_results(limit=1)
   if not a:
+    fetch.end()
     log.info("No records for the job %i", job_id)
     return None
   max_time = DT64toTS(a.array('timestamp')[0])
@@ -472,6 +766,7 @@ def analyze_job(dataSource, job_id, log, nodeLog=None):
   min_time = DT64toTS(a.array('timestamp')[0])
 
   if min_time >= max_time:
+    fetch.end()
     log.info("min time(%i) is not less than max time(%i) for the job %i", min_time, max_time, job_id)
     return None
 
@@ -479,6 +774,8 @@ def analyze_job(dataSource, job_id, log, nodeLog=None):
                     where=[['job_id', Sos.COND_EQ, job_id]],
                     order_by='job_comp_time')
   a = dataSource.get_results(limit=1)
+  fetch.stop()
+  grid_span = gTracer.span("grid", job_id)
   total_records = 1
   total_components = 1
   cur_comp_id = a.array('component_id')[0]
@@ -487,22 +784,30 @@ def analyze_job(dataSource, job_id, log, nodeLog=None):
     cur_deltas[val_name] = conf['DELTAS_DATA_GETTERS'][val_name](a, val_name)[0]
   cur_time = a.array('timestamp')[0]
   cur_timestamp = DT64toTS(cur_time)
-  log.debug("first time: " + str(cur_time))
+  log.debug("first time: %s", cur_time)
   # min_time = cur_timestamp
   # max_time = cur_timestamp
   dt_sample = 0
   dt_total = 0
   delta_params = {}
   delta_data = {}
-  for val_name in conf['DELTAS']:
-    delta_params[val_name] = DeltaParameter(min_time, max_time, conf['grid_step'], log, nodeLog, (job_id,))
-    delta_params[val_name].init_node(cur_timestamp, cur_deltas[val_name], cur_comp_id)
+  if conf['grid_engine'] == 'numpy':
+    # one accumulator for all deltas
+    grid = MultiDeltaParameter(min_time, max_time, conf['grid_step'], len(conf['DELTAS']), log, nodeLog, (job_id,))
+    grid.init_node(cur_timestamp, [cur_deltas[val_name] for val_name in conf['DELTAS']], cur_comp_id)
+  else:
+    for val_name in conf['DELTAS']:
+      delta_params[val_name] = DeltaParameter(min_time, max_time, conf['grid_step'], log, nodeLog, (job_id,))
+      delta_params[val_name].init_node(cur_timestamp, cur_deltas[val_name], cur_comp_id)
   while True:
+    fetch.start()
     a = dataSource.get_results(limit=conf['QUERY_LIMIT'], reset=False)
+    fetch.stop()
     if not a:
       # end cycle
       break
 
+    grid_span.start()
     timestamps = DT64toTS(a.array('timestamp'))
     comp_ids = a.array('component_id')
     for val_name in conf['DELTAS']:
@@ -510,31 +815,58 @@ def analyze_job(dataSource, job_id, log, nodeLog=None):
     nrecords = len(timestamps)
     total_records += nrecords
     log.debug("total records so far: %d", total_records)
-    for i in range(nrecords):
-      if comp_ids[i] != cur_comp_id:
-        # finish previous component
-        max_time = max(max_time, cur_timestamp)
-        log.debug("finished component #%d: %d", total_components, cur_comp_id)
-        total_components += 1
-        #  start new component id
-        cur_comp_id = comp_ids[i]
-        cur_timestamp = timestamps[i]
-        for val_name in conf['DELTAS']:
-          cur_deltas[val_name] = delta_data[val_name][i]
-          delta_params[val_name].new_node(cur_timestamp, cur_deltas[val_name], cur_comp_id)
-        min_time = min(min_time, cur_timestamp)
-      else:
-        # process one more record for current component id
-        new_timestamp = timestamps[i]
-        dt_total += new_timestamp - cur_timestamp
-        dt_sample += 1
-        cur_timestamp = new_timestamp
-        for val_name in conf['DELTAS']:
-          cur_deltas[val_name] = delta_data[val_name][i]
-          delta_params[val_name].same_node(cur_timestamp, cur_deltas[val_name])
+    if conf['grid_engine'] == 'numpy':
+      values = np.array([delta_data[val_name] for val_name in conf['DELTAS']], dtype=float)
+      # process the runs of records of the same component
+      run_starts = np.flatnonzero(comp_ids[1:] != comp_ids[:-1]) + 1
+      for start, end in zip(np.concatenate(([0], run_starts)), np.concatenate((run_starts, [nrecords]))):
+        if comp_ids[start] != cur_comp_id:
+          # finish previous component
+          max_time = max(max_time, cur_timestamp)
+          log.debug("finished component #%d: %d", total_components, cur_comp_id)
+          total_components += 1
+          #  start new component id
+          cur_comp_id = comp_ids[start]
+          cur_timestamp = timestamps[start]
+          grid.new_node(cur_timestamp, values[:, start], cur_comp_id)
+          min_time = min(min_time, cur_timestamp)
+          start += 1
+        if start < end:
+          # process the rest of the records for current component id
+          dt_total += timestamps[end - 1] - cur_timestamp
+          dt_sample += end - start
+          cur_timestamp = timestamps[end - 1]
+          grid.same_node_batch(timestamps[start:end], values[:, start:end])
+    else:
+      for i in range(nrecords):
+        if comp_ids[i] != cur_comp_id:
+          # finish previous component
+          max_time = max(max_time, cur_timestamp)
+          log.debug("finished component #%d: %d", total_components, cur_comp_id)
+          total_components += 1
+          #  start new component id
+          cur_comp_id = comp_ids[i]
+          cur_timestamp = timestamps[i]
+          for val_name in conf['DELTAS']:
+            cur_deltas[val_name] = delta_data[val_name][i]
+            delta_params[val_name].new_node(cur_timestamp, cur_deltas[val_name], cur_comp_id)
+          min_time = min(min_time, cur_timestamp)
+        else:
+          # process one more record for current component id
+          new_timestamp = timestamps[i]
+          dt_total += new_timestamp - cur_timestamp
+          dt_sample += 1
+          cur_timestamp = new_timestamp
+          for val_name in conf['DELTAS']:
+            cur_deltas[val_name] = delta_data[val_name][i]
+            delta_params[val_name].same_node(cur_timestamp, cur_deltas[val_name])
+    grid_span.stop(nrecords)
     if nrecords < conf['QUERY_LIMIT']:
       # end cycle
       break
+  fetch.add_rows(total_records)
+  fetch.end()
+  grid_span.end()
 
   log.debug("finishing last component: %d", cur_comp_id)
   max_time = max(max_time, cur_timestamp)
@@ -545,14 +877,15 @@ def analyze_job(dataSource, job_id, log, nodeLog=None):
   dt_avg = dt_total / dt_sample
   delta_time = 2 * dt_avg + (max_time - min_time)  # / np.timedelta64(1, 's')
   results = {}
-  for val_name in conf['DELTAS']:
-    results[val_name] = delta_params[val_name].finish_all()
+  with gTracer.span("reduce", job_id):
+    if conf['grid_engine'] == 'numpy':
+      for val_name, result in zip(conf['DELTAS'], grid.finish_all()):
+        results[val_name] = result
+    else:
+      for val_name in conf['DELTAS']:
+        results[val_name] = delta_params[val_name].finish_all()
   if conf['use_canary']:
-    results['canary_time'] = (gCanaryStore.getAverageValue(min_time,
-                                                           max_time,
-                                                           conf['wiggle_time'],
-                                                           conf['QUERY_LIMIT']),
-                              0)
+    results['canary_time'] = _canary_time(job_id, min_time, max_time)
   a_value = next(iter(conf['DELTAS']))
   avg, var = results[a_value]
   log.info("d_time: %f, %s avg: %f, var: %f", delta_time, a_value, avg, var)
@@ -570,7 +903,8 @@ def _sample_inbetween(pre, post, between):
     post_val = [conf['DELTAS_DATA_GETTERS'][val_name](post, val_name)[0] for val_name in conf['DELTAS']]
   if pre:
     if post:
-      pre_weight = (post_time - between) / (post_time - pre_time)
+      # pre and post are the same record if it is exactly at `between`
+      pre_weight = (post_time - between) / (post_time - pre_time) if post_time > pre_time else 1
       post_weight = 1 - pre_weight
       between_val = [pre_val[i] * pre_weight + post_val[i] * post_weight for i in range(len(pre_val))]
       rc = 3
@@ -583,7 +917,7 @@ def _sample_inbetween(pre, post, between):
   else:
     between_val = None
     rc = 0
-  logging.debug("between_val: %s", str(between_val))
+  logging.debug("between_val: %s", between_val)
   return between_val, rc
 
 
@@ -594,6 +928,199 @@ def _convert_DataSet_to_str(data_set):
   return res
 
 
+def _alt_component_deltas(dataSource, job_id, comp_id, min_time, max_time, duration, log):
+  """ finds the deltas of one component with four point queries; returns None if the component has no useful records """
+  # get the value before min_time
+  dataSource.select(
+      conf['COLUMNS'],
+      where=[['timestamp', Sos.COND_LE, min_time],
+             ['component_id', Sos.COND_EQ, comp_id]],
+      desc=True,
+      # NOTE: we use comp_time_job instead of time_comp_job
+      # because with time_comp_job, the search stops at first record that matches time and component_id less than comp_id
+      order_by='comp_time_job')
+  pre_min = dataSource.get_results(limit=1, reset=True)
+  if log.isEnabledFor(logging.DEBUG):
+    log.debug("Component %i pre_min: %s", comp_id, _convert_DataSet_to_str(pre_min))
+  # get the value after min_time
+  dataSource.select(
+      conf['COLUMNS'],
+      where=[['timestamp', Sos.COND_GE, min_time],
+             ['component_id', Sos.COND_EQ, comp_id]],
+      desc=False,
+      order_by='comp_time_job')
+  post_min = dataSource.get_results(limit=1, reset=True)
+  if log.isEnabledFor(logging.DEBUG):
+    log.debug("Component %i post_min: %s", comp_id, _convert_DataSet_to_str(post_min))
+  # get the value before max_time
+  dataSource.select(
+      conf['COLUMNS'],
+      where=[['timestamp', Sos.COND_LE, max_time],
+             ['component_id', Sos.COND_EQ, comp_id]],
+      desc=True,
+      order_by='comp_time_job')
+  pre_max = dataSource.get_results(limit=1, reset=True)
+  if log.isEnabledFor(logging.DEBUG):
+    log.debug("Component %i pre_max: %s", comp_id, _convert_DataSet_to_str(pre_max))
+  # get the value after max_time
+  dataSource.select(
+      conf['COLUMNS'],
+      where=[['timestamp', Sos.COND_GE, max_time],
+             ['component_id', Sos.COND_EQ, comp_id]],
+      desc=False,
+      order_by='comp_time_job')
+  post_max = dataSource.get_results(limit=1, reset=True)
+  if log.isEnabledFor(logging.DEBUG):
+    log.debug("Component %i post_max: %s", comp_id, _convert_DataSet_to_str(post_max))
+
+  if pre_max and pre_max.array('timestamp')[0] <= min_time:
+    pre_max = None
+  if post_min and post_min.array('timestamp')[0] >= max_time:
+    post_min = None
+
+  if (pre_min or post_min) and (pre_max or post_max):
+    # can proceed with this component
+    start_val, rc = _sample_inbetween(pre_min, post_min, min_time)
+    if rc == 0:
+      log.error(
+          "Second check (alt_analyze_job): could not find start value for job %i component %i",
+          job_id, comp_id)
+      return None
+    elif rc != 3:
+      log.warning("alt_analyze_job: rc=%i for start sample for job %i component %i", rc, job_id, comp_id)
+    end_val, rc = _sample_inbetween(pre_max, post_max, max_time)
+    if rc == 0:
+      log.error(
+          "Second check (alt_analyze_job): could not find end value for job %i component %i",
+          job_id, comp_id)
+      return None
+    elif rc != 3:
+      log.warning("alt_analyze_job: rc=%i for end sample for job %i component %i", rc, job_id, comp_id)
+    comp_deltas = [(end_val[i] - start_val[i]) / duration for i in range(len(start_val))]
+    log.debug("Component %i totals: %s, deltas: %s",
+              comp_id, str([(end_val[i] - start_val[i]) for i in range(len(start_val))]), str(comp_deltas))
+    return comp_deltas
+  else:
+    if not pre_max and not post_max:
+      log.warning("alt_analyze_job: could not find end value for job %i component %i", job_id, comp_id)
+    if not pre_min and not post_min:
+      log.warning("alt_analyze_job: could not find start value for job %i component %i", job_id, comp_id)
+    # skip this component
+    return None
+
+
+def _scan_boundary(dataSource, components, boundary, log):
+  """
+  reads all records within ALT_SCAN_WINDOW of the boundary (one time-window scan)
+  and finds, for each component, the last record before and the first record after the boundary
+  :return: timestamps of the records before and after (NaN if not found) and their values
+           (arrays of shape (len(conf['DELTAS']), len(components)))
+  """
+  window = np.timedelta64(int(conf['ALT_SCAN_WINDOW'] * 1e6), 'us')
+  dataSource.select(conf['COLUMNS'],
+                    where=[['timestamp', Sos.COND_GE, boundary - window],
+                           ['timestamp', Sos.COND_LE, boundary + window]],
+                    order_by='time_comp_job')
+  timestamps, comp_ids = [], []
+  values = [[] for _ in conf['DELTAS']]
+  a = dataSource.get_results(limit=conf['QUERY_LIMIT'], reset=True)
+  while a:
+    timestamps.append(DT64toTS(a.array('timestamp')))
+    comp_ids.append(a.array('component_id'))
+    for i, val_name in enumerate(conf['DELTAS']):
+      values[i].append(conf['DELTAS_DATA_GETTERS'][val_name](a, val_name))
+    if len(timestamps[-1]) < conf['QUERY_LIMIT']:
+      break
+    a = dataSource.get_results(limit=conf['QUERY_LIMIT'], reset=False)
+
+  n_comps = len(components)
+  pre_t = np.full(n_comps, np.nan)
+  post_t = np.full(n_comps, np.nan)
+  pre_vals = np.full((len(conf['DELTAS']), n_comps), np.nan)
+  post_vals = np.full((len(conf['DELTAS']), n_comps), np.nan)
+  if not timestamps:
+    return pre_t, pre_vals, post_t, post_vals
+  timestamps = np.concatenate(timestamps).astype(float)
+  comp_ids = np.concatenate(comp_ids)
+  values = np.array([np.concatenate(v) for v in values], dtype=float)
+  log.debug("boundary scan: %d records", len(timestamps))
+
+  # group the records by component (ordered by time within a group)
+  order = np.lexsort((timestamps, comp_ids))
+  timestamps, comp_ids, values = timestamps[order], comp_ids[order], values[:, order]
+  components = np.asarray(components)
+  lo = np.searchsorted(comp_ids, components, side='left')
+  hi = np.searchsorted(comp_ids, components, side='right')
+  # the number of records of each group before (and at) the boundary
+  boundary_ts = DT64toTS(boundary)
+  n_le = np.concatenate(([0], np.cumsum(timestamps <= boundary_ts)))
+  n_lt = np.concatenate(([0], np.cumsum(timestamps < boundary_ts)))
+  pre = lo + (n_le[hi] - n_le[lo]) - 1
+  post = lo + (n_lt[hi] - n_lt[lo])
+  has_pre = pre >= lo
+  has_post = post < hi
+  pre_t[has_pre] = timestamps[pre[has_pre]]
+  post_t[has_post] = timestamps[post[has_post]]
+  pre_vals[:, has_pre] = values[:, pre[has_pre]]
+  post_vals[:, has_post] = values[:, post[has_post]]
+  return pre_t, pre_vals, post_t, post_vals
+
+
+def _interpolate_inbetween(pre_t, pre_vals, post_t, post_vals, between_ts):
+  """ vectorized _sample_inbetween: NaN timestamps mean missing samples; returns values and rc codes """
+  has_pre = ~np.isnan(pre_t)
+  has_post = ~np.isnan(post_t)
+  both = has_pre & has_post & (post_t > pre_t)
+  pre_weight = np.ones_like(pre_t)
+  pre_weight[both] = (post_t[both] - between_ts) / (post_t[both] - pre_t[both])
+  pre_weight[~has_pre] = 0
+  post_weight = 1 - pre_weight
+  between_vals = (np.where(has_pre, pre_vals, 0) * pre_weight
+                  + np.where(has_post, post_vals, 0) * post_weight)
+  rc = has_pre * 1 + has_post * 2
+  return between_vals, rc
+
+
+def _alt_scan_deltas(dataSource, job_id, components, min_time, max_time, duration, log):
+  """
+  finds the deltas of the job components with one time-window scan per boundary of the job;
+  the components with records missing from the windows fall back to point queries
+  :return: (number of components with useful records, deltas summed over the components or None)
+  """
+  min_ts = DT64toTS(min_time)
+  max_ts = DT64toTS(max_time)
+  pre_min_t, pre_min_vals, post_min_t, post_min_vals = _scan_boundary(dataSource, components, min_time, log)
+  pre_max_t, pre_max_vals, post_max_t, post_max_vals = _scan_boundary(dataSource, components, max_time, log)
+  # a record may be before (or after) the window
+  fallback = np.isnan(pre_min_t) | np.isnan(post_min_t) | np.isnan(pre_max_t) | np.isnan(post_max_t)
+  # the same filtering as with the point queries
+  pre_max_t[pre_max_t <= min_ts] = np.nan
+  post_min_t[post_min_t >= max_ts] = np.nan
+
+  start_vals, start_rc = _interpolate_inbetween(pre_min_t, pre_min_vals, post_min_t, post_min_vals, min_ts)
+  end_vals, end_rc = _interpolate_inbetween(pre_max_t, pre_max_vals, post_max_t, post_max_vals, max_ts)
+  useful = ~fallback & (start_rc > 0) & (end_rc > 0)
+  for i in np.flatnonzero(~fallback & ~useful):
+    log.warning("alt_analyze_job: could not find %s value for job %i component %i",
+                "start" if start_rc[i] == 0 else "end", job_id, components[i])
+  for i in np.flatnonzero(useful & ((start_rc != 3) | (end_rc != 3))):
+    log.warning("alt_analyze_job: rc=%i/%i for start/end samples for job %i component %i",
+                start_rc[i], end_rc[i], job_id, components[i])
+  total_components = int(np.count_nonzero(useful))
+  deltas = None
+  if total_components:
+    deltas = ((end_vals[:, useful] - start_vals[:, useful]) / duration).sum(axis=1)
+  log.debug("alt_analyze_job: %d components from the scans, %d with point queries",
+            total_components, np.count_nonzero(fallback))
+
+  for i in np.flatnonzero(fallback):
+    comp_deltas = _alt_component_deltas(dataSource, job_id, components[i], min_time, max_time, duration, log)
+    if comp_deltas is not None:
+      total_components += 1
+      deltas = np.add(deltas, comp_deltas) if deltas is not None else comp_deltas
+  return total_components, deltas
+
+
 def alt_analyze_job(dataSource, message, log, nodeLog=None):
   log.debug("Alt. analyzing job_id: %i", message.job_id)
   try:
@@ -601,10 +1128,10 @@ def alt_analyze_job(dataSource, message, log, nodeLog=None):
     min_ts = DT64toTS(min_time)
     max_time = np.datetime64(message.job_end, 'us') + np.timedelta64(1, 's')   # NOTE: we take one second after the end
     max_ts = DT64toTS(max_time)
-    log.debug("min_time: %s(%f), max_time: %s(%f)", str(min_time), min_ts, str(max_time), max_ts)
+    log.debug("min_time: %s(%f), max_time: %s(%f)", min_time, min_ts, max_time, max_ts)
     job_id = message.job_id
     components = get_components_from_string(message.job_nodes)
-    log.debug("components: %s", str(components))
+    log.debug("components: %s", components)
   except Exception as e:
     log.error("Could not parse message: %s", str(message))
     log.error("Exception: %s", str(e))
@@ -616,83 +1143,18 @@ def alt_analyze_job(dataSource, message, log, nodeLog=None):
     return None
 
   duration = max_ts - min_ts
-  deltas = None # will be an array later
   # NOTE: we only calcuate average for the deltas (no variance)
-  total_components = 0
-  for comp_id in components:
-    # get the value before min_time
-    dataSource.select(
-        conf['COLUMNS'],
-        where=[['timestamp', Sos.COND_LE, min_time],
-               ['component_id', Sos.COND_EQ, comp_id]],
-        desc=True,
-        # NOTE: we use comp_time_job instead of time_comp_job
-        # because with time_comp_job, the search stops at first record that matches time and component_id less than comp_id
-        order_by='comp_time_job')
-    pre_min = dataSource.get_results(limit=1, reset=True)
-    log.debug("Component %i pre_min: %s", comp_id, _convert_DataSet_to_str(pre_min))
-    # get the value after min_time
-    dataSource.select(
-        conf['COLUMNS'],
-        where=[['timestamp', Sos.COND_GE, min_time],
-               ['component_id', Sos.COND_EQ, comp_id]],
-        desc=False,
-        order_by='comp_time_job')
-    post_min = dataSource.get_results(limit=1, reset=True)
-    log.debug("Component %i post_min: %s", comp_id, _convert_DataSet_to_str(post_min))
-    # get the value before max_time
-    dataSource.select(
-        conf['COLUMNS'],
-        where=[['timestamp', Sos.COND_LE, max_time],
-               ['component_id', Sos.COND_EQ, comp_id]],
-        desc=True,
-        order_by='comp_time_job')
-    pre_max = dataSource.get_results(limit=1, reset=True)
-    log.debug("Component %i pre_max: %s", comp_id, _convert_DataSet_to_str(pre_max))
-    # get the value after max_time
-    dataSource.select(
-        conf['COLUMNS'],
-        where=[['timestamp', Sos.COND_GE, max_time],
-               ['component_id', Sos.COND_EQ, comp_id]],
-        desc=False,
-        order_by='comp_time_job')
-    post_max = dataSource.get_results(limit=1, reset=True)
-    log.debug("Component %i post_max: %s", comp_id, _convert_DataSet_to_str(post_max))
-
-    if pre_max and pre_max.array('timestamp')[0] <= min_time:
-      pre_max = None
-    if post_min and post_min.array('timestamp')[0] >= max_time:
-      post_min = None
-
-    if (pre_min or post_min) and (pre_max or post_max):
-      # can proceed with this component
-      start_val, rc = _sample_inbetween(pre_min, post_min, min_time)
-      if rc == 0:
-        log.error(
-            "Second check (alt_analyze_job): could not find start value for job %i component %i",
-            job_id, comp_id)
-        continue
-      elif rc != 3:
-        log.warning("alt_analyze_job: rc=%i for start sample for job %i component %i", rc, job_id, comp_id)
-      end_val, rc = _sample_inbetween(pre_max, post_max, max_time)
-      if rc == 0:
-        log.error(
-            "Second check (alt_analyze_job): could not find end value for job %i component %i",
-            job_id, comp_id)
-        continue
-      elif rc != 3:
-        log.warning("alt_analyze_job: rc=%i for end sample for job %i component %i", rc, job_id, comp_id)
-      total_components += 1
-      comp_deltas = [(end_val[i] - start_val[i]) / duration for i in range(len(start_val))]
-      log.debug("Component #%i(%i) totals: %s, deltas: %s",
-                total_components, comp_id, str([(end_val[i] - start_val[i]) for i in range(len(start_val))]), str(comp_deltas))
-      deltas = np.add(deltas, comp_deltas) if deltas else comp_deltas
+  with gTracer.span("fetch", job_id) as span:
+    if conf['ALT_ANALYSIS'] == 'scan':
+      total_components, deltas = _alt_scan_deltas(dataSource, job_id, components, min_time, max_time, duration, log)
     else:
-      if not pre_max and not post_max:
-        log.warning("alt_analyze_job: could not find end value for job %i component %i", job_id, comp_id)
-      if not pre_min and not post_min:
-        log.warning("alt_analyze_job: could not find start value for job %i component %i", job_id, comp_id)
-        # skip this component
+      total_components, deltas = 0, None
+      for comp_id in components:
+        comp_deltas = _alt_component_deltas(dataSource, job_id, comp_id, min_time, max_time, duration, log)
+        if comp_deltas is not None:
+          total_components += 1
+          deltas = np.add(deltas, comp_deltas) if deltas is not None else comp_deltas
+    span.add_rows(total_components)
   # make the results
   if total_components == 0:
     log.warning("No useful records for the job %i", job_id)
@@ -704,11 +1166,7 @@ def alt_analyze_job(dataSource, message, log, nodeLog=None):
   log.info("d_time: %f, %s avg: %f, var: %f", duration, a_value, results[a_value][0], results[a_value][1])
 
   if conf['use_canary']:
-    results['canary_time'] = (gCanaryStore.getAverageValue(min_ts,
-                                                          max_ts,
-                                                          conf['wiggle_time'],
-                                                          conf['QUERY_LIMIT']),
-                              0)
+    results['canary_time'] = _canary_time(job_id, min_ts, max_ts)
 
   return min_ts, max_ts, duration, results
 
@@ -766,12 +1224,22 @@ def update_param(variety_id, param_name, avg, var):
     time_now = DT64toTS(np.datetime64('now'))
     gSummaryTable.log([variety_id, time_now, param_name, nAvg, nVar])
   gRecorder.saveRecord(variety_id, param_name, nAvg, nVar, nCount, nSum)
+  if gSharedEstimates is not None:
+    gSharedEstimates.publish_record(variety_id, param_name, (nAvg, nVar, nCount, nSum))
+  if gResponseCache is not None:
+    gResponseCache.invalidate(variety_id)
+
+
+def make_datasource():
+  """ creates a data source of the LDMS records """
+  datasource = SosDataSource()
+  datasource.config(path=conf['PATH'])
+  return datasource
 
 
 def processing_thread():
   """ the job for the thread that monitores the queue and processes jobs  from it"""
   log = logging.getLogger("job_util")
-  log.setLevel(logging.DEBUG)
   log.info("Job processing thread started")
   src = SosDataSource()
   src.config(path=conf['PATH'])
@@ -785,33 +1253,54 @@ def processing_thread():
   else:
     log.info("No recent results")
 
+  # the jobs are processed by the workers; the jobs of one variety are processed in order
+  # the jobs without data in the database are put back to the queue to be tried later
+  def process(datasource, m):
+    try:
+      process_finished_job(datasource, m, log, gMessageQueue)
+    finally:
+      # later messages for the job are dropped as duplicates (unless it was put back to be retried)
+      gMessageQueue.done(m)
+
+  dispatcher = VarietyDispatcher(process, make_datasource, conf['JOB_WORKERS'], log)
+  dispatcher.start()
+
   while True:
-    if gMessageQueue.empty():
-      time.sleep(conf['PROCESSING_DELAY'])
-    else:
-      m = gMessageQueue.get()
-      now = time.time()
-      if now < m.time:
-        time.sleep(m.time - now)
-      # try processing 3 times
-      for _ in range(conf['N_TRIES']):
-        # process job data
-        result = process_job(src, m, log)
-        if result != None:
-          break
-        time.sleep(conf['PROCESSING_DELAY'])
-      if not result:
-        log.error("Could not find any records for job %d, giving up", m.job_id)
-      else:
-        dt, param_results = result
-        # process timelimit
-        update_param(m.variety_id, 'timelimit', dt, 0)
-        # TODO use canary to calculate loads
-        if 'canary_time' in param_results:
-          del param_results['canary_time']
-        for param_name in param_results:
-          avg, var = param_results[param_name]
-          update_param(m.variety_id, param_name, avg, var)
+    # returns when the job is due
+    dispatcher.submit(gMessageQueue.get())
+
+
+def process_finished_job(src, m, log, retries):
+  """
+  processes a finished job and updates the predictions for its variety (called by the job workers);
+  if the job has no records yet, puts it back to `retries` with a later time (up to N_TRIES tries in total)
+  """
+  m.attempts += 1
+  # process job data
+  with gTracer.span("job", m.job_id):
+    result = process_job(src, m, log)
+  if result is None:
+    if m.attempts < conf['N_TRIES']:
+      delay = retry_delay(m.attempts, conf['RETRY_DELAY'], conf['RETRY_BACKOFF'],
+                          conf['RETRY_MAX_DELAY'], conf['RETRY_JITTER'])
+      log.info("No records for job %d yet (try %d), retrying in %.0f seconds", m.job_id, m.attempts, delay)
+      m.time = time.time() + delay
+      retries.put(m)
+      return
+  if not result:
+    log.error("Could not find any records for job %d, giving up", m.job_id)
+  else:
+    dt, param_results = result
+    with gTracer.span("record-update", m.job_id) as span:
+      # process timelimit
+      update_param(m.variety_id, 'timelimit', dt, 0)
+      # TODO use canary to calculate loads
+      if 'canary_time' in param_results:
+        del param_results['canary_time']
+      for param_name in param_results:
+        avg, var = param_results[param_name]
+        update_param(m.variety_id, param_name, avg, var)
+      span.add_rows(len(param_results) + 1)
 
 
 def process_canary_probe(req, resp):
@@ -937,6 +1426,8 @@ def calculate_current_utilization(dataSource, log, table, privateNodes=None):
   # save results
   with gCU_lock:
     gCU_avg = total_deltas
+  if gSharedEstimates is not None:
+    gSharedEstimates.publish_utilization(total_deltas)
 
   if conf['doSaveTables']:
     time_now = DT64toTS(np.datetime64('now'))
@@ -981,6 +1472,446 @@ def current_utilization_thread():
     time.sleep(conf['CU_PERIOD'])
 
 
+def str_to_variety_id(string):
+  return hashlib.sha256(string.encode('utf-8')).hexdigest()
+
+
+# request types allowed inside a batch
+BATCH_TYPES = {"job_utilization", "process_job", "variety_id/manual", "variety_id/auto"}
+
+# request types handled by handle_request (the statistics count the others as "unknown")
+REQUEST_TYPES = BATCH_TYPES | {"analyze_job", "analyze_job/result", "usage", "process_canary_probe", "batch",
+                               "hello", "stats", "access_log", "trace"}
+
+
+class CachedResponse(dict):
+  """
+  A response with a pre-encoded body: only req_id is encoded for each request
+  """
+
+  def __init__(self, req_id, body, encoded_body):
+    """
+    :param body: the response without req_id
+    :param encoded_body: json.dumps(body) without the opening brace
+    """
+    dict.__init__(self, body)
+    self["req_id"] = req_id
+    self.encoded_body = encoded_body
+
+  def encode(self):
+    return '{"req_id": ' + json.dumps(self["req_id"]) + ', ' + self.encoded_body
+
+
+def encode_response(resp):
+  """ JSON-encodes a response (without the terminating newline) """
+  if isinstance(resp, CachedResponse):
+    return resp.encode()
+  if "responses" in resp:
+    # batch: sub-responses may be pre-encoded
+    head = json.dumps({k: v for k, v in resp.items() if k != "responses"})
+    return head[:-1] + ', "responses": [' + ", ".join(encode_response(r) for r in resp["responses"]) + ']}'
+  return json.dumps(resp)
+
+
+def job_utilization_body(variety_id, records=None):
+  """
+  Computes the job_utilization response (without req_id) for a variety
+  :param records: records prefetched with get_variety_records
+  :return: (body, encoded_body) as needed for CachedResponse
+    and the body with numbers not converted to strings (for the binary encoding)
+  """
+  if records is None or (variety_id, conf['PARAMS'][0]) not in records:
+    records = get_variety_records([variety_id])
+  utilization = {}
+  for param in conf['PARAMS']:
+    record = records.get((variety_id, param))
+    if record:
+      avg, var = record[0:2]
+      name = conf['TRANSLATE'].get(param, param)
+      val = avg + conf['K_SIGMA'][param] * math.sqrt(var)
+      utilization[name] = scale_value(param, val)
+  body = {"status": "OK", "response": {name: str(val) for name, val in utilization.items()}}
+  numeric_body = {"status": "OK", "response": utilization}
+  return body, json.dumps(body)[1:], numeric_body
+
+
+def get_current_utilization():
+  if gSharedEstimates is not None and gRecorder is gSharedEstimates:
+    # serving process
+    return gSharedEstimates.read_utilization()
+  with gCU_lock:
+    return gCU_avg
+
+
+def sync_response_cache():
+  """ in serving processes, drops cached responses if the writer process has published new predictions """
+  global gSharedGeneration
+  if gSharedEstimates is None or gRecorder is not gSharedEstimates or gResponseCache is None:
+    return
+  generation = gSharedEstimates.generation()
+  if generation != gSharedGeneration:
+    gResponseCache.clear()
+    gSharedGeneration = generation
+
+
+def get_variety_records(variety_ids):
+  """ returns {(variety_id, param): record} for all parameters of the varieties """
+  keys = [(variety_id, param) for variety_id in variety_ids for param in conf['PARAMS']]
+  return gRecorder.getRecords(keys)
+
+
+def handle_batch(req, resp, binary=False):
+  requests = req.get("requests")
+  if not isinstance(requests, list):
+    resp["error"] = "requests must be a list"
+    return resp
+  # one lookup pass for all job_utilization requests of the batch
+  variety_ids = {sub_req["variety_id"] for sub_req in requests
+                 if isinstance(sub_req, dict) and sub_req.get("type") == "job_utilization" and "variety_id" in sub_req}
+  # the stale responses are dropped first, so that their varieties are prefetched
+  sync_response_cache()
+  if gResponseCache is not None:
+    variety_ids = [variety_id for variety_id in variety_ids if variety_id not in gResponseCache]
+  records = get_variety_records(variety_ids) if variety_ids else {}
+  responses = []
+  for sub_req in requests:
+    if not isinstance(sub_req, dict):
+      responses.append({"status": "error", "req_id": "error", "error": "request must be an object"})
+    elif not isinstance(sub_req.get("type"), str) or sub_req["type"] not in BATCH_TYPES:
+      responses.append({"status": "error", "req_id": sub_req.get("req_id", "error"),
+                        "error": "{} is not allowed in a batch".format(sub_req.get("type"))})
+    else:
+      responses.append(handle_request(sub_req, records, binary))
+  resp["responses"] = responses
+  resp["status"] = "OK"
+  return resp
+
+
+def handle_request(req, records=None, binary=False):
+  """
+  Computes the response (a dictionary) for a decoded request.
+  Used by all server modes.
+  :param records: records prefetched with get_variety_records (used by batches)
+  :param binary: whether the response is for the binary encoding (numbers are not converted to strings)
+  """
+  fmt = scale_value if binary else format_value
+  resp = {"status": "error"}
+  resp["req_id"] = req.get("req_id", "error")
+
+  if "type" not in req:
+    return resp
+
+  req_type = req["type"]
+
+  try:
+    if req_type == "process_job":
+      if "job_id" in req and "variety_id" in req:
+        if "job_start" in req or "job_end" in req or "job_nodes" in req:
+          if "job_start" in req and "job_end" in req and "job_nodes" in req:
+            m = Message(time.time() + conf['PROCESSING_DELAY'],
+                        int(req['job_id']),
+                        req['variety_id'],
+                        req['job_start'],
+                        req['job_end'],
+                        req['job_nodes'])
+            if gMessageQueue.put(m) is False:
+              resp["duplicate"] = True
+            resp["status"] = "ACK"
+          else:
+            resp["status"] = "error"
+            resp["error"] = "job_start, job_end, and job_nodes must be specified together"
+        else:
+          m = Message(time.time() + conf['PROCESSING_DELAY'],
+                      int(req['job_id']),
+                      req['variety_id'])
+          # the message queues of serving processes do not know (None)
+          if gMessageQueue.put(m) is False:
+            resp["duplicate"] = True
+          resp["status"] = "ACK"
+
+    elif req_type == "analyze_job":
+      if "job_id" not in req:
+        resp["status"] = "error"
+        resp["error"] = "job_id not specified"
+      else:
+        job_id = int(req['job_id'])
+        try:
+          entry = gAnalysisPool.submit(job_id)
+        except BusyError:
+          return busy_response(req)
+        if req.get("async"):
+          resp["status"] = "ACK"
+          resp["job_id"] = job_id
+          resp["handle"] = entry.handle
+        else:
+          entry.done.wait()
+          fill_analysis_response(resp, entry, fmt)
+
+    elif req_type == "analyze_job/result":
+      if "handle" not in req:
+        resp["error"] = "handle not specified"
+      else:
+        timeout = min(float(req.get("timeout", 0)), conf['ANALYSIS_MAX_WAIT'])
+        entry = gAnalysisPool.get(str(req["handle"]), timeout)
+        if entry is None:
+          resp["error"] = "unknown or expired handle"
+        elif not entry.done.is_set():
+          resp["status"] = "pending"
+          resp["job_id"] = entry.key
+          resp["handle"] = entry.handle
+        else:
+          fill_analysis_response(resp, entry, fmt)
+          resp["handle"] = entry.handle
+
+    elif req_type.startswith("variety_id"):
+      if req_type == "variety_id/manual":
+        if "variety_name" in req:
+          resp["status"] = "OK"
+          resp["variety_id"] = str_to_variety_id(req["variety_name"])
+        else:
+          resp["status"] = "error"
+          resp["error"] = "variety_name not specified"
+      elif req_type == "variety_id/auto":
+        # TODO: improve the algorithm
+        if "script_args" in req:
+          args = req["script_args"]
+          if args:
+            resp["status"] = "OK"
+            args_str = json.dumps(args)
+            resp["variety_id"] = str_to_variety_id(args_str)
+          else:
+            resp["error"] = "script_args is empty"
+        else:
+          resp["error"] = "script_args is not specified"
+      else:
+        resp["error"] = "wrond variety_id option"
+
+    elif req_type == "usage":
+      cu_avg = get_current_utilization()
+      resp["status"] = "OK"
+      # TODO: change to new protocol
+      name = conf['DELTAS'][0]
+      resp["response"] = {"lustre" : fmt(name, 0) if conf['zero_current_utilization'] else fmt(name, cu_avg[name])}
+
+    elif req_type == "job_utilization":
+      if "variety_id" in req:
+        variety_id = req["variety_id"]
+        sync_response_cache()
+        if gResponseCache is None:
+          entry = job_utilization_body(variety_id, records)
+        else:
+          entry = gResponseCache.get(variety_id)
+          if entry is None:
+            generation = gResponseCache.generation
+            entry = job_utilization_body(variety_id, records)
+            gResponseCache.put(variety_id, entry, generation)
+        body, encoded_body, numeric_body = entry
+        if binary:
+          resp.update(numeric_body)
+          return resp
+        return CachedResponse(resp["req_id"], body, encoded_body)
+      else:
+        resp["error"] = "variety_id not specified"
+
+    elif req_type == 'process_canary_probe':
+      if gCanaryStore is None:
+        resp["status"] = "error"
+        resp["error"] = "Not configured"
+      else:
+        process_canary_probe(req, resp)
+
+    elif req_type == "batch":
+      handle_batch(req, resp, binary)
+
+    elif req_type == "hello":
+      encoding = req.get("encoding")
+      if encoding in (None, "json", "binary"):
+        resp["status"] = "OK"
+        if encoding is not None:
+          resp["encoding"] = encoding
+        if "out_of_order" in req:
+          resp["out_of_order"] = bool(req["out_of_order"])
+      else:
+        resp["error"] = "unknown encoding {}".format(encoding)
+
+    elif req_type == "stats":
+      resp["status"] = "OK"
+      resp["response"] = gStats.report()
+      if isinstance(gRecorder, EstimateCache):
+        resp["response"]["estimate_cache"] = gRecorder.stats()
+      if gResponseCache is not None:
+        resp["response"]["response_cache"] = gResponseCache.stats()
+      resp["response"]["lanes"] = gAdmission.stats()
+      resp["response"]["analysis"] = gAnalysisPool.stats()
+      if isinstance(gMessageQueue, CombinedQueue):
+        resp["response"]["job_queue"] = gMessageQueue.stats()
+
+    elif req_type == "access_log":
+      resp["status"] = "OK"
+      count = req.get("count")
+      resp["response"] = gAccessLog.last(int(count) if count is not None else None)
+
+    elif req_type == "trace":
+      resp["status"] = "OK"
+      count = req.get("count")
+      resp["response"] = gTracer.last(int(count) if count is not None else None)
+
+    else:
+      resp["status"] = "not implemented"
+  except Exception as err:
+    resp["status"] = "error"
+    resp["error"] = "Exception: {}".format(err)
+    print("---- Error caught... ----")
+    traceback.print_exc()
+    print("---- ...continuing  -----")
+
+  return resp
+
+
+def fill_analysis_response(resp, entry, fmt):
+  """ fills the response to analyze_job from a finished entry of gAnalysisPool """
+  resp['job_id'] = entry.key
+  if entry.error is not None:
+    resp["status"] = "error"
+    resp["error"] = entry.error
+  elif entry.result is None:
+    resp["status"] = "error"
+    resp["error"] = "no data for the job"
+  else:
+    min_time, max_time, delta_time, results = entry.result
+    resp["status"] = ""
+    resp['start_time'] = min_time
+    resp['end_time'] = max_time
+    resp['duration'] = delta_time
+    for k in results:
+      name = conf['TRANSLATE'].get(k, k)
+      avg, var = results[k]
+      resp[name] = {'avg': fmt(k, avg), 'std': fmt(k, math.sqrt(var))}
+
+
+def busy_response(req):
+  return {"req_id": req.get("req_id", "error"), "status": "busy"}
+
+
+def serve_request(req, binary=False):
+  """
+  Handles a request in its lane (see gAdmission);
+  the response is "busy" if the lane is full
+  """
+  lane = gAdmission.lane(req.get("type"))
+  if not lane.admit():
+    return busy_response(req)
+  return lane.run(handle_request, req, None, binary)
+
+
+def decode_request(data):
+  """
+  Decodes one message received from a client.
+  Returns the request (a dictionary) or None if the message cannot be decoded.
+  """
+  try:
+    req = json.loads(data)
+  except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+    return None
+  if not isinstance(req, dict):
+    return None
+  return req
+
+
+class ClientConnection:
+  """
+  State of one client connection: framing and encoding of the messages.
+  The connection starts with the JSON encoding and in-order responses;
+  both can be changed with a "hello" request.
+  In the out-of-order mode, requests other than "hello" are handled concurrently
+  and the responses are sent as soon as they are ready (see dispatched()).
+  """
+
+  def __init__(self, client_address):
+    self.client_address = client_address
+    self.binary = False
+    self.out_of_order = False
+    self.framer = wire_protocol.LineBuffer(conf['MAX_MESSAGE'])
+
+  def feed(self, data):
+    """ adds received data (may raise wire_protocol.MessageTooLongError) """
+    self.framer.feed(data)
+
+  def requests(self):
+    """
+    Yields the received requests (None for a message that cannot be decoded)
+    with the time they were received.
+    respond() must be called for each request that is not dispatched() before getting the next one,
+    as it may change the framing.
+    """
+    message = self.framer.next_message()
+    while message is not None:
+      started = time.perf_counter()
+      if self.binary:
+        try:
+          req = wire_protocol.decode_binary(message)
+        except wire_protocol.DecodeError:
+          req = None
+        if not isinstance(req, dict):
+          req = None
+        TCPlog.debug("%s wrote: %s", self.client_address, req)
+      else:
+        TCPlog.debug("%s wrote: %s", self.client_address, message)
+        req = decode_request(message)
+      yield req, started
+      message = self.framer.next_message()
+
+  def dispatched(self, req):
+    """ whether the request is to be handled concurrently (in the out-of-order mode) """
+    return self.out_of_order and req is not None and req.get("type") != "hello"
+
+  def respond(self, req, resp, started, binary=None):
+    """
+    Returns the encoded response to the request (resp is ignored if req is None).
+    Applies a successful "hello".
+    :param started: the time the request was received (see requests())
+    :param binary: the encoding of the response (the current one if None)
+    """
+    if binary is None:
+      binary = self.binary
+    if req is None:
+      resp = {"status": "error", "error": "decode error" if binary else "JSON decode error", "req_id": "error"}
+      req_type = "invalid"
+    elif not isinstance(req.get("type"), str) or req["type"] not in REQUEST_TYPES:
+      # do not let arbitrary types grow the statistics
+      req_type = "unknown"
+    else:
+      req_type = req["type"]
+    if binary:
+      TCPlog.debug("response: %s", resp)
+      out = wire_protocol.encode_frame(resp)
+    else:
+      text = encode_response(resp)
+      TCPlog.debug("response: %s", text)
+      out = (text + "\n").encode('utf-8')
+    elapsed = time.perf_counter() - started
+    status = resp.get("status")
+    gStats.record(req_type, elapsed, status == "error")
+    gAccessLog.record(self.client_address, resp.get("req_id"), req_type, status, elapsed)
+    if req is not None and req.get("type") == "hello" and status == "OK":
+      if "encoding" in resp:
+        self.set_encoding(resp["encoding"])
+      self.out_of_order = resp.get("out_of_order", self.out_of_order)
+    return out
+
+  def set_encoding(self, encoding):
+    binary = encoding == "binary"
+    if binary == self.binary:
+      return
+    rest = self.framer.take_rest()
+    if binary:
+      self.framer = wire_protocol.FrameBuffer(conf['MAX_MESSAGE'])
+    else:
+      self.framer = wire_protocol.LineBuffer(conf['MAX_MESSAGE'])
+    self.binary = binary
+    self.framer.feed(rest)
+
+
 class MyTCPHandler(socketserver.BaseRequestHandler):
   """
   The request handler class for our server.
@@ -990,157 +1921,274 @@ class MyTCPHandler(socketserver.BaseRequestHandler):
   client.
   """
 
+  # threads that handle the requests of connections in the out-of-order mode (created when needed)
+  executor = None
+  executor_lock = threading.Lock()
+
   def str_to_variety_id(self, string):
-    return hashlib.sha256(string.encode('utf-8')).hexdigest()
+    return str_to_variety_id(string)
+
+  @classmethod
+  def get_executor(cls):
+    with cls.executor_lock:
+      if cls.executor is None:
+        cls.executor = concurrent.futures.ThreadPoolExecutor(max_workers=conf['OUT_OF_ORDER_WORKERS'])
+      return cls.executor
+
+  def setup(self):
+    gStats.connection_opened()
+
+  def finish(self):
+    gStats.connection_closed()
 
   def handle(self):
     global g_state  # TODO: Not used
 
-    while 1:
-      # self.request is the TCP socket connected to the client
-      self.data = self.request.recv(conf['MAX']).strip()
-      TCPlog.info("{} wrote: {}".format(self.client_address[0], self.data))
+    # client_address is empty for Unix domain sockets
+    connection = ClientConnection(self.client_address[0] if self.client_address else "local")
+    self.send_lock = threading.Lock()
+    pending = set()  # requests handled concurrently (out-of-order mode)
+    try:
+      while 1:
+        # self.request is the TCP socket connected to the client
+        data = self.request.recv(conf['MAX'])
+
+        if not data:
+          TCPlog.info("closing connection")
+          break
 
-      if not self.data:
-        TCPlog.info("closing connection")
-        break
+        # pipelined requests are answered in order with one write
+        responses = []
+        try:
+          connection.feed(data)
+          for req, started in connection.requests():
+            if connection.dispatched(req):
+              pending.add(self.get_executor().submit(self.respond_later, connection, req, started,
+                                                     connection.binary))
+              continue
+            resp = serve_request(req, connection.binary) if req is not None else None
+            responses.append(connection.respond(req, resp, started))
+        except wire_protocol.MessageTooLongError as e:
+          TCPlog.error("%s: %s, closing connection", connection.client_address, str(e))
+          break
+        if responses:
+          self.send(b"".join(responses))
+        pending = {future for future in pending if not future.done()}
+    finally:
+      # the responses to the dispatched requests are sent before the connection is closed
+      concurrent.futures.wait(pending)
+
+  def send(self, data):
+    with self.send_lock:
+      self.request.sendall(data)
+
+  def respond_later(self, connection, req, started, binary):
+    """ handles a dispatched request and sends the response (out-of-order mode) """
+    resp = serve_request(req, binary)
+    try:
+      self.send(connection.respond(req, resp, started, binary))
+    except OSError as e:
+      TCPlog.info("%s: could not send the response: %s", connection.client_address, str(e))
 
-      resp = {"status": "error"}
 
-      try:
-        req = json.loads(self.data)
-      except json.decoder.JSONDecodeError:
-        resp["error"] = "JSON decode error"
-        req = {}
+###################################################
+#
+# asyncio server mode
+#
+###################################################
 
-      resp["req_id"] = req.get("req_id", "error")
+# requests of these types may block on SOS and are handled in the executor
+ASYNC_BLOCKING_TYPES = {"analyze_job", "analyze_job/result", "job_utilization", "process_canary_probe", "batch"}
 
-      if "type" in req:
-        req_type = req["type"]
 
+class AsyncServer:
+  """
+  Serves the same protocol as MyTCPHandler from a single event loop.
+
+  Blocking requests (see ASYNC_BLOCKING_TYPES) are handled by a pool of worker threads
+  so that they do not stall the loop.
+  Lanes with bounded concurrency (see gAdmission) have their own pools,
+  so that their requests do not hold up the other requests.
+  """
+
+  def __init__(self, max_connections, idle_timeout, n_workers):
+    """
+    :param max_connections: maximum number of simultaneously open connections
+    :param idle_timeout: seconds before an idle connection is closed (0 or None to disable)
+    :param n_workers: number of threads that handle blocking requests
+    """
+    self.max_connections = max_connections
+    self.idle_timeout = idle_timeout if idle_timeout else None
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+    self.lane_executors = {name: concurrent.futures.ThreadPoolExecutor(max_workers=lane.max_running)
+                           for name, lane in gAdmission.lanes.items() if lane.max_running}
+    self.n_connections = 0
+
+  async def handle_request(self, req, binary):
+    lane = gAdmission.lane(req.get("type"))
+    if not lane.admit():
+      return busy_response(req)
+    if str(req.get("type")) in ASYNC_BLOCKING_TYPES or lane.name in self.lane_executors:
+      loop = asyncio.get_event_loop()
+      executor = self.lane_executors.get(lane.name, self.executor)
+      return await loop.run_in_executor(executor, lane.run, handle_request, req, None, binary)
+    return lane.run(handle_request, req, None, binary)
+
+  async def respond_later(self, connection, writer, drain_lock, req, started, binary):
+    """
+    handles a dispatched request and writes the response (out-of-order mode);
+    waits while the client is slow to read (drain_lock serializes drain() of the connection)
+    """
+    resp = await self.handle_request(req, binary)
+    try:
+      writer.write(connection.respond(req, resp, started, binary))
+      async with drain_lock:
+        await writer.drain()
+    except (ConnectionError, OSError) as e:
+      TCPlog.info("%s: could not send the response: %s", connection.client_address, str(e))
+
+  async def handle_connection(self, reader, writer):
+    peer = writer.get_extra_info('peername')
+    client_address = peer[0] if isinstance(peer, tuple) else "local"
+    if self.n_connections >= self.max_connections:
+      TCPlog.warning("too many connections (%d), rejecting %s", self.n_connections, client_address)
+      writer.close()
+      return
+    self.n_connections += 1
+    gStats.connection_opened()
+    connection = ClientConnection(client_address)
+    pending = set()  # requests handled concurrently (out-of-order mode)
+    drain_lock = asyncio.Lock()
+    try:
+      while True:
         try:
-          if req_type == "process_job":
-            if "job_id" in req and "variety_id" in req:
-              if "job_start" in req or "job_end" in req or "job_nodes" in req:
-                if "job_start" in req and "job_end" in req and "job_nodes" in req:
-                  m = Message(time.time() + conf['PROCESSING_DELAY'],
-                              int(req['job_id']),
-                              req['variety_id'],
-                              req['job_start'],
-                              req['job_end'],
-                              req['job_nodes'])
-                  gMessageQueue.put(m)
-                  resp["status"] = "ACK"
-                else:
-                  resp["status"] = "error"
-                  resp["error"] = "job_start, job_end, and job_nodes must be specified together"
-              else:
-                m = Message(time.time() + conf['PROCESSING_DELAY'],
-                            int(req['job_id']),
-                            req['variety_id'])
-                gMessageQueue.put(m)
-                resp["status"] = "ACK"
-
-          elif req_type == "analyze_job":
-            if "job_id" not in req:
-              resp["status"] = "error"
-              resp["error"] = "job_id not specified"
-            else:
-              job_id = int(req['job_id'])
-              resp['job_id'] = job_id
-              datasource = SosDataSource()
-              datasource.config(path=conf['PATH'])
-              res = analyze_job(datasource, job_id, TCPlog)
-              if res is None:
-                resp["status"] = "error"
-                resp["error"] = "no data for the job"
-              else:
-                min_time, max_time, delta_time, results = res
-                resp["status"] = ""
-                resp['start_time'] = min_time
-                resp['end_time'] = max_time
-                resp['duration'] = delta_time
-                for k in results:
-                  name = conf['TRANSLATE'].get(k, k)
-                  avg, var = results[k]
-                  resp[name] = {'avg': format_value(k, avg), 'std': format_value(k, math.sqrt(var))}
-
-
-          elif req_type.startswith("variety_id"):
-            if req_type == "variety_id/manual":
-              if "variety_name" in req:
-                resp["status"] = "OK"
-                resp["variety_id"] = self.str_to_variety_id(req["variety_name"])
-              else:
-                resp["status"] = "error"
-                resp["error"] = "variety_name not specified"
-            elif req_type == "variety_id/auto":
-              # TODO: improve the algorithm
-              if "script_args" in req:
-                args = req["script_args"]
-                if args:
-                  resp["status"] = "OK"
-                  args_str = json.dumps(args)
-                  resp["variety_id"] = self.str_to_variety_id(args_str)
-                else:
-                  resp["error"] = "script_args is empty"
-              else:
-                resp["error"] = "script_args is not specified"
-            else:
-              resp["error"] = "wrond variety_id option"
-
-          elif req_type == "usage":
-            with gCU_lock:
-              cu_avg = gCU_avg
-            resp["status"] = "OK"
-            # TODO: change to new protocol
-            name = conf['DELTAS'][0]
-            resp["response"] = {"lustre" : "0" if conf['zero_current_utilization'] else format_value(name, cu_avg[name])}
-
-          elif req_type == "job_utilization":
-            if "variety_id" in req:
-              variety_id = req["variety_id"]
-              utilization = {}
-              for param in conf['PARAMS']:
-                record = gRecorder.getRecord(variety_id, param)
-                if record:
-                  avg, var = record[0:2]
-                  name = conf['TRANSLATE'].get(param, param)
-                  val = avg + conf['K_SIGMA'][param] * math.sqrt(var)
-                  utilization[name] = format_value(param, val)
-              resp["response"] = utilization
-              resp["status"] = "OK"
-            else:
-              resp["error"] = "variety_id not specified"
-
-          elif req_type == 'process_canary_probe':
-            if gCanaryStore is None:
-              resp["status"] = "error"
-              resp["error"] = "Not configured"
-            else:
-              process_canary_probe(req, resp)
-          else:
-            resp["status"] = "not implemented"
-        except Exception as err:
-          resp["status"] = "error"
-          resp["error"] = "Exception: {}".format(err)
-          print("---- Error caught... ----")
-          traceback.print_exc()
-          print("---- ...continuing  -----")
+          data = await asyncio.wait_for(reader.read(conf['MAX']), self.idle_timeout)
+        except asyncio.TimeoutError:
+          TCPlog.info("closing idle connection from %s", client_address)
+          break
+
+        if not data:
+          TCPlog.info("closing connection")
+          break
+
+        try:
+          connection.feed(data)
+          for req, started in connection.requests():
+            if connection.dispatched(req):
+              task = asyncio.ensure_future(self.respond_later(connection, writer, drain_lock, req, started,
+                                                              connection.binary))
+              pending.add(task)
+              task.add_done_callback(pending.discard)
+              continue
+            resp = await self.handle_request(req, connection.binary) if req is not None else None
+            writer.write(connection.respond(req, resp, started))
+        except wire_protocol.MessageTooLongError as e:
+          TCPlog.error("%s: %s, closing connection", client_address, str(e))
+          break
+        async with drain_lock:
+          await writer.drain()
+    except (ConnectionError, OSError) as e:
+      TCPlog.info("connection from %s lost: %s", client_address, str(e))
+    finally:
+      # the responses to the dispatched requests are sent before the connection is closed
+      if pending:
+        await asyncio.wait(pending)
+      self.n_connections -= 1
+      gStats.connection_closed()
+      writer.close()
+
+  def serve_forever(self, host, port, reuse_port=False, unix_listener=None):
+    """
+    :param unix_listener: listening Unix domain socket (see bind_unix_socket) served along with the TCP port
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    servers = [loop.run_until_complete(asyncio.start_server(self.handle_connection, host, port,
+                                                            reuse_port=reuse_port))]
+    TCPlog.info("asyncio server is listening on %s:%d", host, port)
+    if unix_listener is not None:
+      servers.append(loop.run_until_complete(asyncio.start_unix_server(self.handle_connection,
+                                                                       sock=unix_listener)))
+      TCPlog.info("asyncio server is listening on %s", unix_listener.getsockname())
+    try:
+      loop.run_forever()
+    finally:
+      for server in servers:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+      self.executor.shutdown(wait=False)
+      for executor in self.lane_executors.values():
+        executor.shutdown(wait=False)
+
+
+class ReusePortThreadingTCPServer(socketserver.ThreadingTCPServer):
+  """ ThreadingTCPServer that shares its port with other processes """
+
+  def server_bind(self):
+    self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    super().server_bind()
+
+
+class ListenerThreadingUnixStreamServer(socketserver.ThreadingUnixStreamServer):
+  """ ThreadingUnixStreamServer that serves an already listening socket (see bind_unix_socket) """
+
+  def __init__(self, listener, handler_class):
+    super().__init__(listener.getsockname(), handler_class, bind_and_activate=False)
+    self.socket.close()
+    self.socket = listener
+
+
+def bind_unix_socket(path):
+  """
+  Creates the listening Unix domain socket (a stale socket file left by a previous run is removed).
+  The socket is created once and shared by all serving processes.
+  """
+  if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+    os.unlink(path)
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  listener.bind(path)
+  listener.listen(socket.SOMAXCONN)
+  return listener
+
+
+def stats_thread():
+  """ periodically dumps the request statistics of this process to a table """
+  table = table_log.TableLog(conf['prefixSaveTables'] + "request_stats_table.csv", title=STATS_TITLES)
+  previous = {}
+  while True:
+    time.sleep(conf['STATS_PERIOD'])
+    rows, previous = gStats.dump_rows(previous)
+    for row in rows:
+      table.log(row)
 
-      resp = json.dumps(resp)
 
-      TCPlog.info("response: %s", resp)
+def _start_server(host, port, reuse_port=False, unix_listener=None):
+  """
+  Serves the TCP port and, if unix_listener is given, the Unix domain socket
+  (both with the same request handler)
+  """
 
-      resp += "\n"
-      self.request.sendall(resp.encode('utf-8'))
+  if conf['doSaveTables'] and conf['STATS_PERIOD']:
+    th_stats = threading.Thread(target=stats_thread)
+    th_stats.daemon = True
+    th_stats.start()
 
+  if conf['server_mode'] == 'asyncio':
+    server = AsyncServer(conf['MAX_CONNECTIONS'], conf['IDLE_TIMEOUT'], conf['ASYNC_WORKERS'])
+    server.serve_forever(host, port, reuse_port, unix_listener)
+    return
 
-def _start_server(host, port):
-  # prepare global state
+  if unix_listener is not None:
+    unix_server = ListenerThreadingUnixStreamServer(unix_listener, MyTCPHandler)
+    unix_server.daemon_threads = True
+    th_unix = threading.Thread(target=unix_server.serve_forever)
+    th_unix.daemon = True
+    th_unix.start()
+    TCPlog.info("listening on %s", unix_listener.getsockname())
 
   # Create the server, binding to host on port
-  server = socketserver.ThreadingTCPServer((host, port), MyTCPHandler, bind_and_activate=True)
+  server_class = ReusePortThreadingTCPServer if reuse_port else socketserver.ThreadingTCPServer
+  server = server_class((host, port), MyTCPHandler, bind_and_activate=True)
   server.daemon_threads = True
 
   # Activate the server; this will keep running until you
@@ -1148,12 +2196,126 @@ def _start_server(host, port):
   server.serve_forever()
 
 
-logging.getLogger().setLevel(logging.DEBUG)
+###################################################
+#
+# multi-process serving
+#
+###################################################
+
+class ForwardingQueue:
+  """
+  Stands in for gMessageQueue in serving processes:
+  the messages are passed to the writer process
+  """
+
+  def __init__(self, forward_queue):
+    self.forward_queue = forward_queue
+
+  def put(self, item):
+    self.forward_queue.put(('message', item))
+
+
+class ForwardingCanaryStore:
+  """
+  Stands in for gCanaryStore in serving processes:
+  new records are passed to the writer process, reads are done locally
+  """
+
+  def __init__(self, forward_queue, store):
+    self.forward_queue = forward_queue
+    self.store = store
+
+  def saveRecord(self, time, ost, duration):
+    self.forward_queue.put(('canary', (time, ost, duration)))
+
+  def getAverageValue(self, *args, **kwargs):
+    return self.store.getAverageValue(*args, **kwargs)
+
+
+def dump_access_log(signum, frame):
+  gAccessLog.dump()
+
+
+def serving_process(forward_queue, host, port, unix_listener):
+  """ the job for the forked serving processes """
+  global gRecorder, gMessageQueue, gCanaryStore
+  signal.signal(signal.SIGUSR1, dump_access_log)
+  gRecorder = gSharedEstimates
+  gMessageQueue = ForwardingQueue(forward_queue)
+  if gCanaryStore is not None:
+    gCanaryStore = ForwardingCanaryStore(forward_queue, gCanaryStore)
+  _start_server(host, port, reuse_port=True, unix_listener=unix_listener)
+
+
+def start_serving_processes(host, port, n_processes, unix_listener=None):
+  """
+  Publishes the predictions to the shared table and forks the serving processes.
+  Must be called before any thread is started.
+  :return: (queue of requests forwarded to this (writer) process, list of serving processes)
+  """
+  global gSharedEstimates
+  log = logging.getLogger("writer")
+  gSharedEstimates = SharedEstimateTable(conf['SHARED_TABLE_SLOTS'], conf['DELTAS'])
+  n_records = 0
+  for variety_id, param, *record in gRecorder.loadRecords():
+    if not gSharedEstimates.publish_record(variety_id, param, record):
+      break
+    n_records += 1
+  log.info("published %d records to the shared table", n_records)
+
+  ctx = multiprocessing.get_context('fork')
+  forward_queue = ctx.Queue()
+  processes = []
+  for _ in range(n_processes):
+    p = ctx.Process(target=serving_process, args=(forward_queue, host, port, unix_listener), daemon=True)
+    p.start()
+    processes.append(p)
+  log.info("started %d serving processes", n_processes)
+  return forward_queue, processes
+
+
+def writer_loop(forward_queue, processes):
+  """ processes requests forwarded by the serving processes """
+  log = logging.getLogger("writer")
+  while True:
+    try:
+      kind, item = forward_queue.get(timeout=1)
+    except queue.Empty:
+      alive = [p for p in processes if p.is_alive()]
+      if len(alive) < len(processes):
+        for p in processes:
+          if not p.is_alive():
+            log.error("serving process %d exited with code %s", p.pid, str(p.exitcode))
+        processes = alive
+        if not processes:
+          raise SystemExit("no serving processes left")
+      continue
+    try:
+      if kind == 'message':
+        gMessageQueue.put(item)
+      elif kind == 'canary':
+        gCanaryStore.saveRecord(*item)
+      else:
+        log.error("unknown forwarded request: %s", str(kind))
+    except Exception:
+      log.exception("could not process forwarded request")
+
+
+logging.getLogger().setLevel(conf['log_level'])
 
 if __name__ == "__main__":
 
+  # the last requests are written to the access log on SIGUSR1
+  signal.signal(signal.SIGUSR1, dump_access_log)
+
   host = args.address
   port = args.port
+  unix_listener = bind_unix_socket(conf['unix_socket']) if conf['unix_socket'] else None
+
+  if conf['serving_processes'] > 1:
+    # the serving processes must be forked before any thread is started
+    forward_queue, serving_processes = start_serving_processes(host, port, conf['serving_processes'],
+                                                               unix_listener)
 
   # start thread that processes completed jobs
   th_cj = threading.Thread(target=processing_thread)
@@ -1171,4 +2333,7 @@ if __name__ == "__main__":
   th_cu.daemon = True
   th_cu.start()
 
-  _start_server(host, port)
+  if conf['serving_processes'] > 1:
+    writer_loop(forward_queue, serving_processes)
+  else:
+    _start_server(host, port, unix_listener=unix_listener)
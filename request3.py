@@ -26,32 +26,34 @@ CLI interface implementation for pysimserv3
 
 """
 
-import socket
 import json
 import sys
 
+import simserv_client
+
 
 class Communicatior(object):
   """
-
+  Sends requests to the server and receives the responses
+  (a thin wrapper of simserv_client.Connection, which tools should use directly).
+  With encoding="binary", the binary encoding is negotiated when the connection is established;
+  the messages are then dictionaries rather than JSON strings.
+  If unix_socket (a path) is given, it is used instead of host and port.
   """
 
-  def __init__(self, host, port):
-    self.host = host
-    self.port = port
-    self.socket = None
+  def __init__(self, host, port, encoding="json", unix_socket=None):
+    self.encoding = encoding
+    self.connection = simserv_client.Connection(host, port, unix_socket, encoding)
 
 
   def send_receive(self, message):
-    if self.socket is None:
-      # try to establish the connection
-      self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-      self.socket.connect((self.host, self.port))
-
-    self.socket.send(message.encode('utf-8'))
-    data = self.socket.recv(1024)
-
-    return data
+    """
+    :param message: JSON string (or a dictionary for the binary encoding)
+    :return: the response as a JSON string (or a dictionary for the binary encoding)
+    """
+    if self.encoding == "binary":
+      return self.connection.call(message)
+    return json.dumps(self.connection.call(json.loads(message)))
 
 
 
@@ -75,6 +77,8 @@ def main():
   host = params.pop('h', 'localhost')
   type = params.pop('type', 'usage')
   req_id = params.pop('req_id', '1')
+  encoding = params.pop('e', 'json')
+  unix_socket = params.pop('u', None)
 
 
   req = {
@@ -105,11 +109,11 @@ def main():
 
   message = json.dumps(req)
 
-  print("Request to {}:{}".format(host, port))
+  print("Request to {}".format(unix_socket if unix_socket else "{}:{}".format(host, port)))
   print(message)
 
-  c = Communicatior(host, port)
-  resp = c.send_receive(message)
+  c = Communicatior(host, port, encoding, unix_socket)
+  resp = c.send_receive(req if encoding == "binary" else message)
   print("Responce:")
   print(resp)
 
@@ -0,0 +1,168 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Request counters and latency histograms of the server (reported by the "stats" request)
+
+Latencies are counted in buckets with power-of-two bounds (in microseconds),
+so recording a request is a few integer operations under a lock.
+
+"""
+
+import copy
+import os
+import threading
+import time
+
+N_BUCKETS = 32  # bucket i counts latencies below 2**i microseconds (the last one is open-ended)
+# columns of the table of periodic dumps (max_ms is the maximum since the start)
+STATS_TITLES = ["time", "pid", "type", "count", "errors", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]
+
+
+def bucket_index(seconds):
+  return min(int(seconds * 1e6).bit_length(), N_BUCKETS - 1)
+
+
+class TypeStats(object):
+  """ counters of one request type """
+
+  __slots__ = ('count', 'errors', 'total', 'max', 'buckets')
+
+  def __init__(self):
+    self.count = 0
+    self.errors = 0
+    self.total = 0.0  # seconds
+    self.max = 0.0  # seconds
+    self.buckets = [0] * N_BUCKETS
+
+  def since(self, previous):
+    """ returns the counters accumulated after the snapshot previous (max is not reset) """
+    diff = TypeStats()
+    diff.count = self.count - previous.count
+    diff.errors = self.errors - previous.errors
+    diff.total = self.total - previous.total
+    diff.max = self.max
+    diff.buckets = [n - p for n, p in zip(self.buckets, previous.buckets)]
+    return diff
+
+  def percentile(self, q):
+    """ returns the upper bound (in seconds) of the bucket that contains the q-th percentile """
+    if not self.count:
+      return 0.0
+    rank = q / 100.0 * self.count
+    seen = 0
+    for i, n in enumerate(self.buckets):
+      seen += n
+      if seen >= rank and n:
+        return min((1 << i) * 1e-6, self.max)
+    return self.max
+
+  def summary(self):
+    return {
+      "count": self.count,
+      "errors": self.errors,
+      "mean_ms": self.total / self.count * 1e3 if self.count else 0.0,
+      "p50_ms": self.percentile(50) * 1e3,
+      "p90_ms": self.percentile(90) * 1e3,
+      "p99_ms": self.percentile(99) * 1e3,
+      "max_ms": self.max * 1e3,
+      # upper bound in microseconds -> number of requests
+      "histogram": {str(1 << i): n for i, n in enumerate(self.buckets) if n},
+    }
+
+
+class ServerStats(object):
+  """
+  Counters, error counts and latency histograms per request type,
+  and the number of open connections
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.types = {}
+    self.connections = 0
+    self.connections_total = 0
+    self.started = time.time()
+
+  def connection_opened(self):
+    with self.lock:
+      self.connections += 1
+      self.connections_total += 1
+
+  def connection_closed(self):
+    with self.lock:
+      self.connections -= 1
+
+  def record(self, req_type, elapsed, error=False):
+    """
+    :param elapsed: time spent on the request (in seconds)
+    :param error: whether the response is an error
+    """
+    i = bucket_index(elapsed)
+    with self.lock:
+      stats = self.types.get(req_type)
+      if stats is None:
+        stats = self.types[req_type] = TypeStats()
+      stats.count += 1
+      stats.total += elapsed
+      if elapsed > stats.max:
+        stats.max = elapsed
+      stats.buckets[i] += 1
+      if error:
+        stats.errors += 1
+
+  def snapshot(self):
+    """ returns a copy of the counters of all request types """
+    with self.lock:
+      return copy.deepcopy(self.types)
+
+  def report(self):
+    """ returns the statistics as reported by the "stats" request """
+    with self.lock:
+      connections = self.connections
+      connections_total = self.connections_total
+    return {
+      "pid": os.getpid(),
+      "uptime": time.time() - self.started,
+      "connections": connections,
+      "connections_total": connections_total,
+      "requests": {req_type: stats.summary() for req_type, stats in self.snapshot().items()},
+    }
+
+  def dump_rows(self, previous):
+    """
+    Returns table rows with the statistics of the requests after the snapshot previous
+    (see STATS_TITLES) and the new snapshot
+    """
+    now = time.time()
+    current = self.snapshot()
+    rows = []
+    for req_type, stats in sorted(current.items()):
+      if req_type in previous:
+        stats = stats.since(previous[req_type])
+      if not stats.count:
+        continue
+      summary = stats.summary()
+      rows.append([now, os.getpid(), req_type] + [summary[k] for k in STATS_TITLES[3:]])
+    return rows, current
+
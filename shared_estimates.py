@@ -0,0 +1,146 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Table of predictions in shared memory for serving from several processes
+
+"""
+
+import hashlib
+import logging
+import mmap
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SharedEstimateTable(object):
+  """
+  Fixed-size hash table of (avg, var, w_count, w_sum) records keyed by (variety_id, parameter)
+  and the current utilization, kept in an anonymous shared memory map.
+
+  The table must be created before forking the serving processes.
+  Only one process (the "writer") may publish; any process may read.
+  Every slot has a sequence counter that is odd while the slot is being written,
+  so readers retry instead of returning a torn record.
+
+  Has the same getRecord/getRecords interface as Recorder (read-only).
+  """
+
+  # generation (incremented on every publish), number of used slots
+  HEADER = struct.Struct('<QQ')
+  # sequence counter, key digest, avg, var, w_count, w_sum
+  SLOT = struct.Struct('<Q16s4d')
+  EMPTY_KEY = bytes(16)
+  # maximum fraction of used slots
+  MAX_LOAD = 0.9
+
+  def __init__(self, n_slots, cu_names):
+    """
+    :param n_slots: number of slots (one per variety id and parameter)
+    :param cu_names: names of the current utilization metrics
+    """
+    assert n_slots > 0
+    self.n_slots = n_slots
+    self.cu_names = list(cu_names)
+    # sequence counter and the values of current utilization
+    self.cu_struct = struct.Struct('<Q{}d'.format(len(self.cu_names)))
+    self.cu_offset = self.HEADER.size
+    self.slots_offset = self.cu_offset + self.cu_struct.size
+    self.mem = mmap.mmap(-1, self.slots_offset + n_slots * self.SLOT.size)
+    # used by the writer only
+    self.write_lock = threading.Lock()
+
+  @staticmethod
+  def _digest(variety_id, param):
+    return hashlib.blake2b((variety_id + '\0' + param).encode('utf-8'), digest_size=16).digest()
+
+  def _slot_offset(self, index):
+    return self.slots_offset + index * self.SLOT.size
+
+  def _read_slot(self, index):
+    offset = self._slot_offset(index)
+    while True:
+      seq, key, avg, var, w_count, w_sum = self.SLOT.unpack_from(self.mem, offset)
+      if seq % 2 == 0 and struct.unpack_from('<Q', self.mem, offset)[0] == seq:
+        return key, (avg, var, w_count, w_sum)
+
+  def _find(self, digest):
+    """ returns (index, record) of the slot with the key or of the empty slot where the key would go """
+    index = int.from_bytes(digest[:8], 'little') % self.n_slots
+    for _ in range(self.n_slots):
+      key, record = self._read_slot(index)
+      if key == digest or key == self.EMPTY_KEY:
+        return index, key, record
+      index = (index + 1) % self.n_slots
+    return None, None, None
+
+  def generation(self):
+    return self.HEADER.unpack_from(self.mem, 0)[0]
+
+  def getRecord(self, variety_id, param):
+    index, key, record = self._find(self._digest(variety_id, param))
+    if index is None or key == self.EMPTY_KEY:
+      return None
+    return record
+
+  def getRecords(self, keys):
+    return {k: self.getRecord(*k) for k in keys}
+
+  def publish_record(self, variety_id, param, record):
+    """ writes the record (avg, var, w_count, w_sum); returns False if the table is full """
+    digest = self._digest(variety_id, param)
+    with self.write_lock:
+      generation, used = self.HEADER.unpack_from(self.mem, 0)
+      index, key, _ = self._find(digest)
+      if key == self.EMPTY_KEY:
+        if used + 1 > self.MAX_LOAD * self.n_slots:
+          index = None
+        else:
+          used += 1
+      if index is None:
+        logger.error("shared table is full, cannot publish variety_id: \"%s\", parameter: \"%s\"",
+                     variety_id, param)
+        return False
+      offset = self._slot_offset(index)
+      seq = struct.unpack_from('<Q', self.mem, offset)[0]
+      struct.pack_into('<Q', self.mem, offset, seq + 1)
+      self.SLOT.pack_into(self.mem, offset, seq + 1, digest, *record)
+      struct.pack_into('<Q', self.mem, offset, seq + 2)
+      self.HEADER.pack_into(self.mem, 0, generation + 1, used)
+    return True
+
+  def publish_utilization(self, values):
+    """ :param values: dictionary {name: value} for all cu_names """
+    with self.write_lock:
+      seq = struct.unpack_from('<Q', self.mem, self.cu_offset)[0]
+      struct.pack_into('<Q', self.mem, self.cu_offset, seq + 1)
+      self.cu_struct.pack_into(self.mem, self.cu_offset, seq + 1, *[values[name] for name in self.cu_names])
+      struct.pack_into('<Q', self.mem, self.cu_offset, seq + 2)
+
+  def read_utilization(self):
+    while True:
+      seq, *values = self.cu_struct.unpack_from(self.mem, self.cu_offset)
+      if seq % 2 == 0 and struct.unpack_from('<Q', self.mem, self.cu_offset)[0] == seq:
+        return dict(zip(self.cu_names, values))
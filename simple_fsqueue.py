@@ -27,7 +27,8 @@ class SimpleFSQueue:
                 seq = "{now:016}-{uid}".format(now=now, uid=uid)
                 target = self._dir / seq
                 fn = target.with_suffix('.lock')
-                pickle.dump(data, fn.open('xb'))  # Write to locked file
+                with fn.open('xb') as fd:
+                    pickle.dump(data, fd)  # Write to locked file (closed before it is renamed)
                 if target.exists():
                     fn.unlink()
                 else:
@@ -45,17 +46,33 @@ class SimpleFSQueue:
             if f.match('*.lock'):
                 continue  # Someone is writing or reading the file
             try:
-                # fn = self._dir / f
-                target = f.with_suffix('.lock')
-                f.rename(target)
-                data = pickle.load(target.open('rb'))
-                target.unlink()
-                return data
+                return self.take(f)
             except FileNotFoundError:
                 pass  # The file was locked by another get()
         raise queue.Empty()
 
 
+    def files(self):
+        """Returns the files of the queue (FIFO) without removing them."""
+        return sorted(f for f in self._read_files() if not f.match('*.lock'))
+
+
+    def read(self, f):
+        """Returns the data of a file of the queue without removing it."""
+        with f.open('rb') as fd:
+            return pickle.load(fd)
+
+
+    def take(self, f):
+        """Removes a file from the queue and returns its data; raises FileNotFoundError if it was taken already."""
+        target = f.with_suffix('.lock')
+        f.rename(target)
+        with target.open('rb') as fd:
+            data = pickle.load(fd)
+        target.unlink()
+        return data
+
+
 
     def qsize(self):
         """Returns the approximate size of the queue."""
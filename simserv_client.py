@@ -0,0 +1,351 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Client library for pysimserv3 (see protocol.md)
+
+* Connection: one persistent connection (reconnects on the next call after an error);
+* ConnectionPool: thread-safe pool of connections;
+* AsyncClient: one connection for asyncio programs.
+
+All of them send requests (dictionaries) and return responses (dictionaries),
+either one at a time (call), several pipelined in one write (pipeline),
+or as one "batch" request (batch).
+Requests without "req_id" get one assigned.
+
+"""
+
+import asyncio
+import collections
+import itertools
+import json
+import queue
+import socket
+import threading
+
+import wire_protocol
+
+MAX_MESSAGE = 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+class ClientError(Exception):
+  pass
+
+
+def hello_request(encoding):
+  return {"req_id": "hello", "type": "hello", "encoding": encoding}
+
+
+def encode_request(req, binary):
+  if binary:
+    return wire_protocol.encode_frame(req)
+  return (json.dumps(req) + "\n").encode('utf-8')
+
+
+def decode_response(message, binary):
+  try:
+    if binary:
+      return wire_protocol.decode_binary(message)
+    return json.loads(message.decode('utf-8'))
+  except (ValueError, wire_protocol.DecodeError) as e:
+    raise ClientError("could not decode the response: {}".format(e))
+
+
+def check_hello(resp, encoding):
+  if resp.get("status") != "OK":
+    raise ClientError("the server does not support the {} encoding: {}".format(encoding, resp))
+
+
+def batch_responses(resp):
+  if resp.get("status") != "OK":
+    raise ClientError("batch failed: {}".format(resp))
+  return resp["responses"]
+
+
+class _RequestIds(object):
+  """ assigns req_id to requests without one """
+
+  def __init__(self):
+    self.counter = itertools.count(1)
+    self.lock = threading.Lock()
+
+  def assign(self, reqs):
+    out = []
+    for req in reqs:
+      if "req_id" not in req:
+        with self.lock:
+          req = dict(req, req_id=str(next(self.counter)))
+      out.append(req)
+    return out
+
+
+class Connection(object):
+  """ one persistent connection to the server (not thread-safe; see ConnectionPool) """
+
+  def __init__(self, host="localhost", port=9999, unix_socket=None, encoding="json", timeout=None):
+    """
+    :param unix_socket: path of the Unix domain socket of the server (used instead of host and port)
+    :param encoding: "json" or "binary" (negotiated when the connection is established)
+    :param timeout: socket timeout in seconds (None to block)
+    """
+    self.host = host
+    self.port = port
+    self.unix_socket = unix_socket
+    self.encoding = encoding
+    self.timeout = timeout
+    self.sock = None
+    self.framer = None
+    self.binary = False
+    self.req_ids = _RequestIds()
+
+  def connect(self):
+    if self.unix_socket:
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      address = self.unix_socket
+    else:
+      sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      address = (self.host, self.port)
+    sock.settimeout(self.timeout)
+    try:
+      sock.connect(address)
+    except OSError:
+      sock.close()
+      raise
+    self.sock = sock
+    self.framer = wire_protocol.LineBuffer(MAX_MESSAGE, accept_unterminated=False)
+    self.binary = False
+    if self.encoding != "json":
+      resp = self._exchange([hello_request(self.encoding)])[0]
+      if resp.get("status") != "OK":
+        self.close()
+      check_hello(resp, self.encoding)
+      self.framer = wire_protocol.FrameBuffer(MAX_MESSAGE, self.framer.take_rest())
+      self.binary = self.encoding == "binary"
+
+  def close(self):
+    if self.sock is not None:
+      self.sock.close()
+    self.sock = None
+
+  def _receive(self):
+    message = self.framer.next_message()
+    while message is None:
+      data = self.sock.recv(READ_SIZE)
+      if not data:
+        raise ConnectionError("connection closed by the server")
+      self.framer.feed(data)
+      message = self.framer.next_message()
+    return decode_response(message, self.binary)
+
+  def _exchange(self, reqs):
+    try:
+      self.sock.sendall(b"".join(encode_request(req, self.binary) for req in reqs))
+      return [self._receive() for _ in reqs]
+    except Exception:
+      # the state of the connection is unknown
+      self.close()
+      raise
+
+  def pipeline(self, reqs):
+    """ sends the requests in one write and returns the responses (in the order of the requests) """
+    if self.sock is None:
+      self.connect()
+    return self._exchange(self.req_ids.assign(reqs))
+
+  def call(self, req):
+    return self.pipeline([req])[0]
+
+  def batch(self, reqs):
+    """ sends the requests as one "batch" request and returns the responses """
+    return batch_responses(self.call({"type": "batch", "requests": self.req_ids.assign(reqs)}))
+
+
+class ConnectionPool(object):
+  """
+  Thread-safe pool of persistent connections.
+
+  A request that fails on a connection taken from the pool (which the server may have closed meanwhile)
+  is sent once more on a new connection, so requests should be safe to repeat.
+  """
+
+  def __init__(self, host="localhost", port=9999, unix_socket=None, encoding="json", max_size=8, timeout=None):
+    """
+    :param max_size: maximum number of connections (callers wait for a free connection)
+    (see Connection for the other parameters)
+    """
+    self.params = dict(host=host, port=port, unix_socket=unix_socket, encoding=encoding, timeout=timeout)
+    self.idle = queue.LifoQueue()
+    self.slots = threading.BoundedSemaphore(max_size)
+
+  def _run(self, fn):
+    with self.slots:
+      try:
+        conn, reused = self.idle.get_nowait(), True
+      except queue.Empty:
+        conn, reused = Connection(**self.params), False
+      try:
+        try:
+          result = fn(conn)
+        except socket.timeout:
+          raise
+        except OSError:
+          if not reused:
+            raise
+          conn.close()
+          conn = Connection(**self.params)
+          result = fn(conn)
+      except BaseException:
+        # a connection that failed is not returned to the pool
+        conn.close()
+        raise
+      self.idle.put(conn)
+      return result
+
+  def call(self, req):
+    return self._run(lambda conn: conn.call(req))
+
+  def pipeline(self, reqs):
+    return self._run(lambda conn: conn.pipeline(reqs))
+
+  def batch(self, reqs):
+    return self._run(lambda conn: conn.batch(reqs))
+
+  def close(self):
+    """ closes the idle connections """
+    while True:
+      try:
+        self.idle.get_nowait().close()
+      except queue.Empty:
+        return
+
+
+class AsyncClient(object):
+  """
+  one persistent connection for asyncio programs;
+  concurrent calls are pipelined (sent as soon as they are made and answered in order)
+  """
+
+  def __init__(self, host="localhost", port=9999, unix_socket=None, encoding="json"):
+    self.host = host
+    self.port = port
+    self.unix_socket = unix_socket
+    self.encoding = encoding
+    self.reader = None
+    self.writer = None
+    self.framer = None
+    self.binary = False
+    self.lock = None  # held while connecting
+    self.drain_lock = None
+    self.pending = collections.deque()  # futures of the responses, in the order of the requests
+    self.receiver = None  # task that reads the responses
+    self.req_ids = _RequestIds()
+
+  async def connect(self):
+    if self.unix_socket:
+      self.reader, self.writer = await asyncio.open_unix_connection(self.unix_socket)
+    else:
+      self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+    self.framer = wire_protocol.LineBuffer(MAX_MESSAGE, accept_unterminated=False)
+    self.binary = False
+    if self.encoding != "json":
+      try:
+        self.writer.write(encode_request(hello_request(self.encoding), False))
+        await self.writer.drain()
+        resp = await self._receive()
+      except Exception:
+        self.close()
+        raise
+      if resp.get("status") != "OK":
+        self.close()
+      check_hello(resp, self.encoding)
+      self.framer = wire_protocol.FrameBuffer(MAX_MESSAGE, self.framer.take_rest())
+      self.binary = self.encoding == "binary"
+    self.receiver = asyncio.ensure_future(self._receive_responses())
+
+  def close(self, error=None):
+    if self.writer is not None:
+      self.writer.close()
+    self.reader = self.writer = None
+    if self.receiver is not None:
+      self.receiver.cancel()
+    self.receiver = None
+    while self.pending:
+      future = self.pending.popleft()
+      if not future.done():
+        future.set_exception(error or ConnectionError("connection closed"))
+
+  async def _receive(self):
+    message = self.framer.next_message()
+    while message is None:
+      data = await self.reader.read(READ_SIZE)
+      if not data:
+        raise ConnectionError("connection closed by the server")
+      self.framer.feed(data)
+      message = self.framer.next_message()
+    return decode_response(message, self.binary)
+
+  async def _receive_responses(self):
+    try:
+      while True:
+        resp = await self._receive()
+        if not self.pending:
+          raise ClientError("unexpected response: {}".format(resp))
+        future = self.pending.popleft()
+        if not future.done():
+          future.set_result(resp)
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      # also when the server closes an idle connection (the next call reconnects)
+      self.receiver = None  # not cancelled by close
+      self.close(e)
+
+  async def pipeline(self, reqs):
+    if self.lock is None:
+      self.lock = asyncio.Lock()
+      self.drain_lock = asyncio.Lock()
+    async with self.lock:
+      if self.writer is None:
+        await self.connect()
+    reqs = self.req_ids.assign(reqs)
+    loop = asyncio.get_event_loop()
+    futures = [loop.create_future() for _ in reqs]
+    # the write and the futures are queued together, so that the responses are matched in order
+    self.writer.write(b"".join(encode_request(req, self.binary) for req in reqs))
+    self.pending.extend(futures)
+    try:
+      # concurrent drains of one stream are not allowed before Python 3.10
+      async with self.drain_lock:
+        if self.writer is not None:
+          await self.writer.drain()
+    except Exception as e:
+      self.close(e)
+    return [await future for future in futures]
+
+  async def call(self, req):
+    return (await self.pipeline([req]))[0]
+
+  async def batch(self, reqs):
+    return batch_responses(await self.call({"type": "batch", "requests": self.req_ids.assign(reqs)}))
@@ -35,7 +35,6 @@ from sosdb import Sos
 from numsos.DataSource import SosDataSource
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 class EmptyDatabaseError(Exception):
@@ -94,6 +93,30 @@ class Recorder(_Recorder):
       with self.gDB_lock:
         return record[2:6]
 
+  def getRecords(self, keys):
+    """
+    Looks up several records at once (with one acquisition of the lock)
+    :param keys: iterable of (variety_id, param) tuples
+    :return: dictionary {(variety_id, param): record or None}
+    """
+    found = [(k, self.key_attr.find(self.key_attr.key(*k))) for k in keys]
+    with self.gDB_lock:
+      return {k: record[2:6] if record else None for k, record in found}
+
+  def loadRecords(self):
+    """
+    Reads all records
+    :return: list of (variety_id, param, avg, var, w_count, w_sum) tuples
+    """
+    records = []
+    with self.gDB_lock:
+      it = self.key_attr.attr_iter()
+      found = it.begin()
+      while found:
+        records.append(tuple(it.item()[0:6]))
+        found = it.next()
+    return records
+
   def saveRecord(self, variety_id, param, avg, var, w_count, w_sum):
     logger.debug("saving variety_id: \"%s\", parameter: \"%s\", avg: %f, var: %f, count: %f, sum: %f",
                  variety_id, param, avg, var, w_count, w_sum)
@@ -151,7 +174,7 @@ class CanaryStore(_Recorder):
         total += np.sum(data.array('value'))
         count += data.get_series_size()
         data = self.src.get_results(limit=limit, reset=False)
-    logger.debug("Read {} canary records for the interval {}-{}".format(count, st, et))
+    logger.debug("Read %d canary records for the interval %s-%s", count, st, et)
     if count >= 2:
       return total/count
 
@@ -163,5 +186,5 @@ class CanaryStore(_Recorder):
     # increase wiggle time and repeat
     if wiggle_time <= 0:
       raise EmptyDatabaseError("No records to calculate canary average and non-positive wiggle time ({})".format(wiggle_time))
-    logger.debug("Increasing wiggle time ({}) for the interval {}-{}".format(wiggle_time, start_time, end_time))
+    logger.debug("Increasing wiggle time (%s) for the interval %s-%s", wiggle_time, start_time, end_time)
     return self.getAverageValue(start_time, end_time, 2*wiggle_time, limit)
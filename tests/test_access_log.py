@@ -0,0 +1,54 @@
+'''
+Tests for access_log.py
+
+'''
+import context
+
+import logging
+import unittest
+
+from access_log import AccessLog
+
+
+class ListHandler(logging.Handler):
+
+  def __init__(self):
+    super().__init__()
+    self.messages = []
+
+  def emit(self, record):
+    self.messages.append(record.getMessage())
+
+
+class TestAccessLog(unittest.TestCase):
+
+  def setUp(self):
+    self.handler = ListHandler()
+
+  def tearDown(self):
+    self.access_log.stop()
+    self.access_log.logger.removeHandler(self.access_log.queue_handler)
+
+  def test_sampling(self):
+    self.access_log = AccessLog(self.handler, sample_rate=0.0, ring_size=3)
+    for i in range(5):
+      self.access_log.record("local", i, "usage", "OK", 1e-3)
+    self.access_log.stop()
+    self.assertEqual(self.handler.messages, [])
+    self.assertEqual([entry["req_id"] for entry in self.access_log.last()], [2, 3, 4])
+    self.assertEqual([entry["req_id"] for entry in self.access_log.last(1)], [4])
+    self.assertEqual(self.access_log.last(0), [])
+
+  def test_errors(self):
+    self.access_log = AccessLog(self.handler, sample_rate=1.0, error_interval=3600)
+    self.access_log.record("local", 1, "usage", "OK", 1e-3)
+    for i in range(3):
+      self.access_log.record("local", 2, "batch", "error", 1e-3)
+    self.access_log.stop()
+    self.assertEqual(self.handler.messages, ["local req_id=1 type=usage status=OK time_ms=1.000",
+                                             "local req_id=2 type=batch status=error time_ms=1.000"])
+    self.assertEqual(self.access_log.suppressed_errors, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,73 @@
+'''
+Tests for admission.py
+
+'''
+import context
+
+import threading
+import unittest
+
+from admission import AdmissionControl, Lane
+
+
+class TestLane(unittest.TestCase):
+
+  def test_capacity(self):
+    lane = Lane("heavy", max_running=1, max_waiting=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+      started.set()
+      release.wait()
+      return "done"
+
+    self.assertTrue(lane.admit())
+    running = threading.Thread(target=lane.run, args=(slow,))
+    running.start()
+    started.wait()
+    self.assertTrue(lane.admit())
+    waiting_result = []
+    waiting = threading.Thread(target=lambda: waiting_result.append(lane.run(lambda: "waited")))
+    waiting.start()
+    # one running and one waiting: the lane is full
+    self.assertFalse(lane.admit())
+    release.set()
+    running.join()
+    waiting.join()
+    self.assertEqual(waiting_result, ["waited"])
+    self.assertTrue(lane.admit())
+    self.assertEqual(lane.run(lambda: 1), 1)
+    self.assertEqual(lane.stats()["rejected"], 1)
+    self.assertEqual(lane.stats()["admitted"], 0)
+
+  def test_unlimited(self):
+    lane = Lane("default")
+    for _ in range(100):
+      self.assertTrue(lane.admit())
+    self.assertEqual(lane.stats()["admitted"], 100)
+
+  def test_release_on_exception(self):
+    lane = Lane("heavy", max_running=1)
+
+    def fail():
+      raise ValueError()
+
+    self.assertTrue(lane.admit())
+    with self.assertRaises(ValueError):
+      lane.run(fail)
+    self.assertTrue(lane.admit())
+
+
+class TestAdmissionControl(unittest.TestCase):
+
+  def test_lanes(self):
+    admission = AdmissionControl({"heavy": {"types": ["analyze_job"], "max_running": 2}})
+    self.assertEqual(admission.lane("analyze_job").name, "heavy")
+    self.assertEqual(admission.lane("usage").name, "default")
+    self.assertEqual(admission.lane(["analyze_job"]).name, "default")
+    self.assertEqual(set(admission.stats()), {"heavy", "default"})
+
+
+if __name__ == "__main__":
+  unittest.main()
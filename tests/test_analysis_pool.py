@@ -0,0 +1,101 @@
+'''
+Tests for analysis_pool.py
+
+'''
+import context
+
+import threading
+import time
+import unittest
+
+from analysis_pool import AnalysisPool, BusyError
+
+
+class TestAnalysisPool(unittest.TestCase):
+
+  def setUp(self):
+    self.datasources = []
+    self.calls = []
+    self.release = threading.Event()
+    self.release.set()
+    self.release_slow = threading.Event()
+
+  def make_datasource(self):
+    self.datasources.append(object())
+    return self.datasources[-1]
+
+  def analyze(self, datasource, key):
+    self.release.wait()
+    if key == "slow":
+      self.release_slow.wait(5)
+    self.calls.append((datasource, key))
+    if key == "fail":
+      raise ValueError("fail")
+    return key * 2
+
+  def make_pool(self, **kwargs):
+    params = dict(n_workers=1, max_pending=2, ttl=60, max_results=10)
+    params.update(kwargs)
+    return AnalysisPool(self.analyze, self.make_datasource, **params)
+
+  def test_results_are_kept(self):
+    pool = self.make_pool()
+    entry = pool.submit(3)
+    self.assertIs(pool.get(entry.handle, timeout=5), entry)
+    self.assertEqual(entry.result, 6)
+    self.assertIs(pool.submit(3), entry)
+    pool.submit(4).done.wait(5)
+    self.assertEqual([key for _, key in self.calls], [3, 4])
+    # the worker reuses its data source
+    self.assertEqual(len(self.datasources), 1)
+    self.assertEqual(pool.stats()["hits"], 1)
+
+  def test_expiry(self):
+    pool = self.make_pool(ttl=0)
+    entry = pool.submit(3)
+    entry.done.wait(5)
+    time.sleep(0.01)
+    self.assertIsNone(pool.get(entry.handle))
+    self.assertIsNot(pool.submit(3), entry)
+
+  def test_expiry_behind_pending(self):
+    pool = self.make_pool(n_workers=2, max_pending=10, ttl=0, max_results=2)
+    slow = pool.submit("slow")
+    entries = [pool.submit(key) for key in range(5)]
+    for entry in entries:
+      entry.done.wait(5)
+    time.sleep(0.01)
+    # a pending analysis does not keep the finished ones behind it
+    pool.submit(10).done.wait(5)
+    self.assertLessEqual(len(pool.entries), 2)
+    self.assertIs(pool.get(slow.handle), slow)
+    self.release_slow.set()
+    self.assertTrue(slow.done.wait(5))
+
+  def test_failure(self):
+    pool = self.make_pool()
+    entry = pool.submit("fail")
+    entry.done.wait(5)
+    self.assertIn("fail", entry.error)
+    # failures are not kept and the data source is replaced
+    pool.submit("fail").done.wait(5)
+    self.assertEqual(len(self.calls), 2)
+    self.assertEqual(len(self.datasources), 2)
+
+  def test_busy(self):
+    pool = self.make_pool(max_pending=1)
+    self.release.clear()
+    first = pool.submit(1)
+    # wait for the worker to take the first analysis
+    while pool.queue.qsize():
+      time.sleep(0.001)
+    pool.submit(2)
+    with self.assertRaises(BusyError):
+      pool.submit(3)
+    self.assertFalse(first.done.is_set())
+    self.release.set()
+    self.assertTrue(first.done.wait(5))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,252 @@
+'''
+Tests for the scan modes of analyze_job in pysimserv3.py (with a fake data source)
+
+'''
+import context
+
+import logging
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import sys
+
+sys.modules['sosdb'] = mock.MagicMock()
+sys.modules['numsos'] = mock.MagicMock()
+sys.modules['numsos.DataSource'] = mock.MagicMock()
+
+import pysimserv3
+from reference_delta_parameter import DeltaParameter as ReferenceDeltaParameter
+
+# the columns of the indices used by the queries
+INDICES = {
+  'job_comp_time': ('job_id', 'component_id', 'timestamp'),
+  'job_time_comp': ('job_id', 'timestamp', 'component_id'),
+  'comp_time_job': ('component_id', 'timestamp', 'job_id'),
+  'time_comp_job': ('timestamp', 'component_id', 'job_id'),
+}
+
+CONDITIONS = {
+  pysimserv3.Sos.COND_EQ: np.equal,
+  pysimserv3.Sos.COND_LE: np.less_equal,
+  pysimserv3.Sos.COND_GE: np.greater_equal,
+  pysimserv3.Sos.COND_LT: np.less,
+  pysimserv3.Sos.COND_GT: np.greater,
+}
+
+
+class FakeResult(object):
+
+  def __init__(self, columns):
+    self.columns = columns
+
+  def __len__(self):
+    return len(self.columns['timestamp'])
+
+  def array(self, name):
+    return self.columns[name]
+
+
+class FakeDataSource(object):
+  """ stands in for SosDataSource: selects the records (a dict of column arrays) in the order of an index """
+
+  def __init__(self, records):
+    self.records = records
+    self.queries = []  # order_by of each select
+
+  def select(self, columns, where=None, desc=False, order_by=None):
+    self.queries.append(order_by)
+    mask = np.ones(len(self.records['timestamp']), dtype=bool)
+    for name, cond, value in where or []:
+      mask &= CONDITIONS[cond](self.records[name], value)
+    selected = {name: self.records[name][mask] for name in columns}
+    # np.lexsort sorts by the last key first
+    order = np.lexsort([self.records[name][mask] for name in reversed(INDICES[order_by])])
+    if desc:
+      order = order[::-1]
+    self.result = {name: values[order] for name, values in selected.items()}
+    self.pos = 0
+
+  def get_results(self, limit=None, reset=True):
+    if reset:
+      self.pos = 0
+    end = self.pos + limit if limit else len(self.result['timestamp'])
+    page = {name: values[self.pos:end] for name, values in self.result.items()}
+    self.pos = end
+    if not len(page['timestamp']):
+      return None
+    return FakeResult(page)
+
+
+def make_records(rng, n_nodes=6, job_id=4, period=10, gap=None):
+  """
+  records of the job (about 600 seconds): every node reports about every `period` seconds
+  with counters (that may reset)
+  :param gap: (node, start, end) - the node does not report between start and end seconds
+  """
+  t0 = np.datetime64('2024-01-01T00:00:00', 'us')
+  records = {'timestamp': [], 'component_id': [], 'job_id': [], 'user': [], 'user2': []}
+  for node in range(1, n_nodes + 1):
+    seconds = np.cumsum(rng.uniform(0.5, 2 * period, 600 // period)) + rng.uniform(0, 30)
+    if gap is not None and gap[0] == node:
+      seconds = seconds[(seconds < gap[1]) | (seconds > gap[2])]
+    user = np.cumsum(rng.randint(0, 1000, len(seconds)))
+    user[len(user) // 2:] -= user[len(user) // 2]  # a counter reset
+    records['timestamp'].append(t0 + (seconds * 1e6).astype('timedelta64[us]'))
+    records['component_id'].append(np.full(len(seconds), node))
+    records['job_id'].append(np.full(len(seconds), job_id))
+    records['user'].append(user)
+    records['user2'].append(np.cumsum(rng.randint(0, 100, len(seconds))))
+  return {name: np.concatenate(values) for name, values in records.items()}
+
+
+class AnalysisTest(unittest.TestCase):
+  """ runs the analysis with two DELTAS and small pages """
+
+  log = logging.getLogger("test_analyze_job")
+  log.setLevel(logging.ERROR)
+
+  def setUp(self):
+    getters = dict(pysimserv3.conf['DELTAS_DATA_GETTERS'], user2=pysimserv3.simple_array)
+    patcher = mock.patch.dict(pysimserv3.conf, {
+      'DELTAS': ['user', 'user2'],
+      'COLUMNS': ['timestamp', 'component_id', 'job_id', 'user', 'user2'],
+      'DELTAS_DATA_GETTERS': getters,
+      'QUERY_LIMIT': 7,
+      'grid_step': 10,
+      'grid_engine': 'numpy',
+      'use_canary': False,
+    })
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def analyze(self, records, scan, **params):
+    pysimserv3.conf['ANALYSIS_SCAN'] = scan
+    pysimserv3.conf.update(params)
+    return pysimserv3.analyze_job(FakeDataSource(records), 4, self.log)
+
+  def assertSameAnalysis(self, result, expected):
+    self.assertIsNotNone(result)
+    np.testing.assert_allclose(result[:3], expected[:3], rtol=1e-12)
+    self.assertEqual(set(result[3]), set(expected[3]))
+    for name in expected[3]:
+      np.testing.assert_allclose(result[3][name], expected[3][name], rtol=1e-9)
+
+
+class TestStreamScan(AnalysisTest):
+
+  def test_matches_bounds(self):
+    rng = np.random.RandomState(0)
+    for _ in range(5):
+      records = make_records(rng)
+      self.assertSameAnalysis(self.analyze(records, 'stream'), self.analyze(records, 'bounds'))
+
+  def test_queries(self):
+    source = FakeDataSource(make_records(np.random.RandomState(1)))
+    pysimserv3.conf['ANALYSIS_SCAN'] = 'stream'
+    pysimserv3.analyze_job(source, 4, self.log)
+    # the last record, then all records in the order of time
+    self.assertEqual(source.queries, ['job_time_comp', 'job_time_comp'])
+
+  def test_stalled_node(self):
+    rng = np.random.RandomState(2)
+    records = make_records(rng, gap=(3, 150, 400))
+    # shorter gaps are interpolated over
+    self.assertSameAnalysis(self.analyze(records, 'stream', STREAM_STALL_TIMEOUT=1000),
+                            self.analyze(records, 'bounds'))
+    # the node is finished in the gap; its later records are another node
+    split = dict(records, component_id=records['component_id'].copy())
+    seconds = (records['timestamp'] - np.datetime64('2024-01-01T00:00:00', 'us')) / np.timedelta64(1, 's')
+    split['component_id'][(records['component_id'] == 3) & (seconds > 400)] = 100
+    self.assertSameAnalysis(self.analyze(records, 'stream', STREAM_STALL_TIMEOUT=60),
+                            self.analyze(split, 'bounds'))
+
+  def test_no_records(self):
+    records = make_records(np.random.RandomState(3))
+    records['job_id'][:] = 5
+    self.assertIsNone(self.analyze(records, 'stream'))
+
+
+class TestSingleScan(AnalysisTest):
+
+  def test_matches_bounds(self):
+    rng = np.random.RandomState(5)
+    for _ in range(3):
+      records = make_records(rng)
+      for engine in ('numpy', 'python'):
+        pysimserv3.conf['grid_engine'] = engine
+        expected = self.analyze(records, 'bounds')
+        if engine == 'python':
+          # the per-record algorithm gives the same results
+          with mock.patch.object(pysimserv3, 'DeltaParameter', ReferenceDeltaParameter):
+            self.assertSameAnalysis(self.analyze(records, 'single'), expected)
+            self.assertSameAnalysis(self.analyze(records, 'bounds'), expected)
+        self.assertSameAnalysis(self.analyze(records, 'single'), expected)
+        # more records than ANALYSIS_MAX_BUFFERED: the time bounds are found first
+        self.assertSameAnalysis(self.analyze(records, 'single', ANALYSIS_MAX_BUFFERED=20), expected)
+        pysimserv3.conf['ANALYSIS_MAX_BUFFERED'] = 10 ** 6
+
+  def test_queries(self):
+    records = make_records(np.random.RandomState(6))
+    pysimserv3.conf['ANALYSIS_SCAN'] = 'single'
+    source = FakeDataSource(records)
+    pysimserv3.analyze_job(source, 4, self.log)
+    self.assertEqual(source.queries, ['job_comp_time'])
+    pysimserv3.conf['ANALYSIS_MAX_BUFFERED'] = 20
+    source = FakeDataSource(records)
+    pysimserv3.analyze_job(source, 4, self.log)
+    self.assertEqual(source.queries, ['job_comp_time', 'job_time_comp', 'job_time_comp', 'job_comp_time'])
+
+  def test_no_records(self):
+    records = make_records(np.random.RandomState(7))
+    records['job_id'][:] = 5
+    self.assertIsNone(self.analyze(records, 'single'))
+
+
+class TestAltScan(AnalysisTest):
+  """ alt_analyze_job with one time-window scan per boundary gives the same results as the point queries """
+
+  def setUp(self):
+    super().setUp()
+    patcher = mock.patch.object(pysimserv3, 'gHostList', None)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def alt_analyze(self, records, mode):
+    pysimserv3.conf['ALT_ANALYSIS'] = mode
+    source = FakeDataSource(records)
+    message = pysimserv3.Message(0, 4, "v", '2024-01-01T00:01:00', '2024-01-01T00:08:00', "1-9")
+    return pysimserv3.alt_analyze_job(source, message, self.log), source.queries
+
+  def test_matches_points(self):
+    rng = np.random.RandomState(4)
+    t0 = np.datetime64('2024-01-01T00:00:00', 'us')
+    for _ in range(3):
+      records = make_records(rng, n_nodes=8)
+      seconds = (records['timestamp'] - t0) / np.timedelta64(1, 's')
+      # node 2 reports exactly at the job start and node 3 exactly at the end (one second after job_end)
+      for node, boundary in ((2, 60), (3, 481)):
+        nearest = np.argmin(np.where(records['component_id'] == node, np.abs(seconds - boundary), np.inf))
+        records['timestamp'][nearest] = t0 + np.timedelta64(boundary, 's')
+      # node 7 reports every 100 seconds (not within ALT_SCAN_WINDOW of the boundaries)
+      # and node 8 stops reporting early: both fall back to the point queries; node 9 has no records
+      keep = (records['component_id'] != 7) & ((records['component_id'] != 8) | (seconds < 200))
+      records = {name: values[keep] for name, values in records.items()}
+      sparse = np.arange(5, 700, 100)
+      records['timestamp'] = np.concatenate((records['timestamp'], t0 + (sparse * 1e6).astype('timedelta64[us]')))
+      records['component_id'] = np.concatenate((records['component_id'], np.full(len(sparse), 7)))
+      records['job_id'] = np.concatenate((records['job_id'], np.full(len(sparse), 4)))
+      for name in ('user', 'user2'):
+        records[name] = np.concatenate((records[name], np.cumsum(rng.randint(0, 10000, len(sparse)))))
+
+      points, points_queries = self.alt_analyze(records, 'points')
+      scan, scan_queries = self.alt_analyze(records, 'scan')
+      self.assertSameAnalysis(scan, points)
+      self.assertEqual(len(points_queries), 4 * 9)
+      # two scans and the point queries of nodes 7, 8 and 9
+      self.assertEqual(scan_queries, 2 * ['time_comp_job'] + 4 * 3 * ['comp_time_job'])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,181 @@
+'''
+Tests for combined_queue.py
+
+'''
+import context
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import combined_queue
+from combined_queue import CombinedQueue, DirectoryWatch, external_put
+from message import Message
+
+
+class TestCombinedQueue(unittest.TestCase):
+
+  def test_due_order(self):
+    q = CombinedQueue()
+    now = time.time()
+    q.put(Message(now + 0.2, 1, "v"))
+    q.put(Message(now - 1, 2, "v"))
+    q.put(Message(now + 0.1, 3, "v"))
+    self.assertEqual([q.get().job_id for _ in range(3)], [2, 3, 1])
+    self.assertGreaterEqual(time.time(), now + 0.2)
+    self.assertTrue(q.empty())
+
+  def test_get_timeout(self):
+    q = CombinedQueue()
+    q.put(Message(time.time() + 10, 1, "v"))
+    with self.assertRaises(queue.Empty):
+      q.get(timeout=0.1)
+    self.assertEqual(q.qsize(), 1)
+
+  def test_wakes_on_put(self):
+    q = CombinedQueue()
+    q.put(Message(time.time() + 10, 1, "v"))
+    threading.Timer(0.1, q.put, (Message(time.time(), 2, "v"),)).start()
+    start = time.time()
+    self.assertEqual(q.get(timeout=5).job_id, 2)
+    self.assertLess(time.time() - start, 1)
+
+  def test_file_queue(self):
+    path = tempfile.mkdtemp()
+    q = CombinedQueue(path, poll_interval=0.05)
+    try:
+      q.put(Message(time.time() + 0.5, 1, "v"))
+      external_put(path, 2, "v", 0)
+      m = q.get(timeout=5)
+      self.assertEqual((m.job_id, m.attempts), (2, 0))
+      external_put(path, 3, "v", 0)
+      self.assertEqual(q.get(timeout=5).job_id, 3)
+      self.assertEqual(q.get(timeout=5).job_id, 1)
+    finally:
+      q.close()
+      shutil.rmtree(path)
+
+
+class TestFileQueue(unittest.TestCase):
+
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.path)
+
+  def queue(self, **params):
+    q = CombinedQueue(self.path, **params)
+    self.addCleanup(q.close)
+    return q
+
+  def wait_for(self, condition):
+    deadline = time.time() + 5
+    while not condition():
+      self.assertLess(time.time(), deadline)
+      time.sleep(0.01)
+
+  def test_kept_on_disk_until_due(self):
+    external_put(self.path, 1, "v", 60)
+    q = self.queue(poll_interval=0.05)
+    with self.assertRaises(queue.Empty):
+      q.get(timeout=0.2)
+    self.assertEqual(q.qsize(), 1)
+    self.assertEqual(len(os.listdir(self.path)), 1)
+    q.close()
+    # the server is restarted: the message is still there
+    external_put(self.path, 2, "v", 0)
+    q = self.queue(poll_interval=0.05)
+    self.assertEqual(q.get(timeout=5).job_id, 2)
+    self.assertEqual(len(os.listdir(self.path)), 1)
+    self.assertEqual(q.stats()["queued"], 1)
+
+  def test_wakes_on_new_file(self):
+    watch = DirectoryWatch(self.path)
+    watch.close()
+    if watch.wakeup is None:
+      self.skipTest("inotify is not available")
+    # the directory is not polled
+    q = self.queue(poll_interval=60)
+    with self.assertRaises(queue.Empty):
+      q.get(timeout=0.1)
+    threading.Timer(0.1, external_put, (self.path, 1, "v", 0)).start()
+    start = time.time()
+    self.assertEqual(q.get(timeout=5).job_id, 1)
+    self.assertLess(time.time() - start, 1)
+    start = time.time()
+    q.close()
+    self.assertLess(time.time() - start, 1)
+
+  def test_polling(self):
+    with mock.patch.object(combined_queue, "inotify_watch", return_value=None):
+      q = self.queue(poll_interval=0.05)
+      q.start()
+    self.assertIsNone(q.watch.fd)
+    threading.Timer(0.1, external_put, (self.path, 1, "v", 0)).start()
+    self.assertEqual(q.get(timeout=5).job_id, 1)
+
+  def test_duplicate_file_message(self):
+    q = self.queue(poll_interval=0.05)
+    q.put(Message(time.time() + 60, 1, "v"))
+    external_put(self.path, 1, "v", 0)
+    external_put(self.path, 2, "v", 0)
+    self.assertEqual(q.get(timeout=5).job_id, 2)
+    self.wait_for(lambda: not os.listdir(self.path))
+    self.assertEqual(q.stats()["duplicates"], 1)
+    self.assertEqual(q.qsize(), 1)
+
+  def test_taken_by_another_reader(self):
+    external_put(self.path, 1, "v", 0.5)
+    q = self.queue(poll_interval=0.05)
+    q.start()
+    self.wait_for(lambda: q.qsize() == 1)
+    os.remove(os.path.join(self.path, os.listdir(self.path)[0]))
+    with self.assertRaises(queue.Empty):
+      q.get(timeout=1)
+    self.assertTrue(q.empty())
+
+
+class TestDuplicates(unittest.TestCase):
+
+  def test_pending_duplicate_is_merged(self):
+    q = CombinedQueue()
+    self.assertTrue(q.put(Message(time.time(), 1, "v")))
+    self.assertFalse(q.put(Message(time.time(), 1, "v", "start", "end", "nodes")))
+    m = q.get()
+    self.assertEqual((m.job_start, m.job_end, m.job_nodes), ("start", "end", "nodes"))
+    # being processed
+    self.assertFalse(q.put(Message(time.time(), 1, "v")))
+    self.assertEqual(q.stats()["duplicates"], 2)
+
+  def test_retry_and_done(self):
+    q = CombinedQueue()
+    q.put(Message(time.time(), 1, "v"))
+    m = q.get()
+    self.assertTrue(q.put(m))
+    # done for the previous try is ignored while the message is queued again
+    q.done(m)
+    self.assertFalse(q.put(Message(time.time(), 1, "v")))
+    self.assertIs(q.get(), m)
+    q.done(m)
+    self.assertFalse(q.put(Message(time.time(), 1, "v")))
+    self.assertTrue(q.empty())
+    self.assertEqual(q.stats()["completed"], 1)
+
+  def test_completed_expire(self):
+    q = CombinedQueue(completed_ttl=0.1, max_completed=2)
+    for job_id in range(3):
+      q.put(Message(time.time(), job_id, "v"))
+      q.done(q.get())
+    self.assertEqual(q.stats()["completed"], 2)
+    self.assertTrue(q.put(Message(time.time(), 0, "v")))
+    self.assertFalse(q.put(Message(time.time(), 2, "v")))
+    time.sleep(0.2)
+    self.assertTrue(q.put(Message(time.time(), 2, "v")))
+
+
+if __name__ == "__main__":
+  unittest.main()
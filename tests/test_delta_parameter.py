@@ -0,0 +1,160 @@
+'''
+Tests for delta_parameter_totalized.py
+
+'''
+import context
+
+import logging
+import unittest
+
+import numpy as np
+
+from delta_parameter_totalized import DeltaParameter, MultiDeltaParameter, StreamingDeltaParameter
+from reference_delta_parameter import DeltaParameter as ReferenceDeltaParameter
+
+
+def make_nodes(rng, n_nodes=5):
+  """ :return: list of random nodes (node, timestamps, counter values with resets) """
+  nodes = []
+  for node in range(n_nodes):
+    n = rng.randint(2, 200)
+    timestamps = 1000 + np.cumsum(rng.uniform(0.5, 40, n)) - rng.uniform(0, 30)
+    values = np.cumsum(rng.randint(0, 10000, n)).astype(float)
+    # counter resets
+    for reset in rng.randint(1, n, 2):
+      values[reset:] -= values[reset] - rng.randint(0, 100)
+    nodes.append((node, timestamps, values))
+  return nodes
+
+
+class TestSameNodeBatch(unittest.TestCase):
+
+  log = logging.getLogger("test_delta_parameter")
+  log.setLevel(logging.ERROR)
+
+  def analyze(self, nodes, batch, chunk=None):
+    """ :param batch: whether to use same_node_batch (or the per-record same_node of the reference) """
+    delta_param = (DeltaParameter if batch else ReferenceDeltaParameter)(1000, 3000, 10, self.log)
+    for i, (node, timestamps, values) in enumerate(nodes):
+      if i == 0:
+        delta_param.init_node(timestamps[0], values[0], node)
+      else:
+        delta_param.new_node(timestamps[0], values[0], node)
+      if batch:
+        for start in range(1, len(timestamps), chunk):
+          delta_param.same_node_batch(timestamps[start:start + chunk], values[start:start + chunk])
+      else:
+        for timestamp, value in zip(timestamps[1:], values[1:]):
+          delta_param.same_node(timestamp, value)
+    return delta_param.finish_all(), delta_param.t_profile, delta_param.total
+
+  def test_matches_reference(self):
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+      nodes = make_nodes(rng)
+      expected = self.analyze(nodes, False)
+      for chunk in (1, 7, 1000):
+        result = self.analyze(nodes, True, chunk)
+        np.testing.assert_allclose(result[0], expected[0], rtol=1e-9)
+        np.testing.assert_allclose(result[1], expected[1], rtol=1e-9, atol=1e-6)
+        self.assertAlmostEqual(result[2], expected[2])
+
+  def test_empty_batch(self):
+    delta_param = DeltaParameter(0, 100, 10, self.log)
+    delta_param.init_node(5, 0, "node")
+    delta_param.same_node_batch([], [])
+    delta_param.same_node_batch([25], [20])
+    self.assertEqual(list(delta_param.t_profile[:2]), [0.5, 1])
+
+
+class TestMultiDeltaParameter(unittest.TestCase):
+
+  log = TestSameNodeBatch.log
+
+  def test_matches_reference(self):
+    rng = np.random.RandomState(1)
+    for _ in range(10):
+      nodes = []
+      for node, timestamps, values in make_nodes(rng):
+        # a counter without resets and one that resets often
+        other = np.cumsum(rng.randint(0, 100, len(values))).astype(float)
+        nodes.append((node, timestamps, np.array([values, other, other % 1000])))
+      multi = MultiDeltaParameter(1000, 3000, 10, 3, self.log)
+      # the per-record algorithm, metric by metric
+      singles = [ReferenceDeltaParameter(1000, 3000, 10, self.log) for _ in range(3)]
+      for i, (node, timestamps, values) in enumerate(nodes):
+        if i == 0:
+          multi.init_node(timestamps[0], values[:, 0], node)
+        else:
+          multi.new_node(timestamps[0], values[:, 0], node)
+        multi.same_node(timestamps[1], values[:, 1])
+        multi.same_node_batch(timestamps[2:], values[:, 2:])
+        for metric, single in enumerate(singles):
+          if i == 0:
+            single.init_node(timestamps[0], values[metric, 0], node)
+          else:
+            single.new_node(timestamps[0], values[metric, 0], node)
+          for timestamp, value in zip(timestamps[1:], values[metric, 1:]):
+            single.same_node(timestamp, value)
+      results = multi.finish_all()
+      for metric, single in enumerate(singles):
+        np.testing.assert_allclose(results[metric], single.finish_all(), rtol=1e-9)
+        np.testing.assert_allclose(multi.t_profile[metric], single.t_profile, rtol=1e-9, atol=1e-6)
+        self.assertAlmostEqual(multi.total[metric], single.total)
+
+
+class TestStreamingDeltaParameter(unittest.TestCase):
+
+  log = TestSameNodeBatch.log
+
+  def make_records(self, rng, n_nodes=6):
+    """ :return: list of nodes (node, timestamps, values) and their records in the order of time """
+    nodes = []
+    for node, timestamps, values in make_nodes(rng, n_nodes):
+      other = np.cumsum(rng.randint(0, 100, len(values))).astype(float)
+      nodes.append((node, timestamps, np.array([values, other])))
+    timestamps = np.concatenate([n[1] for n in nodes])
+    names = np.concatenate([[n[0]] * len(n[1]) for n in nodes])
+    values = np.concatenate([n[2] for n in nodes], axis=1)
+    order = np.argsort(timestamps, kind='stable')
+    return nodes, timestamps[order], names[order], values[:, order]
+
+  def test_matches_multi(self):
+    rng = np.random.RandomState(2)
+    for _ in range(10):
+      nodes, timestamps, names, values = self.make_records(rng)
+      start, end = timestamps.min(), timestamps.max()
+      multi = MultiDeltaParameter(start, end, 10, 2, self.log)
+      for i, (node, node_timestamps, node_values) in enumerate(nodes):
+        if i == 0:
+          multi.init_node(node_timestamps[0], node_values[:, 0], node)
+        else:
+          multi.new_node(node_timestamps[0], node_values[:, 0], node)
+        multi.same_node_batch(node_timestamps[1:], node_values[:, 1:])
+      stream = StreamingDeltaParameter(start, end, 10, 2, 1e9, self.log)
+      for page in range(0, len(timestamps), 50):
+        stream.add_records(timestamps[page:page + 50], names[page:page + 50], values[:, page:page + 50])
+      np.testing.assert_allclose(stream.finish_all(), multi.finish_all(), rtol=1e-9)
+      np.testing.assert_allclose(stream.total, multi.total)
+      self.assertEqual(stream.n_nodes, len(nodes))
+      self.assertEqual(stream.n_finished, multi.n_points)
+
+  def test_bounded_memory(self):
+    # one node stops reporting early: it is finished after the stall timeout
+    step, n = 10, 20000
+    timestamps = np.repeat(np.arange(n, dtype=float), 2)
+    names = np.tile([1, 2], n)
+    values = np.tile(np.repeat(np.arange(n, dtype=float), 2), (1, 1))
+    keep = (names == 1) | (timestamps < 100)
+    stream = StreamingDeltaParameter(0, n - 1, step, 1, 60, self.log)
+    for page in range(0, np.count_nonzero(keep), 4096):
+      stream.add_records(timestamps[keep][page:page + 4096], names[keep][page:page + 4096],
+                         values[:, keep][:, page:page + 4096])
+    (avg, var), = stream.finish_all()
+    self.assertLess(stream.max_pending, 1000)
+    self.assertEqual(stream.n_finished, stream.n_points)
+    self.assertAlmostEqual(stream.total[0], (n - 1) + 99)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,162 @@
+'''
+Tests for the negotiation of the encoding with "hello" (both server modes)
+
+'''
+import context
+
+import asyncio
+import json
+import socket
+import socketserver
+import threading
+import time
+import unittest
+from unittest import mock
+
+import sys
+
+sys.modules['sosdb'] = mock.MagicMock()
+sys.modules['numsos'] = mock.MagicMock()
+sys.modules['numsos.DataSource'] = mock.MagicMock()
+
+import pysimserv3
+import wire_protocol
+
+
+class Client(object):
+  """ a raw connection: JSON lines until the framing is switched to binary frames """
+
+  def __init__(self, port):
+    self.sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    self.framer = wire_protocol.LineBuffer(1 << 20, accept_unterminated=False)
+    self.binary = False
+
+  def send(self, data):
+    self.sock.sendall(data)
+
+  def receive(self):
+    """ :return: the next decoded response """
+    message = self.framer.next_message()
+    while message is None:
+      data = self.sock.recv(4096)
+      if not data:
+        raise ConnectionError("closed")
+      self.framer.feed(data)
+      message = self.framer.next_message()
+    return wire_protocol.decode_binary(message) if self.binary else json.loads(message)
+
+  def switch_to_binary(self):
+    self.framer = wire_protocol.FrameBuffer(1 << 20, self.framer.take_rest())
+    self.binary = True
+
+  def close(self):
+    self.sock.close()
+
+
+def usage(req_id):
+  return {"req_id": req_id, "type": "usage"}
+
+
+class EncodingTests(object):
+  """ the tests for one server mode (see start_server) """
+
+  def setUp(self):
+    self.port = self.start_server()
+
+  def connect(self):
+    client = Client(self.port)
+    self.addCleanup(client.close)
+    return client
+
+  def test_json_without_hello(self):
+    client = self.connect()
+    client.send(b'{"req_id": 1, "type": "usage"}\n{"req_id": 2, "type": "usage"}\n')
+    first, second = client.receive(), client.receive()
+    self.assertEqual((first["req_id"], second["req_id"]), (1, 2))
+    # the numbers are strings in the JSON encoding
+    self.assertIsInstance(first["response"]["lustre"], str)
+
+  def test_hello_binary(self):
+    client = self.connect()
+    # the binary frames follow the hello in the same write
+    client.send(b'{"req_id": "h", "type": "hello", "encoding": "binary"}\n'
+                + wire_protocol.encode_frame(usage(1)) + wire_protocol.encode_frame(usage(2)))
+    hello = client.receive()
+    self.assertEqual((hello["status"], hello["encoding"]), ("OK", "binary"))
+    client.switch_to_binary()
+    first, second = client.receive(), client.receive()
+    self.assertEqual((first["req_id"], second["req_id"]), (1, 2))
+    self.assertEqual(first["status"], "OK")
+    self.assertIsInstance(first["response"]["lustre"], int)
+
+    # several frames in one write, the last one split across writes
+    frames = b"".join(wire_protocol.encode_frame(usage(i)) for i in range(3, 7))
+    client.send(frames[:-5])
+    time.sleep(0.1)
+    client.send(frames[-5:])
+    self.assertEqual([client.receive()["req_id"] for _ in range(4)], [3, 4, 5, 6])
+    # a frame split within its header
+    frame = wire_protocol.encode_frame(usage(7))
+    client.send(frame[:2])
+    time.sleep(0.1)
+    client.send(frame[2:])
+    self.assertEqual(client.receive()["req_id"], 7)
+
+  def test_other_connections_stay_json(self):
+    binary = self.connect()
+    binary.send(b'{"req_id": "h", "type": "hello", "encoding": "binary"}\n')
+    binary.receive()
+    client = self.connect()
+    client.send(b'{"req_id": 1, "type": "usage"}\n')
+    resp = client.receive()
+    self.assertEqual(resp["req_id"], 1)
+    self.assertIsInstance(resp["response"]["lustre"], str)
+
+  def test_unknown_encoding(self):
+    client = self.connect()
+    client.send(b'{"req_id": "h", "type": "hello", "encoding": "xml"}\n{"req_id": 1, "type": "usage"}\n')
+    self.assertEqual(client.receive()["status"], "error")
+    self.assertEqual(client.receive()["req_id"], 1)
+
+
+class TestThreadingServer(EncodingTests, unittest.TestCase):
+
+  def start_server(self):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), pysimserv3.MyTCPHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    return server.server_address[1]
+
+
+class TestAsyncServer(EncodingTests, unittest.TestCase):
+
+  def start_server(self):
+    server = pysimserv3.AsyncServer(max_connections=8, idle_timeout=None, n_workers=2)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    listener = loop.run_until_complete(asyncio.start_server(server.handle_connection, "127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def close():
+      listener.close()
+      await listener.wait_closed()
+      # the client sockets are closed first (see connect)
+      while server.n_connections:
+        await asyncio.sleep(0.01)
+
+    def stop():
+      asyncio.run_coroutine_threadsafe(close(), loop).result(5)
+      loop.call_soon_threadsafe(loop.stop)
+      thread.join()
+      loop.close()
+      server.executor.shutdown()
+
+    self.addCleanup(stop)
+    return listener.sockets[0].getsockname()[1]
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,100 @@
+'''
+Tests for estimate_cache.py
+
+'''
+import context
+
+import unittest
+
+from estimate_cache import EstimateCache, ResponseCache
+
+
+class MockRecorder:
+
+  def __init__(self):
+    self.records = {}
+    self.reads = 0
+
+  def getRecord(self, variety_id, param):
+    self.reads += 1
+    return self.records.get((variety_id, param))
+
+  def getRecords(self, keys):
+    self.reads += 1
+    return {k: self.records.get(k) for k in keys}
+
+  def saveRecord(self, variety_id, param, avg, var, w_count, w_sum):
+    self.records[(variety_id, param)] = (avg, var, w_count, w_sum)
+
+  def loadRecords(self):
+    return [k + v for k, v in self.records.items()]
+
+
+class TestEstimateCache(unittest.TestCase):
+
+  def setUp(self):
+    self.recorder = MockRecorder()
+    self.recorder.saveRecord("v1", "user", 1.0, 2.0, 3.0, 4.0)
+    self.cache = EstimateCache(self.recorder, 2)
+
+  def test_hit_miss(self):
+    self.assertEqual(self.cache.getRecord("v1", "user"), (1.0, 2.0, 3.0, 4.0))
+    self.assertEqual(self.cache.getRecord("v1", "user"), (1.0, 2.0, 3.0, 4.0))
+    self.assertIsNone(self.cache.getRecord("v2", "user"))
+    self.assertIsNone(self.cache.getRecord("v2", "user"))
+    self.assertEqual(self.recorder.reads, 2)
+    stats = self.cache.stats()
+    self.assertEqual(stats["hits"], 2)
+    self.assertEqual(stats["misses"], 2)
+
+  def test_write_through(self):
+    self.assertIsNone(self.cache.getRecord("v2", "user"))
+    self.cache.saveRecord("v2", "user", 5.0, 6.0, 7.0, 8.0)
+    self.assertEqual(self.recorder.records[("v2", "user")], (5.0, 6.0, 7.0, 8.0))
+    self.assertEqual(self.cache.getRecord("v2", "user"), (5.0, 6.0, 7.0, 8.0))
+    self.assertEqual(self.recorder.reads, 1)
+
+  def test_lru(self):
+    self.cache.getRecord("v1", "user")
+    self.cache.getRecord("v2", "user")
+    self.cache.getRecord("v1", "user")  # v1 is now the most recently used
+    self.cache.getRecord("v3", "user")  # evicts v2
+    self.assertEqual(self.cache.stats()["evictions"], 1)
+    reads = self.recorder.reads
+    self.cache.getRecord("v1", "user")
+    self.assertEqual(self.recorder.reads, reads)
+    self.cache.getRecord("v2", "user")
+    self.assertEqual(self.recorder.reads, reads + 1)
+
+  def test_get_records(self):
+    self.cache.getRecord("v1", "user")
+    records = self.cache.getRecords([("v1", "user"), ("v2", "user")])
+    self.assertEqual(records, {("v1", "user"): (1.0, 2.0, 3.0, 4.0), ("v2", "user"): None})
+    self.assertEqual(self.recorder.reads, 2)
+
+  def test_preload(self):
+    self.assertEqual(self.cache.preload(), 1)
+    self.assertEqual(self.cache.getRecord("v1", "user"), (1.0, 2.0, 3.0, 4.0))
+    self.assertEqual(self.recorder.reads, 0)
+
+
+class TestResponseCache(unittest.TestCase):
+
+  def test_invalidate(self):
+    cache = ResponseCache(10)
+    cache.put("v1", "r1", cache.generation)
+    self.assertEqual(cache.get("v1"), "r1")
+    cache.invalidate("v1")
+    self.assertIsNone(cache.get("v1"))
+
+  def test_stale_put(self):
+    cache = ResponseCache(10)
+    generation = cache.generation
+    # the predictions change while the entry is being computed
+    cache.invalidate("v1")
+    cache.put("v1", "stale", generation)
+    self.assertIsNone(cache.get("v1"))
+
+
+if __name__ == "__main__":
+  unittest.main()
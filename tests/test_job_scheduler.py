@@ -0,0 +1,72 @@
+'''
+Tests for job_scheduler.py
+
+'''
+import context
+
+import threading
+import time
+import unittest
+
+from job_scheduler import VarietyDispatcher, retry_delay
+from message import Message
+
+
+class TestVarietyDispatcher(unittest.TestCase):
+
+  def setUp(self):
+    self.lock = threading.Lock()
+    self.processed = []
+    self.running = {}  # variety_id -> number of jobs being processed
+    self.max_running = 0
+    self.overlap = False
+
+  def process(self, datasource, message):
+    with self.lock:
+      self.running[message.variety_id] = self.running.get(message.variety_id, 0) + 1
+      self.overlap |= self.running[message.variety_id] > 1
+      self.max_running = max(self.max_running, sum(self.running.values()))
+    time.sleep(0.01)
+    with self.lock:
+      self.running[message.variety_id] -= 1
+      self.processed.append((message.variety_id, message.job_id))
+    if message.job_id == 13:
+      raise ValueError("failed")
+
+  def test_order_per_variety(self):
+    dispatcher = VarietyDispatcher(self.process, object, 4)
+    dispatcher.start()
+    for job_id in range(40):
+      dispatcher.submit(Message(0, job_id, "v{}".format(job_id % 4)))
+    self.assertTrue(dispatcher.join(10))
+    self.assertFalse(self.overlap)
+    self.assertGreater(self.max_running, 1)
+    for variety in range(4):
+      jobs = [job_id for variety_id, job_id in self.processed if variety_id == "v{}".format(variety)]
+      self.assertEqual(jobs, sorted(jobs))
+      self.assertEqual(len(jobs), 10)
+    self.assertEqual(dispatcher.stats()["pending"], 0)
+
+  def test_failure_replaces_datasource(self):
+    datasources = []
+    dispatcher = VarietyDispatcher(self.process, lambda: datasources.append(1) or object(), 1)
+    dispatcher.start()
+    for job_id in range(10, 16):
+      dispatcher.submit(Message(0, job_id, "v"))
+    self.assertTrue(dispatcher.join(10))
+    self.assertEqual([job_id for _, job_id in self.processed], list(range(10, 16)))
+    self.assertEqual(len(datasources), 2)
+
+
+class TestRetryDelay(unittest.TestCase):
+
+  def test_backoff(self):
+    self.assertEqual([retry_delay(n, 20, 2, 300) for n in range(1, 7)], [20, 40, 80, 160, 300, 300])
+
+  def test_jitter(self):
+    self.assertAlmostEqual(retry_delay(1, 20, jitter=0.1, rand=lambda: 0), 18)
+    self.assertAlmostEqual(retry_delay(2, 20, jitter=0.1, rand=lambda: 1), 44)
+
+
+if __name__ == "__main__":
+  unittest.main()
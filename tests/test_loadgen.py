@@ -0,0 +1,55 @@
+'''
+Tests for loadgen.py
+
+'''
+import context
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import loadgen
+
+
+class TestLoadgen(unittest.TestCase):
+
+  def test_percentile(self):
+    values = list(range(1, 1001))
+    self.assertEqual(loadgen.percentile(values, 50), 500)
+    self.assertEqual(loadgen.percentile(values, 99.9), 999)
+    self.assertEqual(loadgen.percentile([7], 99), 7)
+
+  def test_schedule(self):
+    requests = [(None, {"type": "usage"})] * 10
+    self.assertEqual([due for due, _ in loadgen.schedule(requests, 4, 2, 0)], [0, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75])
+    self.assertEqual(len(list(loadgen.schedule(requests, 4, 0, 3))), 3)
+    timed = [(0.0, {}), (1.0, {}), (3.0, {})]
+    self.assertEqual([due for due, _ in loadgen.schedule(timed, 0, 0, 0, speed=2)], [0, 0.5, 1.5])
+
+  def test_synthetic(self):
+    weights = loadgen.parse_mix("usage=1,job_utilization=3")
+    reqs = loadgen.synthetic_requests(weights, 10, seed=1)
+    types = [next(reqs)["type"] for _ in range(1000)]
+    self.assertEqual(set(types), {"usage", "job_utilization"})
+    self.assertGreater(types.count("job_utilization"), types.count("usage"))
+    with self.assertRaises(ValueError):
+      loadgen.parse_mix("analyze_job=1")
+
+  def test_mixed_trace_needs_rate(self):
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+      f.write(json.dumps({"time": 0.5, "request": {"type": "usage"}}) + "\n")
+      f.write(json.dumps({"type": "usage"}) + "\n")
+    self.addCleanup(os.remove, f.name)
+    self.assertEqual([t for t, _ in loadgen.read_trace(f.name)], [0.5, None])
+    with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+      loadgen.main(["--trace", f.name, "-p", "1"])
+    # with --rate, the untimed requests are sent at the rate
+    trace = loadgen.read_trace(f.name)
+    self.assertEqual([due for due, _ in loadgen.schedule(trace, 4, 0, 0)], [0.5, 0.25])
+
+
+if __name__ == "__main__":
+  unittest.main()
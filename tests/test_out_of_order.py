@@ -0,0 +1,146 @@
+'''
+Tests for the out-of-order mode of pysimserv3 (both server modes)
+
+'''
+import context
+
+import asyncio
+import json
+import socket
+import socketserver
+import threading
+import unittest
+from unittest import mock
+
+import sys
+
+sys.modules['sosdb'] = mock.MagicMock()
+sys.modules['numsos'] = mock.MagicMock()
+sys.modules['numsos.DataSource'] = mock.MagicMock()
+
+import pysimserv3
+
+
+class SlowHandler(object):
+  """ stands in for pysimserv3.handle_request; the "slow" request waits for `release` """
+
+  def __init__(self):
+    self.release = threading.Event()
+    self.started = threading.Semaphore(0)  # released by each slow request
+    self.original = pysimserv3.handle_request
+
+  def __call__(self, req, log=None, binary=False):
+    if req.get("type") == "hello":
+      return self.original(req, log, binary)
+    if str(req.get("req_id")).startswith("slow"):
+      self.started.release()
+      self.release.wait(5)
+    return {"req_id": req.get("req_id"), "status": "OK", "type": req.get("type")}
+
+
+class ServerModeTests(object):
+  """ the tests for one server mode (see start_server) """
+
+  def setUp(self):
+    self.handler = SlowHandler()
+    patcher = mock.patch.object(pysimserv3, "handle_request", self.handler)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.addCleanup(self.handler.release.set)
+    self.port = self.start_server()
+
+  def connect(self):
+    sock = socket.create_connection(("127.0.0.1", self.port), timeout=5)
+    self.addCleanup(sock.close)
+    sock.sendall(b'{"req_id": "h", "type": "hello", "out_of_order": true}\n')
+    reader = sock.makefile("rb")
+    self.assertEqual(json.loads(reader.readline())["out_of_order"], True)
+    return sock, reader
+
+  def test_fast_response_first(self):
+    sock, reader = self.connect()
+    # a type that is handled in the executor by the asyncio server
+    sock.sendall(b'{"req_id": "slow", "type": "job_utilization"}\n'
+                 b'{"req_id": "fast", "type": "job_utilization"}\n')
+    self.assertEqual(json.loads(reader.readline())["req_id"], "fast")
+    self.handler.release.set()
+    self.assertEqual(json.loads(reader.readline())["req_id"], "slow")
+
+  def test_client_gone_before_response(self):
+    sock, reader = self.connect()
+    sock.sendall(b'{"req_id": "slow", "type": "job_utilization"}\n')
+    reader.close()
+    sock.close()
+    self.handler.release.set()
+    # the server goes on serving other connections
+    sock, reader = self.connect()
+    sock.sendall(b'{"req_id": "next", "type": "job_utilization"}\n')
+    self.assertEqual(json.loads(reader.readline())["req_id"], "next")
+
+
+class TestThreadingServer(ServerModeTests, unittest.TestCase):
+
+  def start_server(self):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), pysimserv3.MyTCPHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    return server.server_address[1]
+
+  def test_usage_burst(self):
+    # more concurrent queries of the scheduler than any lane runs at once
+    n = 2 * max(lane.max_running for lane in pysimserv3.gAdmission.lanes.values())
+    readers = []
+    for i in range(n):
+      sock, reader = self.connect()
+      sock.sendall(json.dumps({"req_id": "slow{}".format(i), "type": "usage"}).encode() + b"\n")
+      readers.append(reader)
+    # all of them are handled at the same time
+    for _ in range(n):
+      self.assertTrue(self.handler.started.acquire(timeout=5))
+    self.handler.release.set()
+    for reader in readers:
+      self.assertEqual(json.loads(reader.readline())["status"], "OK")
+
+
+class TestAsyncServer(ServerModeTests, unittest.TestCase):
+
+  def start_server(self):
+    self.n_workers = 4
+    server = pysimserv3.AsyncServer(max_connections=8, idle_timeout=None, n_workers=self.n_workers)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    listener = loop.run_until_complete(asyncio.start_server(server.handle_connection, "127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def close():
+      listener.close()
+      await listener.wait_closed()
+      # the client sockets are closed first (see connect)
+      while server.n_connections:
+        await asyncio.sleep(0.01)
+
+    def stop():
+      asyncio.run_coroutine_threadsafe(close(), loop).result(5)
+      loop.call_soon_threadsafe(loop.stop)
+      thread.join()
+      loop.close()
+      server.executor.shutdown()
+
+    self.addCleanup(stop)
+    return listener.sockets[0].getsockname()[1]
+
+  def test_scheduler_not_held_up(self):
+    sock, reader = self.connect()
+    # more batch requests than the workers of the default lane and of the bulk lane
+    for i in range(self.n_workers + pysimserv3.gAdmission.lane("batch").max_running):
+      sock.sendall(json.dumps({"req_id": "slow{}".format(i), "type": "batch"}).encode() + b"\n")
+    sock.sendall(b'{"req_id": "fast", "type": "job_utilization"}\n')
+    self.assertEqual(json.loads(reader.readline())["req_id"], "fast")
+    self.handler.release.set()
+
+
+if __name__ == "__main__":
+  unittest.main()
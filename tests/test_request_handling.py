@@ -0,0 +1,224 @@
+'''
+Tests for the request handlers of pysimserv3.py (with a fake recorder)
+
+'''
+import context
+
+import json
+import unittest
+from unittest import mock
+
+import sys
+
+sys.modules['sosdb'] = mock.MagicMock()
+sys.modules['numsos'] = mock.MagicMock()
+sys.modules['numsos.DataSource'] = mock.MagicMock()
+
+import pysimserv3
+from combined_queue import CombinedQueue
+from estimate_cache import ResponseCache
+from server_stats import ServerStats
+
+
+class FakeRecorder(object):
+  """ stands in for the recorder of the predictions; counts the lookups """
+
+  def __init__(self):
+    self.records = {}
+    self.lookups = []  # keys of each getRecords call
+
+  def getRecord(self, variety_id, param):
+    return self.records.get((variety_id, param))
+
+  def getRecords(self, keys):
+    self.lookups.append(list(keys))
+    return {key: self.records.get(key) for key in keys}
+
+  def saveRecord(self, variety_id, param, avg, var, count, total):
+    self.records[(variety_id, param)] = (avg, var, count, total)
+
+
+class FakeSharedEstimates(FakeRecorder):
+  """ the predictions as seen by a serving process (see sync_response_cache) """
+
+  def __init__(self):
+    FakeRecorder.__init__(self)
+    self.published = 0
+
+  def generation(self):
+    return self.published
+
+
+class HandlerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.recorder = FakeRecorder()
+    for variety_id, avg in (("a", 1.0), ("b", 2.0), ("c", 3.0)):
+      self.recorder.saveRecord(variety_id, "user", avg, 0.0, 1, avg)
+      self.recorder.saveRecord(variety_id, "timelimit", 60.0, 0.0, 1, 60.0)
+    self.patch('gRecorder', self.recorder)
+    self.patch('gResponseCache', ResponseCache(100))
+    self.patch('gSharedEstimates', None)
+
+  def patch(self, name, value):
+    patcher = mock.patch.object(pysimserv3, name, value)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def request(self, req):
+    """ :return: the response as a client decodes it """
+    return json.loads(pysimserv3.encode_response(pysimserv3.serve_request(req)))
+
+
+class TestBatch(HandlerTest):
+
+  def test_req_ids(self):
+    resp = self.request({"req_id": "outer", "type": "batch", "requests": [
+      {"req_id": 1, "type": "job_utilization", "variety_id": "a"},
+      {"req_id": "x", "type": "variety_id/manual", "variety_name": "name"},
+      {"req_id": 3, "type": "job_utilization", "variety_id": "a"},
+    ]})
+    self.assertEqual((resp["req_id"], resp["status"]), ("outer", "OK"))
+    self.assertEqual([r["req_id"] for r in resp["responses"]], [1, "x", 3])
+    self.assertEqual([r["status"] for r in resp["responses"]], ["OK"] * 3)
+    self.assertEqual(resp["responses"][2]["response"], resp["responses"][0]["response"])
+
+  def test_sub_request_errors(self):
+    resp = self.request({"req_id": 0, "type": "batch", "requests": [
+      {"req_id": 1, "type": "job_utilization"},
+      "not an object",
+      {"req_id": 3, "type": "batch", "requests": []},
+      {"req_id": 4, "type": "stats"},
+      {"req_id": 5, "type": "job_utilization", "variety_id": "b"},
+    ]})
+    self.assertEqual(resp["status"], "OK")
+    responses = resp["responses"]
+    self.assertEqual([r["status"] for r in responses], ["error", "error", "error", "error", "OK"])
+    self.assertEqual([r["req_id"] for r in responses], [1, "error", 3, 4, 5])
+    self.assertIn("not allowed", responses[2]["error"])
+    self.assertIn("not allowed", responses[3]["error"])
+
+  def test_not_a_list(self):
+    resp = self.request({"req_id": 0, "type": "batch", "requests": {}})
+    self.assertEqual(resp["status"], "error")
+
+  def test_type_not_a_string(self):
+    resp = self.request({"req_id": 0, "type": "batch", "requests": [{"req_id": 1, "type": ["usage"]}]})
+    self.assertEqual([r["status"] for r in resp["responses"]], ["error"])
+
+  def test_shared_prefetch(self):
+    requests = [{"req_id": i, "type": "job_utilization", "variety_id": v} for i, v in enumerate("abcab")]
+    resp = self.request({"req_id": 0, "type": "batch", "requests": requests})
+    self.assertEqual([r["status"] for r in resp["responses"]], ["OK"] * 5)
+    # one lookup for all varieties of the batch
+    self.assertEqual(len(self.recorder.lookups), 1)
+    self.assertEqual({key[0] for key in self.recorder.lookups[0]}, set("abc"))
+    # the cached responses are not looked up again
+    self.request({"req_id": 0, "type": "batch", "requests": requests})
+    self.assertEqual(len(self.recorder.lookups), 1)
+
+  def test_stale_responses_prefetched(self):
+    # a serving process: the predictions are published by the writer process
+    shared = FakeSharedEstimates()
+    shared.records = dict(self.recorder.records)
+    self.patch('gRecorder', shared)
+    self.patch('gSharedEstimates', shared)
+    self.patch('gSharedGeneration', None)
+    requests = [{"req_id": v, "type": "job_utilization", "variety_id": v} for v in "ab"]
+    before = self.request({"req_id": 0, "type": "batch", "requests": requests})
+    shared.saveRecord("a", "user", 10.0, 0.0, 1, 10.0)
+    shared.saveRecord("b", "user", 20.0, 0.0, 1, 20.0)
+    shared.published += 1
+    shared.lookups = []
+    after = self.request({"req_id": 0, "type": "batch", "requests": requests})
+    self.assertNotEqual(after["responses"], before["responses"])
+    self.assertEqual(after["responses"][0]["response"]["lustre"],
+                     pysimserv3.format_value("user", 10.0))
+    # the dropped responses are computed from one prefetch
+    self.assertEqual(len(shared.lookups), 1)
+
+
+class TestJobUtilizationCache(HandlerTest):
+
+  def test_req_id_spliced(self):
+    first = pysimserv3.serve_request({"req_id": 1, "type": "job_utilization", "variety_id": "a"})
+    for req_id in ("two", 'with "quotes", braces {} and \\', 3.5, None, ["a", 1]):
+      resp = pysimserv3.serve_request({"req_id": req_id, "type": "job_utilization", "variety_id": "a"})
+      # the cached body is spliced with the req_id of the request
+      self.assertIsInstance(resp, pysimserv3.CachedResponse)
+      self.assertIs(resp.encoded_body, first.encoded_body)
+      decoded = json.loads(pysimserv3.encode_response(resp))
+      self.assertEqual(decoded["req_id"], req_id)
+      self.assertEqual(decoded["response"], json.loads(pysimserv3.encode_response(first))["response"])
+    self.assertEqual(len(self.recorder.lookups), 1)
+
+  def test_update_param_invalidates(self):
+    self.patch('conf', dict(pysimserv3.conf, doSaveTables=False))
+    before = self.request({"req_id": 1, "type": "job_utilization", "variety_id": "a"})
+    other = self.request({"req_id": 2, "type": "job_utilization", "variety_id": "b"})
+    pysimserv3.update_param("a", "user", 100.0, 0.0)
+    after = self.request({"req_id": 1, "type": "job_utilization", "variety_id": "a"})
+    self.assertNotEqual(after["response"]["lustre"], before["response"]["lustre"])
+    self.assertEqual(after["response"]["lustre"],
+                     pysimserv3.format_value("user", self.recorder.getRecord("a", "user")[0]))
+    # the responses of the other varieties stay cached
+    lookups = len(self.recorder.lookups)
+    self.assertEqual(self.request({"req_id": 2, "type": "job_utilization", "variety_id": "b"}), other)
+    self.assertEqual(len(self.recorder.lookups), lookups)
+
+
+class TestProcessJob(HandlerTest):
+
+  def setUp(self):
+    HandlerTest.setUp(self)
+    self.queue = CombinedQueue()
+    self.patch('gMessageQueue', self.queue)
+    patcher = mock.patch.dict(pysimserv3.conf, {'PROCESSING_DELAY': 0})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_duplicate(self):
+    req = {"req_id": 1, "type": "process_job", "job_id": "7", "variety_id": "a"}
+    resp = self.request(req)
+    self.assertEqual(resp, {"req_id": 1, "status": "ACK"})
+    # waiting to be processed
+    resp = self.request(dict(req, job_start="s", job_end="e", job_nodes="n"))
+    self.assertEqual(resp, {"req_id": 1, "status": "ACK", "duplicate": True})
+    # being processed, then processed
+    m = self.queue.get()
+    self.assertEqual(self.request(req)["duplicate"], True)
+    self.queue.done(m)
+    self.assertEqual(self.request(req)["duplicate"], True)
+    self.assertNotIn("duplicate", self.request(dict(req, job_id="8")))
+
+  def test_forwarded(self):
+    # the queue of a serving process does not know about duplicates
+    forward_queue = mock.Mock()
+    self.patch('gMessageQueue', pysimserv3.ForwardingQueue(forward_queue))
+    req = {"req_id": 1, "type": "process_job", "job_id": "7", "variety_id": "a"}
+    self.assertEqual(self.request(req), {"req_id": 1, "status": "ACK"})
+    self.assertEqual(self.request(req), {"req_id": 1, "status": "ACK"})
+    self.assertEqual(forward_queue.put.call_count, 2)
+
+
+class TestStatsTypes(HandlerTest):
+
+  def test_unknown_types(self):
+    stats = ServerStats()
+    self.patch('gStats', stats)
+    self.patch('gAccessLog', mock.Mock())
+    connection = pysimserv3.ClientConnection(("127.0.0.1", 0))
+    for req in ({"type": "usage", "request": ["lustre"]},
+                {"type": "variety_id/manual", "variety_name": "name"},
+                {"type": "variety_id/x1"}, {"type": "variety_id/x2"},
+                {"type": "no_such_type"}, {"type": ["usage"]}, {}):
+      connection.respond(req, pysimserv3.serve_request(req), 0)
+    connection.respond(None, None, 0)
+    requests = stats.report()["requests"]
+    self.assertEqual({req_type: row["count"] for req_type, row in requests.items()},
+                     {"usage": 1, "variety_id/manual": 1, "unknown": 5, "invalid": 1})
+    self.assertEqual(requests["unknown"]["errors"], 4)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,54 @@
+'''
+Tests for server_stats.py
+
+'''
+import context
+
+import unittest
+
+from server_stats import ServerStats, bucket_index, STATS_TITLES
+
+
+class TestServerStats(unittest.TestCase):
+
+  def setUp(self):
+    self.stats = ServerStats()
+
+  def test_bucket_index(self):
+    self.assertEqual(bucket_index(0), 0)
+    self.assertEqual(bucket_index(1e-6), 1)
+    self.assertEqual(bucket_index(3e-6), 2)
+    self.assertEqual(bucket_index(1000.0), 30)
+    self.assertEqual(bucket_index(1e9), 31)
+
+  def test_report(self):
+    for _ in range(98):
+      self.stats.record("usage", 10e-6)
+    self.stats.record("usage", 1e-3)
+    self.stats.record("usage", 0.5, error=True)
+    self.stats.connection_opened()
+    report = self.stats.report()
+    self.assertEqual(report["connections"], 1)
+    usage = report["requests"]["usage"]
+    self.assertEqual(usage["count"], 100)
+    self.assertEqual(usage["errors"], 1)
+    self.assertEqual(usage["p50_ms"], 16e-3)
+    self.assertEqual(usage["p99_ms"], 1024e-3)
+    self.assertEqual(usage["max_ms"], 500)
+    self.assertEqual(usage["histogram"], {"16": 98, "1024": 1, "524288": 1})
+
+  def test_dump_rows(self):
+    self.stats.record("usage", 1e-3)
+    rows, previous = self.stats.dump_rows({})
+    self.assertEqual(len(rows), 1)
+    self.assertEqual(len(rows[0]), len(STATS_TITLES))
+    self.assertEqual(rows[0][2:4], ["usage", 1])
+    self.stats.record("job_utilization", 1e-3)
+    rows, previous = self.stats.dump_rows(previous)
+    self.assertEqual([row[2] for row in rows], ["job_utilization"])
+    rows, previous = self.stats.dump_rows(previous)
+    self.assertEqual(rows, [])
+
+
+if __name__ == "__main__":
+  unittest.main()
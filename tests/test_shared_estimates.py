@@ -0,0 +1,59 @@
+'''
+Tests for shared_estimates.py
+
+'''
+import context
+
+import multiprocessing
+import unittest
+
+from shared_estimates import SharedEstimateTable
+
+
+def _read_in_child(table, published, conn):
+  published.wait()
+  conn.send((table.getRecord("v1", "user"), table.read_utilization(), table.generation()))
+
+
+class TestSharedEstimateTable(unittest.TestCase):
+
+  def setUp(self):
+    self.table = SharedEstimateTable(16, ["user"])
+
+  def test_publish(self):
+    self.assertIsNone(self.table.getRecord("v1", "user"))
+    self.assertTrue(self.table.publish_record("v1", "user", (1.0, 2.0, 3.0, 4.0)))
+    self.assertTrue(self.table.publish_record("v1", "user", (5.0, 6.0, 7.0, 8.0)))
+    self.assertEqual(self.table.getRecord("v1", "user"), (5.0, 6.0, 7.0, 8.0))
+    self.assertIsNone(self.table.getRecord("v1", "timelimit"))
+    self.assertEqual(self.table.generation(), 2)
+
+  def test_full(self):
+    n = 0
+    while self.table.publish_record("v{}".format(n), "user", (n, 0.0, 0.0, 0.0)):
+      n += 1
+    self.assertEqual(n, 14)  # MAX_LOAD of 16 slots
+    for i in range(n):
+      self.assertEqual(self.table.getRecord("v{}".format(i), "user")[0], i)
+    # existing records can still be updated
+    self.assertTrue(self.table.publish_record("v0", "user", (-1.0, 0.0, 0.0, 0.0)))
+
+  def test_other_process(self):
+    ctx = multiprocessing.get_context('fork')
+    parent_conn, child_conn = ctx.Pipe()
+    published = ctx.Event()
+    # the table is created before the fork, the records are published after
+    p = ctx.Process(target=_read_in_child, args=(self.table, published, child_conn))
+    p.start()
+    self.table.publish_record("v1", "user", (1.0, 2.0, 3.0, 4.0))
+    self.table.publish_utilization({"user": 42.0})
+    published.set()
+    record, utilization, generation = parent_conn.recv()
+    p.join()
+    self.assertEqual(record, (1.0, 2.0, 3.0, 4.0))
+    self.assertEqual(utilization, {"user": 42.0})
+    self.assertEqual(generation, 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,152 @@
+'''
+Tests for simserv_client.py (with a minimal server)
+
+'''
+import context
+
+import asyncio
+import json
+import socket
+import socketserver
+import threading
+import time
+import unittest
+
+import wire_protocol
+from simserv_client import AsyncClient, Connection, ConnectionPool
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+  """
+  responds with the request type; closes the connection after "bye";
+  holds the responses to "held" requests until three of them are received
+  """
+
+  def handle(self):
+    framer = wire_protocol.LineBuffer(1 << 20)
+    binary = False
+    held = []
+    while True:
+      data = self.request.recv(4096)
+      if not data:
+        return
+      for message in framer.read_messages(data):
+        req = wire_protocol.decode_binary(message) if binary else json.loads(message)
+        if req["type"] == "bye":
+          return
+        resp = {"req_id": req["req_id"], "status": "OK", "type": req["type"]}
+        if req["type"] == "batch":
+          resp["responses"] = [{"req_id": r["req_id"], "status": "OK"} for r in req["requests"]]
+        if req["type"] == "held":
+          held.append(resp)
+          if len(held) < 3:
+            continue
+        for resp in held or [resp]:
+          if binary:
+            self.request.sendall(wire_protocol.encode_frame(resp))
+          else:
+            self.request.sendall((json.dumps(resp) + "\n").encode())
+        held = []
+        if req["type"] == "hello":
+          binary = True
+          framer = wire_protocol.FrameBuffer(1 << 20, framer.take_rest())
+
+
+class TestClient(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), EchoHandler)
+    cls.server.daemon_threads = True
+    cls.port = cls.server.server_address[1]
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def test_pipeline(self):
+    for encoding in ("json", "binary"):
+      conn = Connection("127.0.0.1", self.port, encoding=encoding)
+      resps = conn.pipeline([{"type": "usage"}, {"req_id": "x", "type": "job_utilization"}])
+      self.assertEqual([r["type"] for r in resps], ["usage", "job_utilization"])
+      self.assertEqual(resps[1]["req_id"], "x")
+      self.assertEqual(len(conn.batch([{"type": "usage"}, {"type": "usage"}])), 2)
+      conn.close()
+
+  def test_reconnect(self):
+    conn = Connection("127.0.0.1", self.port)
+    with self.assertRaises(ConnectionError):
+      conn.call({"type": "bye"})
+    self.assertEqual(conn.call({"type": "usage"})["status"], "OK")
+    conn.close()
+
+  def test_pool_retries_closed_connection(self):
+    pool = ConnectionPool("127.0.0.1", self.port, max_size=2)
+    self.assertEqual(pool.call({"type": "usage"})["status"], "OK")
+    # the server closes the pooled connection
+    conn = pool.idle.get_nowait()
+    conn.sock.sendall(b'{"req_id": "1", "type": "bye"}\n')
+    time.sleep(0.1)
+    pool.idle.put(conn)
+    # the request is sent again on a new connection
+    self.assertEqual(pool.call({"type": "usage"})["status"], "OK")
+    self.assertIsNot(pool.idle.get_nowait(), conn)
+    pool.close()
+
+  def test_pool_closes_failed_connection(self):
+    pool = ConnectionPool("127.0.0.1", self.port, max_size=2)
+    conns = []
+
+    def fail(conn):
+      conns.append(conn)
+      conn.call({"type": "usage"})
+      raise socket.timeout()
+
+    with self.assertRaises(socket.timeout):
+      pool._run(fail)
+    self.assertIsNone(conns[0].sock)
+    self.assertTrue(pool.idle.empty())
+    pool.close()
+
+  def test_async(self):
+    async def run():
+      client = AsyncClient("127.0.0.1", self.port, encoding="binary")
+      resps = await asyncio.gather(*[client.call({"type": "usage"}) for _ in range(5)])
+      batch = await client.batch([{"type": "usage"}])
+      client.close()
+      return resps, batch
+
+    loop = asyncio.new_event_loop()
+    try:
+      resps, batch = loop.run_until_complete(run())
+    finally:
+      loop.close()
+    self.assertEqual(len({r["req_id"] for r in resps}), 5)
+    self.assertEqual(len(batch), 1)
+
+  def test_async_concurrent_calls(self):
+    async def run(encoding):
+      client = AsyncClient("127.0.0.1", self.port, encoding=encoding)
+      # the calls are sent without waiting for the responses to the previous ones
+      resps = await asyncio.wait_for(asyncio.gather(*[client.call({"req_id": i, "type": "held"}) for i in range(3)]), 5)
+      # the server closes the connection: the next call reconnects
+      with self.assertRaises(ConnectionError):
+        await client.call({"type": "bye"})
+      resp = await client.call({"type": "usage"})
+      client.close()
+      return resps, resp
+
+    for encoding in ("json", "binary"):
+      loop = asyncio.new_event_loop()
+      try:
+        resps, resp = loop.run_until_complete(run(encoding))
+      finally:
+        loop.close()
+      self.assertEqual([r["req_id"] for r in resps], [0, 1, 2])
+      self.assertEqual(resp["status"], "OK")
+
+
+if __name__ == "__main__":
+  unittest.main()
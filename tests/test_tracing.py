@@ -0,0 +1,65 @@
+'''
+Tests for tracing.py
+
+'''
+import context
+
+import time
+import unittest
+
+from tracing import NULL_SPAN, Tracer
+
+
+class ListTable:
+
+  def __init__(self):
+    self.rows = []
+
+  def log(self, row):
+    self.rows.append(row)
+
+
+class TestTracer(unittest.TestCase):
+
+  def test_disabled(self):
+    tracer = Tracer(False)
+    with tracer.span("fetch", 1) as span:
+      span.add_rows(10)
+    self.assertIs(span, NULL_SPAN)
+    self.assertEqual(tracer.last(), [])
+
+  def test_span(self):
+    table = ListTable()
+    tracer = Tracer(True, table=table)
+    with tracer.span("fetch", 7) as span:
+      time.sleep(0.01)
+      span.add_rows(10)
+    entry, = tracer.last()
+    self.assertEqual((entry["job_id"], entry["span"], entry["rows"]), (7, "fetch", 10))
+    self.assertGreaterEqual(entry["duration_ms"], 10)
+    self.assertEqual(table.rows[0][1:3], [7, "fetch"])
+
+  def test_accumulated_span(self):
+    tracer = Tracer(True)
+    span = tracer.span("grid", 1)
+    for _ in range(3):
+      span.start()
+      time.sleep(0.005)
+      span.stop(100)
+      time.sleep(0.01)
+    span.end()
+    entry, = tracer.last()
+    self.assertEqual(entry["rows"], 300)
+    self.assertGreaterEqual(entry["duration_ms"], 15)
+
+  def test_ring(self):
+    tracer = Tracer(True, ring_size=3)
+    for job_id in range(5):
+      tracer.span("job", job_id).start().end()
+    self.assertEqual([entry["job_id"] for entry in tracer.last()], [2, 3, 4])
+    self.assertEqual([entry["job_id"] for entry in tracer.last(1)], [4])
+    self.assertEqual(tracer.last(0), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,105 @@
+'''
+Tests for serving pysimserv3 over a Unix domain socket along with the TCP port
+
+'''
+import context
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import sys
+
+sys.modules['sosdb'] = mock.MagicMock()
+sys.modules['numsos'] = mock.MagicMock()
+sys.modules['numsos.DataSource'] = mock.MagicMock()
+
+import pysimserv3
+from simserv_client import Connection
+
+
+def free_port():
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+
+def connect(**params):
+  """ connects to the server that is starting """
+  conn = Connection(**params)
+  for _ in range(100):
+    try:
+      conn.connect()
+      return conn
+    except OSError:
+      time.sleep(0.05)
+  conn.connect()
+  return conn
+
+
+class TestBindUnixSocket(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.dir)
+    self.path = os.path.join(self.dir, "simserv.sock")
+
+  def test_stale_socket_file_removed(self):
+    # a previous run did not remove its socket file
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(self.path)
+    stale.close()
+    self.assertTrue(os.path.exists(self.path))
+    listener = pysimserv3.bind_unix_socket(self.path)
+    self.addCleanup(listener.close)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(self.path)
+    client.close()
+
+  def test_other_file_kept(self):
+    with open(self.path, "w") as f:
+      f.write("data")
+    with self.assertRaises(OSError):
+      pysimserv3.bind_unix_socket(self.path)
+    with open(self.path) as f:
+      self.assertEqual(f.read(), "data")
+
+
+class TestServeUnixSocket(unittest.TestCase):
+  """ the servers run until the end of the tests (in daemon threads) """
+
+  def serve(self, server_mode):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    path = os.path.join(directory, "simserv.sock")
+    port = free_port()
+    patcher = mock.patch.dict(pysimserv3.conf, {'server_mode': server_mode, 'doSaveTables': False})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    listener = pysimserv3.bind_unix_socket(path)
+    thread = threading.Thread(target=pysimserv3._start_server, args=("127.0.0.1", port, False, listener))
+    thread.daemon = True
+    thread.start()
+    # the TCP listener is up
+    over_tcp = connect(host="127.0.0.1", port=port, timeout=5)
+    over_unix = connect(unix_socket=path, timeout=5)
+    for conn in (over_unix, over_tcp, over_unix):
+      resp = conn.call({"req_id": "u", "type": "usage"})
+      self.assertEqual((resp["req_id"], resp["status"]), ("u", "OK"))
+    over_tcp.close()
+    over_unix.close()
+
+  def test_threading(self):
+    self.serve('threading')
+
+  def test_asyncio(self):
+    self.serve('asyncio')
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,85 @@
+'''
+Tests for message framing (wire_protocol.py)
+
+'''
+import context
+
+import unittest
+from unittest import mock
+
+import wire_protocol
+
+
+class TestLineBuffer(unittest.TestCase):
+
+  def setUp(self):
+    self.buffer = wire_protocol.LineBuffer(1024)
+
+  def test_pipelined(self):
+    messages = self.buffer.read_messages(b'{"req_id": 1}\n{"req_id": 2}\n')
+    self.assertEqual(messages, [b'{"req_id": 1}', b'{"req_id": 2}'])
+
+  def test_split(self):
+    self.assertEqual(self.buffer.read_messages(b'{"req_id": 1}\n{"req_'), [b'{"req_id": 1}'])
+    self.assertEqual(self.buffer.read_messages(b'id": 2'), [])
+    self.assertEqual(self.buffer.read_messages(b'}\r\n\n'), [b'{"req_id": 2}'])
+    self.assertEqual(self.buffer.buffer, b'')
+
+  def test_unterminated(self):
+    # old clients do not send a newline
+    self.assertEqual(self.buffer.read_messages(b' {"req_id": 1} '), [b'{"req_id": 1}'])
+    self.assertEqual(self.buffer.read_messages(b'\n'), [])
+
+  def test_unterminated_parsed_when_complete(self):
+    with mock.patch.object(wire_protocol.json, 'loads', wraps=wire_protocol.json.loads) as loads:
+      for chunk in (b'{"req_id": 1, ', b'"data": "', b'x' * 100, b'"', b'} '):
+        messages = self.buffer.read_messages(chunk)
+      self.assertEqual(messages, [b'{"req_id": 1, "data": "' + b'x' * 100 + b'"}'])
+      self.assertEqual(loads.call_count, 1)
+
+  def test_too_long(self):
+    self.buffer.feed(b'x' * 1000)
+    with self.assertRaises(wire_protocol.MessageTooLongError):
+      self.buffer.feed(b'x' * 100)
+    self.assertEqual(self.buffer.read_messages(b'{}\n'), [b'{}'])
+
+
+
+class TestFrameBuffer(unittest.TestCase):
+
+  def setUp(self):
+    self.buffer = wire_protocol.FrameBuffer(1000)
+
+  def test_split(self):
+    data = wire_protocol.encode_frame({"req_id": 1}) + wire_protocol.encode_frame({"req_id": 2})
+    self.assertEqual(self.buffer.read_messages(data[:3]), [])
+    messages = self.buffer.read_messages(data[3:-2])
+    self.assertEqual([wire_protocol.decode_binary(m) for m in messages], [{"req_id": 1}])
+    messages = self.buffer.read_messages(data[-2:])
+    self.assertEqual([wire_protocol.decode_binary(m) for m in messages], [{"req_id": 2}])
+    self.assertEqual(self.buffer.take_rest(), b'')
+
+  def test_too_long(self):
+    with self.assertRaises(wire_protocol.MessageTooLongError):
+      self.buffer.feed(wire_protocol.FRAME_HEADER.pack(1001))
+
+
+class TestBinaryEncoding(unittest.TestCase):
+
+  def test_round_trip(self):
+    value = {"req_id": "1", "type": "batch", "n": -5, "x": 0.25, "ok": True, "no": False, "none": None,
+             "requests": [{"nodes": 1 << 40}, [], "ünïcode"]}
+    self.assertEqual(wire_protocol.decode_binary(wire_protocol.encode_binary(value)), value)
+
+  def test_errors(self):
+    data = wire_protocol.encode_binary({"req_id": "1"})
+    with self.assertRaises(wire_protocol.DecodeError):
+      wire_protocol.decode_binary(data[:-1])
+    with self.assertRaises(wire_protocol.DecodeError):
+      wire_protocol.decode_binary(data + b'N')
+    with self.assertRaises(wire_protocol.DecodeError):
+      wire_protocol.decode_binary(b'?')
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,136 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Tracing of the job processing: spans (fetch, grid, reduce, canary, ...)
+record their duration and number of rows for each job.
+
+When tracing is disabled, span() returns a shared span that does nothing,
+so the instrumented code costs a method call per span.
+Finished spans are kept in a ring buffer and, optionally, written to a table.
+
+"""
+
+import collections
+import time
+
+SPAN_FIELDS = ("time", "job_id", "span", "duration_ms", "rows")
+
+
+class Span(object):
+  """
+  Use as a context manager, or call start()/stop() around each part
+  (e.g., each page of a query) and end() once to record the total.
+  """
+
+  __slots__ = ("tracer", "name", "job_id", "started", "duration", "rows")
+
+  def __init__(self, tracer, name, job_id):
+    self.tracer = tracer
+    self.name = name
+    self.job_id = job_id
+    self.started = None
+    self.duration = 0.0
+    self.rows = 0
+
+  def start(self):
+    self.started = time.perf_counter()
+    return self
+
+  def stop(self, rows=0):
+    self.duration += time.perf_counter() - self.started
+    self.started = None
+    self.rows += rows
+
+  def add_rows(self, rows):
+    self.rows += rows
+
+  def end(self):
+    """ records the span (stops it first if it is running) """
+    if self.started is not None:
+      self.stop()
+    self.tracer.record(self)
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.end()
+
+
+class NullSpan(object):
+  """ the span of a disabled tracer """
+
+  __slots__ = ()
+
+  def start(self):
+    return self
+
+  def stop(self, rows=0):
+    pass
+
+  def add_rows(self, rows):
+    pass
+
+  def end(self):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer(object):
+
+  def __init__(self, enabled=False, ring_size=1000, table=None):
+    """
+    :param enabled: whether the spans are recorded
+    :param ring_size: number of the last spans kept for last()
+    :param table: TableLog the spans are written to (None if not written)
+    """
+    self.enabled = enabled
+    self.ring = collections.deque(maxlen=ring_size)
+    self.table = table
+
+  def span(self, name, job_id=None):
+    if not self.enabled:
+      return NULL_SPAN
+    return Span(self, name, job_id)
+
+  def record(self, span):
+    entry = (time.time(), span.job_id, span.name, span.duration * 1000, span.rows)
+    self.ring.append(entry)
+    if self.table is not None:
+      self.table.log(list(entry))
+
+  def last(self, count=None):
+    """ returns the last spans (at most count) as dictionaries, oldest first """
+    entries = list(self.ring)
+    if count is not None:
+      entries = entries[-count:] if count > 0 else []
+    return [dict(zip(SPAN_FIELDS, entry)) for entry in entries]
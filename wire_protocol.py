@@ -0,0 +1,288 @@
+"""
+ Copyright (c) 2024 Alexander Goponenko. University of Central Florida.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining
+ a copy of this software and associated documentation files (the
+ “Software”), to deal in the Software without restriction, including
+ without limitation the rights to use, copy, modify, merge, publish,
+ distribute, sublicense, and/or sell copies of the Software, and
+ to permit persons to whom the Software is furnished to do so,
+ subject to the following conditions:
+ 
+ The above copyright notice and this permission notice shall be
+ included in all copies or substantial portions of the Software.
+ 
+ THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND,
+ EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+ OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Framing and encoding of messages of the connection protocol (see protocol.md)
+
+Two encodings are supported:
+* "json" (default): newline-terminated JSON documents;
+* "binary": frames prefixed with their length (4 bytes, big-endian),
+  each containing one value encoded with encode_binary().
+
+Both framers have the same interface: feed() adds received data,
+next_message() returns the next complete message (or None),
+take_rest() returns the data that follows the last returned message.
+
+"""
+
+import json
+import numbers
+import struct
+
+
+class MessageTooLongError(Exception):
+  pass
+
+
+class DecodeError(Exception):
+  pass
+
+
+class LineBuffer(object):
+  """
+  Splits a stream of bytes into newline-terminated messages.
+
+  Incomplete tails are kept until the rest of the message arrives,
+  so several pipelined messages may arrive in one read and
+  one message may be split between several reads.
+  """
+
+  def __init__(self, max_size, accept_unterminated=True):
+    """
+    :param max_size: maximum length of one message (in bytes)
+    :param accept_unterminated: whether to return an unterminated tail
+      that is a complete JSON document (for old clients that do not terminate messages with a newline)
+    """
+    self.max_size = max_size
+    self.accept_unterminated = accept_unterminated
+    self.buffer = b''
+
+  def feed(self, data):
+    """ adds received data to the buffer """
+    self.buffer += data
+    if len(self.buffer) - self.buffer.rfind(b'\n') - 1 > self.max_size:
+      self.buffer = b''
+      raise MessageTooLongError("message is longer than {} bytes".format(self.max_size))
+
+  def next_message(self):
+    """
+    Returns the next complete message (without the newline and surrounding whitespace) or None;
+    empty lines are skipped.
+    """
+    while True:
+      pos = self.buffer.find(b'\n')
+      if pos < 0:
+        return self.take_unterminated() if self.accept_unterminated else None
+      line = self.buffer[:pos].strip()
+      self.buffer = self.buffer[pos + 1:]
+      if line:
+        return line
+
+  def take_unterminated(self):
+    """
+    Returns the tail of the buffer if it is a complete JSON document
+    (for old clients that do not terminate messages with a newline), or None
+    """
+    # the messages are JSON objects: do not parse the tail (again) before it can be complete
+    end = len(self.buffer)
+    while end and self.buffer[end - 1] in b' \t\r\n':
+      end -= 1
+    if not end or self.buffer[end - 1] != ord('}'):
+      return None
+    tail = self.buffer.strip()
+    try:
+      json.loads(tail)
+    except ValueError:
+      return None
+    self.buffer = b''
+    return tail
+
+  def take_rest(self):
+    rest, self.buffer = self.buffer, b''
+    return rest
+
+  def read_messages(self, data):
+    """ feeds the data and returns the list of all complete messages """
+    self.feed(data)
+    messages = []
+    message = self.next_message()
+    while message is not None:
+      messages.append(message)
+      message = self.next_message()
+    return messages
+
+
+###################################################
+#
+# binary encoding
+#
+###################################################
+
+FRAME_HEADER = struct.Struct('>I')
+_INT = struct.Struct('>q')
+_FLOAT = struct.Struct('>d')
+_COUNT = struct.Struct('>I')
+_KEY_LEN = struct.Struct('>H')
+
+
+class FrameBuffer(object):
+  """ Splits a stream of bytes into length-prefixed frames """
+
+  def __init__(self, max_size, data=b''):
+    """
+    :param max_size: maximum length of one frame (in bytes)
+    :param data: data already received
+    """
+    self.max_size = max_size
+    self.buffer = b''
+    self.feed(data)
+
+  def feed(self, data):
+    """ adds received data to the buffer """
+    self.buffer += data
+    if len(self.buffer) >= FRAME_HEADER.size:
+      length = FRAME_HEADER.unpack_from(self.buffer)[0]
+      if length > self.max_size:
+        self.buffer = b''
+        raise MessageTooLongError("message is longer than {} bytes".format(self.max_size))
+
+  def next_message(self):
+    """ returns the payload of the next complete frame or None """
+    if len(self.buffer) < FRAME_HEADER.size:
+      return None
+    length = FRAME_HEADER.unpack_from(self.buffer)[0]
+    end = FRAME_HEADER.size + length
+    if len(self.buffer) < end:
+      return None
+    payload = self.buffer[FRAME_HEADER.size:end]
+    self.buffer = self.buffer[end:]
+    # check the size of the next frame
+    self.feed(b'')
+    return payload
+
+  def take_rest(self):
+    rest, self.buffer = self.buffer, b''
+    return rest
+
+  def read_messages(self, data):
+    """ feeds the data and returns the list of all complete frames """
+    self.feed(data)
+    messages = []
+    message = self.next_message()
+    while message is not None:
+      messages.append(message)
+      message = self.next_message()
+    return messages
+
+
+def _encode(value, out):
+  if value is None:
+    out.append(b'N')
+  elif value is True:
+    out.append(b'T')
+  elif value is False:
+    out.append(b'F')
+  elif isinstance(value, numbers.Integral):
+    out.append(b'i')
+    out.append(_INT.pack(value))
+  elif isinstance(value, numbers.Real):
+    out.append(b'd')
+    out.append(_FLOAT.pack(value))
+  elif isinstance(value, str):
+    data = value.encode('utf-8')
+    out.append(b's')
+    out.append(_COUNT.pack(len(data)))
+    out.append(data)
+  elif isinstance(value, (list, tuple)):
+    out.append(b'l')
+    out.append(_COUNT.pack(len(value)))
+    for item in value:
+      _encode(item, out)
+  elif isinstance(value, dict):
+    out.append(b'm')
+    out.append(_COUNT.pack(len(value)))
+    for key, item in value.items():
+      key = str(key).encode('utf-8')
+      out.append(_KEY_LEN.pack(len(key)))
+      out.append(key)
+      _encode(item, out)
+  else:
+    raise TypeError("cannot encode {}".format(type(value).__name__))
+
+
+def encode_binary(value):
+  """
+  Encodes a value made of None, bool, int (64 bit), float, str, lists and dictionaries
+  """
+  out = []
+  _encode(value, out)
+  return b''.join(out)
+
+
+def _decode(data, pos):
+  tag = data[pos:pos + 1]
+  pos += 1
+  if tag == b'N':
+    return None, pos
+  if tag == b'T':
+    return True, pos
+  if tag == b'F':
+    return False, pos
+  if tag == b'i':
+    return _INT.unpack_from(data, pos)[0], pos + _INT.size
+  if tag == b'd':
+    return _FLOAT.unpack_from(data, pos)[0], pos + _FLOAT.size
+  if tag == b's':
+    length = _COUNT.unpack_from(data, pos)[0]
+    pos += _COUNT.size
+    if pos + length > len(data):
+      raise DecodeError("truncated string")
+    return data[pos:pos + length].decode('utf-8'), pos + length
+  if tag == b'l':
+    count = _COUNT.unpack_from(data, pos)[0]
+    pos += _COUNT.size
+    value = []
+    for _ in range(count):
+      item, pos = _decode(data, pos)
+      value.append(item)
+    return value, pos
+  if tag == b'm':
+    count = _COUNT.unpack_from(data, pos)[0]
+    pos += _COUNT.size
+    value = {}
+    for _ in range(count):
+      length = _KEY_LEN.unpack_from(data, pos)[0]
+      pos += _KEY_LEN.size
+      if pos + length > len(data):
+        raise DecodeError("truncated key")
+      key = data[pos:pos + length].decode('utf-8')
+      value[key], pos = _decode(data, pos + length)
+    return value, pos
+  raise DecodeError("unknown tag {!r}".format(tag))
+
+
+def decode_binary(data):
+  """ decodes a value encoded with encode_binary """
+  try:
+    value, pos = _decode(data, 0)
+  except (struct.error, UnicodeDecodeError, RecursionError) as e:
+    raise DecodeError(str(e))
+  if pos != len(data):
+    raise DecodeError("extra data after the value")
+  return value
+
+
+def encode_frame(value):
+  """ encodes a value into a length-prefixed frame """
+  payload = encode_binary(value)
+  return FRAME_HEADER.pack(len(payload)) + payload